@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pygame
+import cengParkSimulator as simulator
+
+FRAMES = 300
+# (floors, places per floor), from the original lot to twenty thousand spots
+LOT_SIZES = ((4, 10), (10, 100), (20, 250), (40, 500))
+# The immediate-mode repaint of the original renderer is measured up to this many spots, beyond it a frame takes seconds
+IMMEDIATE_MODE_SPOTS = 1000
+
+
+def build_drawer(floors=simulator.FLOORS, places_per_floor=simulator.CARS_PER_FLOOR):
+    # Without a port the serial manager opens nothing, as for the simulated board
+    dirty_regions = simulator.DirtyRegions()
+    parking_lot = simulator.ParkingLot(floors, places_per_floor, dirty_regions)
+    car_queue = simulator.CarQueue(4 * floors, dirty_regions)
+    subscriptions = simulator.Subscriptions(places_per_floor, dirty_regions)
+    statistics = simulator.GameStatistics(dirty_regions)
+    serial_manager = simulator.SerialManager(None, 0, None, False, False, dirty_regions)
+    snapshots = simulator.SnapshotPublisher(dirty_regions, parking_lot, car_queue, subscriptions, serial_manager, statistics)
+    protocol = simulator.select_protocol(floors, places_per_floor, 5 * floors * places_per_floor // 2)
+    drawer = simulator.Drawer(simulator.SCREEN_WIDTH, simulator.SCREEN_HEIGHT, simulator.DISPLAY_WIDTH,
+                              floors, places_per_floor, simulator.SIMULATOR_CAPTION, snapshots, protocol=protocol)
+    drawer.stop()
+
+    # Half full lot, a few subscriptions and a full queue
+    for index in range(floors * places_per_floor // 2):
+        floor, spot = divmod(index * 2, places_per_floor)
+        parking_lot.park_car(floor, spot, simulator.Car(index, simulator.car_colors[index % 20], index % 7 == 0))
+    for floor in range(floors):
+        subscriptions.add_subscription(floors * places_per_floor + floor, floor, 1)
+    for index in range(car_queue.no_cars):
+        car_queue.add_car(simulator.Car(2 * floors * places_per_floor + index, simulator.car_colors[index % 20], False))
+    snapshots.publish()
+    return drawer
+
+
+def immediate_mode_layout(drawer):
+    # Spot, queue and floor letter positions of the original renderer: one column of the screen per floor
+    places_per_column = (drawer.cars_per_floor + 1) // 2
+    parking_height = places_per_column * drawer.screen_height // (places_per_column + 3)
+    queue_height = 2 * drawer.screen_height // (places_per_column + 3)
+    empty_height = drawer.screen_height - parking_height - queue_height
+    floor_width = drawer.game_area_width // drawer.floors
+    car_width, car_height = floor_width // 3, parking_height // (places_per_column * 1.2)
+    row_height = parking_height // places_per_column
+    top = parking_height // (places_per_column * 2) - car_height // 2
+    parking_spots = []
+    for floor in range(drawer.floors):
+        for index in range(drawer.cars_per_floor):
+            col, spot = divmod(index, places_per_column)
+            x = floor * floor_width + col * (floor_width // 2) + floor_width // 4 - car_width // 2 + ((2 * (col % 2) - 1) * car_width) // 6.5
+            parking_spots.append(pygame.Rect(x, spot * row_height + top, car_width, car_height))
+    queue_spots = []
+    for queue in range(2):
+        for floor in range(drawer.floors):
+            for col in range(2):
+                x = floor * floor_width + col * (floor_width // 2) + (floor_width // 4 - car_width // 2)
+                queue_spots.append(pygame.Rect(x, queue * row_height + top + empty_height + parking_height, car_width, car_height))
+    floor_character_spots = [(drawer.protocol.floor_name(floor), (floor * floor_width + floor_width // 2 - 15, parking_height // 2 - 15))
+                             for floor in range(drawer.floors)]
+    return {
+        "parking_height": parking_height, "empty_height": empty_height, "floor_width": floor_width, "car_width": car_width,
+        "parking_spots": parking_spots, "queue_spots": queue_spots, "floor_character_spots": floor_character_spots,
+        "floor_font": pygame.font.SysFont(None, 50),
+    }
+
+
+def immediate_mode_frame(drawer, layout):
+    # The original full-screen repaint: every shape and string drawn and rendered every frame
+    screen = drawer.screen
+    snapshots = drawer.snapshots
+    parking_height, floor_width = layout["parking_height"], layout["floor_width"]
+    screen.fill(drawer.black_color)
+    pygame.draw.rect(screen, drawer.gray_color, pygame.Rect(0, 0, drawer.game_area_width, drawer.screen_height))
+    for i in range(1, drawer.floors):
+        pygame.draw.line(screen, drawer.yellow_color, (i * floor_width, 0), (i * floor_width, parking_height), 5)
+    pygame.draw.line(screen, (60, 30, 20), (3 * layout["car_width"] // 2, parking_height + layout["empty_height"] - 10),
+                     (drawer.game_area_width, parking_height + layout["empty_height"] - 10), 10)
+    for park_ind in range(drawer.cars_per_floor):
+        for floor in range(drawer.floors):
+            spot = layout["parking_spots"][floor * drawer.cars_per_floor + park_ind]
+            color = drawer.white_color
+            if snapshots.subscriptions.get_subscription(floor, park_ind) is not None:
+                color = drawer.red_color
+            pygame.draw.rect(screen, color, spot, 2)
+            id_text = drawer.display_font.render(str(park_ind + 1), True, color)
+            screen.blit(id_text, id_text.get_rect(center=spot.center))
+    for queue in layout["queue_spots"]:
+        pygame.draw.rect(screen, drawer.white_color, queue, 2)
+    for char, position in layout["floor_character_spots"]:
+        screen.blit(layout["floor_font"].render(char, True, drawer.white_color), position)
+    for car, spot in zip(snapshots.parking_lot.get_1D_spots(), layout["parking_spots"]):
+        if car is not None:
+            pygame.draw.rect(screen, car[0].car_color, spot)
+            id_text = drawer.display_font.render(f"{car[0].car_id}", True, drawer.white_color)
+            screen.blit(id_text, id_text.get_rect(center=spot.center))
+    for car, queue_spot in zip(snapshots.car_queue.get_queue(), layout["queue_spots"]):
+        pygame.draw.rect(screen, car.car_color, queue_spot)
+        id_text = drawer.display_font.render(f"{car.car_id}", True, drawer.white_color)
+        screen.blit(id_text, id_text.get_rect(center=queue_spot.center))
+    labels = [f'Floor {floor + 1}: {snapshots.parking_lot.get_number_of_cars(floor)} cars' for floor in range(drawer.floors)]
+    labels += ["Time statistics:", "Average: 00.00", "Minimum: 00.00", "Maximum: 00.00", "Total Earnings:",
+               "Simulator: 000", "Received: 000", "Empty Places:", "Simulator: 20", "Received: : 00", "Status:", "RUNNING"]
+    for row, label in enumerate(labels):
+        screen.blit(drawer.display_font.render(label, True, drawer.text_color), (drawer.game_area_width + 20, 20 + row * 30))
+    pygame.display.flip()
+
+
+def draw(drawer, regions):
+    drawer._Drawer__draw(drawer.snapshots.snapshot, regions)
+
+
+def view(drawer, zoom):
+    # Zoom around the top left of the lot, then draw the whole viewport once so the caches are warm
+    drawer.fit()
+    drawer.zoom_by(zoom / drawer.fit_zoom, drawer.viewport.topleft)
+    drawer._Drawer__apply_view_requests()
+    draw(drawer, {drawer.VIEWPORT})
+
+
+def car_moves(drawer):
+    # Every frame one car leaves a spot of floor 0 and another one parks, as in a running session
+    parking_lot = drawer.snapshots.parking_lot
+    car = simulator.Car(10 ** 6, simulator.car_colors[0], False)
+    spots = [spot for spot in range(parking_lot.places_per_floor) if parking_lot.read_spot(0, spot) is None]
+    moves = 0
+
+    def frame():
+        nonlocal moves
+        parking_lot.remove_car_by_id(car.car_id)
+        parking_lot.park_car(0, spots[moves % len(spots)], car)
+        moves += 1
+        drawer.snapshots.publish()
+        draw(drawer, {simulator.DirtyRegions.floor(0), simulator.DirtyRegions.PANEL})
+    return frame
+
+
+def measure(name, function, *args):
+    times = []
+    for _ in range(FRAMES):
+        start = time.perf_counter()
+        function(*args)
+        times.append((time.perf_counter() - start) * 1000.0)
+    times.sort()
+    print(f"{name:>44}: median {times[len(times) // 2]:.3f} ms, max {times[-1]:.3f} ms")
+
+
+if __name__ == "__main__":
+    pygame.init()
+    for floors, places_per_floor in LOT_SIZES:
+        drawer = build_drawer(floors, places_per_floor)
+        print(f"{floors} floors of {places_per_floor} places, {floors * places_per_floor} spots:")
+        if floors * places_per_floor <= IMMEDIATE_MODE_SPOTS:
+            measure("immediate mode, full screen", immediate_mode_frame, drawer, immediate_mode_layout(drawer))
+        for zoom in (drawer.fit_zoom, 1.0):
+            view(drawer, zoom)
+            level = f"zoom {drawer.zoom:.2f}, {'detail' if drawer.detail else 'heat map'}"
+            measure(f"full viewport, {level}", draw, drawer, {drawer.VIEWPORT})
+            measure(f"one car moved, {level}", car_moves(drawer))
+        measure("pan", lambda: (drawer.pan(3, 2), drawer._Drawer__apply_view_requests(), draw(drawer, {drawer.VIEWPORT})))
+    pygame.quit()
@@ -0,0 +1,61 @@
+import queue
+import statistics
+import threading
+import time
+
+MESSAGE_RATE = 200
+MESSAGES = 400
+IDLE_SECONDS = 2.0
+EVENT_POLL_INTERVAL = 1 / 60
+
+
+def busy_poll(messages, latencies, running):
+    # The original main loop: check empty() and get() without ever sleeping
+    while running.is_set():
+        while not messages.empty():
+            sent = messages.get()
+            latencies.append(time.perf_counter() - sent)
+
+
+def blocking_dispatch(messages, latencies, running):
+    # GameEngine.__dispatch_messages: block with a timeout, wake up to poll UI events
+    while running.is_set():
+        deadline = time.perf_counter() + EVENT_POLL_INTERVAL
+        remaining = EVENT_POLL_INTERVAL
+        while remaining > 0:
+            try:
+                sent = messages.get(timeout=remaining)
+            except queue.Empty:
+                break
+            latencies.append(time.perf_counter() - sent)
+            remaining = deadline - time.perf_counter()
+
+
+def measure(consumer):
+    messages = queue.Queue()
+    latencies = []
+    running = threading.Event()
+    running.set()
+    thread = threading.Thread(target=consumer, args=(messages, latencies, running), daemon=True)
+    thread.start()
+
+    # Silent board
+    cpu_start = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu_start) / IDLE_SECONDS * 100.0
+
+    # Steady message stream
+    for _ in range(MESSAGES):
+        messages.put(time.perf_counter())
+        time.sleep(1 / MESSAGE_RATE)
+    time.sleep(0.1)
+
+    running.clear()
+    thread.join()
+    return idle_cpu, statistics.median(latencies) * 1e6, len(latencies)
+
+
+if __name__ == "__main__":
+    for name, consumer in (("busy poll", busy_poll), ("blocking dispatch", blocking_dispatch)):
+        idle_cpu, median_latency, handled = measure(consumer)
+        print(f"{name:>18}: idle CPU {idle_cpu:5.1f} %, median arrival-to-handling {median_latency:7.1f} us ({handled} messages)")
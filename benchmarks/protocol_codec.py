@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cengParkSimulator as simulator
+
+CALLS = 200000
+BATCH = 64
+# Each case runs in ROUNDS parts of CALLS / ROUNDS calls, the fastest part counts
+ROUNDS = 20
+
+
+# The encoding and decoding ProtocolCodec replaced, kept here as the reference it is measured against
+
+def digits(value, width):
+    return f"{value:0{width}}".encode('ascii')
+
+
+def empty_message(protocol, empty_spaces):
+    return b'EMP' + digits(empty_spaces, protocol.empty_digits)
+
+
+def parking_space_message(protocol, car_id, floor, spot):
+    return (b'SPC' + digits(car_id, protocol.car_id_digits) + protocol.floor_name(floor).encode('ascii')
+            + digits(spot + 1, protocol.spot_digits))
+
+
+def fee_message(protocol, car_id, fee):
+    return b'FEE' + digits(car_id, protocol.car_id_digits) + digits(fee, protocol.fee_digits)
+
+
+def reservation_message(protocol, car_id, fee):
+    return b'RES' + digits(car_id, protocol.car_id_digits) + digits(fee, 2)
+
+
+def car_command(protocol, code, car_id):
+    return code.encode('ascii') + digits(car_id, protocol.car_id_digits)
+
+
+def string_parse(protocol, message):
+    # Prefix checks, then one slice, decode and int() per field
+    if message.startswith(b'EMP'):
+        return int(message[protocol.empty_slice].decode('ascii'))
+    elif message.startswith(b'SPC'):
+        return (int(message[protocol.car_id_slice].decode('ascii')), message[protocol.floor_slice].decode('ascii'),
+                int(message[protocol.spot_slice].decode('ascii')))
+    elif message.startswith(b'FEE'):
+        return int(message[protocol.car_id_slice].decode('ascii')), int(message[protocol.fee_slice].decode('ascii'))
+    elif message.startswith(b'RES'):
+        return (int(message[protocol.car_id_slice].decode('ascii')),
+                int(message[protocol.reservation_fee_slice].decode('ascii')))
+    return None
+
+
+def measure(name, function, calls):
+    # Seconds per call
+    part = max(1, calls // ROUNDS)
+    fastest = float('inf')
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(part):
+            function()
+        fastest = min(fastest, time.perf_counter() - start)
+    elapsed = fastest / part
+    print(f"{name:>40}: {elapsed * 1e9:8.1f} ns per call")
+    return elapsed
+
+
+if __name__ == "__main__":
+    protocol = simulator.STANDARD_PROTOCOL
+    codec = simulator.ProtocolCodec(protocol, 100, simulator.FLOORS, simulator.CARS_PER_FLOOR)
+    messages = [empty_message(protocol, 12), parking_space_message(protocol, 42, 1, 6), fee_message(protocol, 42, 123),
+                reservation_message(protocol, 42, 50)]
+    views = [memoryview(message) for message in messages]
+
+    print("Decoding:")
+    for message, view in zip(messages, views):
+        code = message[:3].decode('ascii')
+        measure(f"{code} slices and int()", lambda: string_parse(protocol, message), CALLS)
+        measure(f"{code} ProtocolCodec.decode", lambda: codec.decode(message), CALLS)
+        measure(f"{code} ProtocolCodec.decode, memoryview", lambda: codec.decode(view), CALLS)
+
+    batch = (messages * (BATCH // len(messages)))[:BATCH]
+    old = measure(f"{BATCH} frames, slices and int()", lambda: [string_parse(protocol, message) for message in batch], CALLS // BATCH)
+    new = measure(f"{BATCH} frames, decode_batch", lambda: codec.decode_batch(batch), CALLS // BATCH)
+    print(f"{'batch speedup':>40}: {old / new:8.2f}x")
+
+    print("Encoding:")
+    measure("PRK frame with f-string", lambda: b'$' + car_command(protocol, "PRK", 42) + b'#', CALLS)
+    measure("PRK frame from table", lambda: codec.car_frame("PRK", 42), CALLS)
+    measure("SPC message with f-string", lambda: parking_space_message(protocol, 42, 1, 6), CALLS)
+    measure("SPC message from tables", lambda: codec.parking_space_message(42, 1, 6), CALLS)
+    measure("FEE message with f-string", lambda: fee_message(protocol, 42, 123), CALLS)
+    measure("FEE message from tables", lambda: codec.fee_message(42, 123), CALLS)
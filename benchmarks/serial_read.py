@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cengParkModel import FrameParser, checkMessage
+
+FRAMES = [b'$EMP12#', b'$SPC042B07#', b'$FEE042123#', b'$RES04250#']
+REPEAT = 50000
+CHUNK_SIZE = 64
+
+
+class MemoryPort:
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.position = 0
+        self.chunk_size = chunk_size
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk_size, len(self.data) - self.position)
+
+    def read(self, size=1):
+        chunk = self.data[self.position:self.position + size]
+        self.position += size
+        return chunk
+
+
+def per_byte_read(port, total):
+    # The original SerialManager.read loop, one read(1) and one bytes join per byte
+    WAITING, GETTING = 0, 1
+    state = WAITING
+    data = b''
+    messages = []
+    while port.position < total:
+        byte = port.read(1)
+        if state == WAITING:
+            if byte == b'$':
+                state = GETTING
+                data = b''
+        elif state == GETTING:
+            if byte == b'#':
+                if checkMessage(data):
+                    messages.append(data)
+                data = b''
+                state = WAITING
+            else:
+                data = b''.join([data, byte])
+    return messages
+
+
+def bulk_read(port, total):
+    parser = FrameParser()
+    messages = []
+    while port.position < total:
+        chunk = port.read(max(1, port.in_waiting))
+        messages.extend(parser.feed(chunk))
+    return messages
+
+
+def measure(function, stream):
+    port = MemoryPort(stream, CHUNK_SIZE)
+    start = time.perf_counter()
+    messages = function(port, len(stream))
+    elapsed = time.perf_counter() - start
+    return len(messages), elapsed
+
+
+if __name__ == "__main__":
+    stream = b''.join(FRAMES) * REPEAT
+    for name, function in (("per-byte", per_byte_read), ("bulk", bulk_read)):
+        count, elapsed = measure(function, stream)
+        print(f"{name:>9}: {count} frames in {elapsed:.3f} s "
+              f"({len(stream) / elapsed / 1e6:.2f} MB/s, {count / elapsed:,.0f} frames/s)")
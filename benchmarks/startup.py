@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import py_compile
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SIMULATOR = os.path.join(ROOT, 'cengParkSimulator.py')
+REPEAT = 10
+HEAVY_MODULES = ('pygame', 'serial', 'numpy', 'asyncio', 'http.server', 'multiprocessing')
+MODULES = ('cengParkModel', 'cengParkSimulator', 'cengParkMetrics')
+
+# Milliseconds on top of a bare interpreter start, best of REPEAT runs
+BUDGETS = {
+    "import cengParkModel": 30,
+    "import cengParkSimulator": 60,
+    "cengParkSimulator.py --help": 80,
+    "headless session, 0 s": 250,
+}
+
+COMMANDS = {
+    "bare interpreter": [sys.executable, '-c', 'pass'],
+    "import cengParkModel": [sys.executable, '-c', 'import cengParkModel'],
+    "import cengParkSimulator": [sys.executable, '-c', 'import cengParkSimulator'],
+    "cengParkSimulator.py --help": [sys.executable, SIMULATOR, '--help'],
+    "headless session, 0 s": [sys.executable, SIMULATOR, '--headless', '--board-simulation', '--virtual-time', '--duration', '0'],
+}
+
+
+def best_time(command, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return min(times)
+
+
+def loaded_heavy_modules(module):
+    # Heavy dependencies a plain import pulls in, there should be none
+    script = f"import sys, {module}; print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+    return subprocess.run([sys.executable, '-c', script], cwd=ROOT, check=True, capture_output=True, text=True).stdout.split()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import and startup time of the simulator against a budget.")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="runs per command, the fastest one counts")
+    parser.add_argument('--output', help="JSON file to write the results to")
+    arguments = parser.parse_args()
+
+    # Timed with up to date bytecode, also where PYTHONDONTWRITEBYTECODE keeps imports from writing it
+    for module in MODULES:
+        py_compile.compile(os.path.join(ROOT, module + '.py'), doraise=True)
+    bare = best_time(COMMANDS["bare interpreter"], arguments.repeat)
+    print(f"{'bare interpreter':>30}: {bare:7.1f} ms")
+    results = {}
+    over_budget = []
+    for name, command in COMMANDS.items():
+        if name == "bare interpreter":
+            continue
+        elapsed = best_time(command, arguments.repeat) - bare
+        results[name] = {"ms": elapsed, "budget_ms": BUDGETS[name]}
+        if elapsed > BUDGETS[name]:
+            over_budget.append(name)
+        print(f"{name:>30}: {elapsed:7.1f} ms (budget {BUDGETS[name]} ms){'  OVER BUDGET' if name in over_budget else ''}")
+    for module in MODULES[:2]:
+        heavy = loaded_heavy_modules(module)
+        results[f"heavy modules after import {module}"] = heavy
+        if heavy:
+            over_budget.append(f"import {module} loads {', '.join(heavy)}")
+            print(f"import {module} loads {', '.join(heavy)}")
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump({"bare_interpreter_ms": bare, "results": results}, output, indent=2)
+    if over_budget:
+        print(f"Over budget: {'; '.join(over_budget)}")
+        sys.exit(1)
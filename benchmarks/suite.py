@@ -0,0 +1,337 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import pygame
+import cengParkModel as model
+import cengParkSimulator as simulator
+from drawer_frame import build_drawer
+
+REPEAT = 5
+
+
+def summarize(samples_ns, operations):
+    samples_ns = sorted(samples_ns)
+    return {
+        "operations": operations,
+        "median_ns": samples_ns[len(samples_ns) // 2],
+        "min_ns": samples_ns[0],
+        "max_ns": samples_ns[-1],
+        "mean_ns": statistics.fmean(samples_ns),
+    }
+
+
+def time_calls(function, iterations, repeat=REPEAT):
+    # Per call time of `function`, best of `repeat` batches smoothed by reporting the median batch
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            function()
+        samples.append((time.perf_counter_ns() - start) / iterations)
+    return summarize(samples, iterations * repeat)
+
+
+def time_each(setup, function, iterations):
+    # Times only `function`, for operations that need fresh state from `setup` every time
+    samples = []
+    for _ in range(iterations):
+        argument = setup()
+        start = time.perf_counter_ns()
+        function(argument)
+        samples.append(time.perf_counter_ns() - start)
+    return summarize(samples, iterations)
+
+
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+# Micro benchmarks
+
+def bench_check_message(iterations):
+    results = {}
+    for message in (b'EMP12', b'SPC042B07', b'FEE042123', b'RES04250', b'XYZ'):
+        results[f"checkMessage/{message[:3].decode('ascii')}"] = time_calls(lambda: model.checkMessage(message), iterations)
+    return results
+
+
+def bench_frame_parser(iterations):
+    chunk = b'$EMP12#$SPC042B07#$FEE042123#$RES04250#' * 16
+    parser = simulator.FrameParser()
+    result = time_calls(lambda: parser.feed(chunk), max(1, iterations // 100))
+    result["frames_per_call"] = 64
+    return {"FrameParser.feed/64_frames": result}
+
+
+def bench_codec(iterations):
+    protocol = simulator.STANDARD_PROTOCOL
+    codec = simulator.ProtocolCodec(protocol, 100, simulator.FLOORS, simulator.CARS_PER_FLOOR)
+    results = {}
+    for message in (b'EMP12', b'SPC042B07', b'FEE042123', b'RES04250'):
+        results[f"ProtocolCodec.decode/{message[:3].decode('ascii')}"] = time_calls(lambda: codec.decode(message), iterations)
+    batch = [b'EMP12', b'SPC042B07', b'FEE042123', b'RES04250'] * 16
+    result = time_calls(lambda: codec.decode_batch(batch), max(1, iterations // 100))
+    result["frames_per_call"] = len(batch)
+    results["ProtocolCodec.decode_batch/64_frames"] = result
+    results["ProtocolCodec.car_frame/PRK"] = time_calls(lambda: codec.car_frame("PRK", 42), iterations)
+    results["ProtocolCodec.parking_space_message"] = time_calls(lambda: codec.parking_space_message(42, 1, 6), iterations)
+    return results
+
+
+def build_engine():
+    simulator.BOARD_SIMULATION = False
+    with quiet():
+        engine = simulator.GameEngine(simulator.SCREEN_WIDTH, simulator.SCREEN_HEIGHT, simulator.DISPLAY_WIDTH,
+                                      simulator.SIMULATOR_CAPTION, simulator.FLOORS, simulator.CARS_PER_FLOOR,
+                                      serial_port=None, headless=True, virtual_time=True)
+    engine.running = True
+    return engine
+
+
+def bench_process_message(iterations):
+    engine = build_engine()
+    codec = engine.codec
+    process = engine._GameEngine__process_message
+    add_car = engine._GameEngine__add_car
+    exit_car = engine._GameEngine__exit_car
+    subscribe_car = engine._GameEngine__subscribe_car
+    places = [(floor, spot) for floor in range(engine.floors) for spot in range(engine.cars_per_floor)]
+    results = {}
+
+    results["process_message/EMP"] = time_calls(lambda: process(codec.empty_message(12)), iterations)
+
+    # PRK -> SPC -> EXT -> FEE cycles over the whole lot
+    state = {"index": 0}
+
+    def queued_car():
+        index = state["index"] % len(places)
+        state["index"] += 1
+        car = engine.fleet[index]
+        add_car(car)
+        floor, spot = places[index]
+        return codec.parking_space_message(car.car_id, floor, spot), car
+
+    parked = []
+
+    def park(argument):
+        message, car = argument
+        process(message)
+        parked.append(car)
+
+    def exiting_car():
+        car = parked.pop()
+        exit_car(car)
+        return codec.fee_message(car.car_id, 5)
+
+    samples_spc, samples_fee = [], []
+    for _ in range(max(1, iterations // len(places))):
+        batch = min(len(places), engine.car_queue.no_cars)
+        samples_spc.append(time_each(queued_car, park, batch))
+        samples_fee.append(time_each(exiting_car, process, batch))
+        state["index"] += len(places) - batch
+    results["process_message/SPC"] = merge(samples_spc)
+    results["process_message/FEE"] = merge(samples_fee)
+
+    # SUB -> RES for fresh cars and spots
+    sub_state = {"index": 0}
+
+    def subscribing_car():
+        index = sub_state["index"]
+        sub_state["index"] += 1
+        car = engine.fleet[engine.fleet_size - 1 - index % 20]
+        floor, spot = places[index % len(places)]
+        engine.subscribed_cars.pop(car.car_id, None)
+        engine.subsriptions.remove_subscription(floor, spot)
+        subscribe_car(car, floor, spot)
+        return codec.reservation_message(car.car_id, 50)
+
+    results["process_message/RES"] = time_each(subscribing_car, process, min(iterations, 2000))
+    return results
+
+
+def merge(summaries):
+    return {
+        "operations": sum(summary["operations"] for summary in summaries),
+        "median_ns": statistics.median(summary["median_ns"] for summary in summaries),
+        "min_ns": min(summary["min_ns"] for summary in summaries),
+        "max_ns": max(summary["max_ns"] for summary in summaries),
+        "mean_ns": statistics.fmean(summary["mean_ns"] for summary in summaries),
+    }
+
+
+def bench_models(iterations):
+    results = {}
+    floors, places = simulator.FLOORS, simulator.CARS_PER_FLOOR
+    cars = [simulator.Car(car_id, (0, 0, 0), False) for car_id in range(floors * places)]
+
+    parking_lot = simulator.ParkingLot(floors, places)
+
+    def park_and_remove():
+        for car in cars:
+            floor, spot = divmod(car.car_id, places)
+            parking_lot.park_car(floor, spot, car)
+        for car in cars:
+            parking_lot.remove_car_by_id(car.car_id)
+
+    result = time_calls(park_and_remove, max(1, iterations // len(cars)))
+    result["cars_per_call"] = len(cars)
+    results["ParkingLot/park_and_remove_all"] = result
+    for car in cars[::2]:
+        parking_lot.park_car(*divmod(car.car_id, places), car)
+    results["ParkingLot/get_occupancy"] = time_calls(parking_lot.get_occupancy, iterations)
+    results["ParkingLot/contains_car"] = time_calls(lambda: parking_lot.contains_car(7), iterations)
+    results["ParkingLot/get_1D_spots"] = time_calls(parking_lot.get_1D_spots, max(1, iterations // 10))
+
+    car_queue = simulator.CarQueue(4 * floors)
+    queue_cars = cars[:car_queue.no_cars]
+
+    def fill_and_drain():
+        for car in queue_cars:
+            car_queue.add_car(car)
+        for car in queue_cars:
+            car_queue.remove_car(car)
+
+    result = time_calls(fill_and_drain, max(1, iterations // len(queue_cars)))
+    result["cars_per_call"] = len(queue_cars)
+    results["CarQueue/fill_and_drain"] = result
+    for car in queue_cars:
+        car_queue.add_car(car)
+    last_car_id = queue_cars[-1].car_id
+    results["CarQueue/get_car"] = time_calls(lambda: car_queue.get_car(last_car_id), iterations)
+    results["CarQueue/get_queue"] = time_calls(car_queue.get_queue, iterations)
+
+    subscriptions = simulator.Subscriptions(places)
+
+    def subscribe_all():
+        for car in cars:
+            floor, spot = divmod(car.car_id, places)
+            subscriptions.add_subscription(car.car_id, floor, spot)
+            subscriptions.get_subscription(floor, spot)
+        for car in cars:
+            subscriptions.remove_subscription(*divmod(car.car_id, places))
+
+    result = time_calls(subscribe_all, max(1, iterations // len(cars)))
+    result["spots_per_call"] = len(cars)
+    results["Subscriptions/add_get_remove_all"] = result
+    return results
+
+
+def bench_drawer(iterations):
+    pygame.init()
+    drawer = build_drawer()
+    all_regions = set(drawer.region_rects.keys())
+    snapshot = drawer.snapshots.snapshot
+    results = {
+        "Drawer.__draw/full_frame": time_calls(lambda: drawer._Drawer__draw(snapshot, all_regions), max(1, iterations // 100), 3),
+        "Drawer.__draw/one_floor": time_calls(lambda: drawer._Drawer__draw(snapshot, {simulator.DirtyRegions.floor(0)}),
+                                              max(1, iterations // 100), 3),
+    }
+    pygame.quit()
+    return results
+
+
+# Macro benchmarks
+
+def bench_session(duration):
+    simulator.BOARD_SIMULATION = True
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = os.path.join(directory, 'session.log')
+        with quiet():
+            engine = simulator.GameEngine(simulator.SCREEN_WIDTH, simulator.SCREEN_HEIGHT, simulator.DISPLAY_WIDTH,
+                                          simulator.SIMULATOR_CAPTION, simulator.FLOORS, simulator.CARS_PER_FLOOR,
+                                          headless=True, virtual_time=True, record_file=log_path)
+            start = time.perf_counter_ns()
+            session = engine.run(duration=duration)
+            session_ns = time.perf_counter_ns() - start
+
+            start = time.perf_counter_ns()
+            replayed = simulator.replay_session(log_path)
+            replay_ns = time.perf_counter_ns() - start
+    return {
+        "session/virtual_time": {
+            "operations": 1,
+            "simulated_seconds": duration,
+            "wall_ns": session_ns,
+            "messages": session["received_messages"],
+            "simulator_fee": session["simulator_fee"],
+        },
+        "session/replay": {
+            "operations": 1,
+            "wall_ns": replay_ns,
+            "matches_session": all(replayed[key] == session[key] for key in
+                                   ("simulator_fee", "received_fee", "simulator_empty_spaces", "received_empty_spaces")),
+        },
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    print(f"\nCompared to {baseline_path}:")
+    for name, result in results.items():
+        old = baseline.get(name)
+        key = "median_ns" if "median_ns" in result else "wall_ns"
+        if old is None or key not in old or not old[key]:
+            continue
+        ratio = result[key] / old[key]
+        print(f"  {name:<40} {ratio:6.2f}x {'(slower)' if ratio > 1.1 else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro and macro benchmarks for the parking lot simulator.")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write the results to")
+    parser.add_argument('--baseline', help="earlier results to compare against")
+    parser.add_argument('--iterations', type=int, default=20000, help="calls per micro benchmark batch")
+    parser.add_argument('--session-duration', type=float, default=600, help="simulated seconds for the macro session")
+    arguments = parser.parse_args()
+
+    results = {}
+    for name, benchmark in (("checkMessage", bench_check_message), ("FrameParser", bench_frame_parser),
+                            ("ProtocolCodec", bench_codec), ("process_message", bench_process_message), ("models", bench_models),
+                            ("Drawer", bench_drawer)):
+        print(f"Running {name} ...")
+        results.update(benchmark(arguments.iterations))
+    print("Running session ...")
+    results.update(bench_session(arguments.session_duration))
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "results": results,
+    }
+    with open(arguments.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+    for name, result in results.items():
+        if "median_ns" in result:
+            print(f"  {name:<40} {result['median_ns'] / 1000:10.2f} us")
+        else:
+            print(f"  {name:<40} {result['wall_ns'] / 1e6:10.2f} ms")
+    print(f"Results written to {arguments.output}")
+
+    if arguments.baseline:
+        compare(results, arguments.baseline)
@@ -0,0 +1,120 @@
+# Prometheus metrics endpoint of a GameEngine, imported by cengParkSimulator only when one is served
+import http.server
+import threading
+from cengParkModel import debug_print
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        debug_print("Metrics: " + format % args)
+
+class MetricsServer:
+    # Prometheus text endpoint for one engine. The session threads only bump plain counters; everything
+    # else is read from the engine when a scrape arrives, on the server's own thread.
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, game_engine, host, port):
+        self.game_engine = game_engine
+        self.host = host
+        self.port = port
+        self.server = None
+        self.server_thread = None
+        self.running = False
+
+    def start(self):
+        self.server = http.server.ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self
+        # Port 0 picks a free port
+        self.port = self.server.server_address[1]
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.server.shutdown()
+            self.server.server_close()
+            self.server_thread.join()
+
+    @staticmethod
+    def __add(lines, name, kind, description, samples):
+        # samples are (labels, value) pairs, labels a dict
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if labels:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+
+    @staticmethod
+    def __by_type(counter, label='type'):
+        return [({label: key.decode('ascii', 'replace')}, count) for key, count in sorted(counter.items())]
+
+    def render(self):
+        game_engine = self.game_engine
+        serial_manager = game_engine.serial_manager
+        lines = []
+        add = self.__add
+        add(lines, "cengpark_frames_received_total", "counter", "Frames received from the board by message type.",
+            self.__by_type(serial_manager.received.copy()))
+        add(lines, "cengpark_frames_rejected_total", "counter", "Frames dropped as invalid by message type.",
+            self.__by_type(serial_manager.rejected.copy()))
+        add(lines, "cengpark_commands_sent_total", "counter", "Commands sent to the board by type.",
+            self.__by_type(serial_manager.sent.copy()))
+
+        writer = serial_manager.writer
+        add(lines, "cengpark_queue_depth", "gauge", "Entries waiting in the simulator's queues.", [
+            ({"queue": "serial_messages"}, serial_manager.messages.qsize()),
+            ({"queue": "serial_writer"}, len(writer.frames) if writer is not None else 0),
+            ({"queue": "car_queue"}, game_engine.car_queue.get_queue_size()),
+        ])
+
+        parking_lot = game_engine.parking_lot
+        add(lines, "cengpark_floor_cars", "gauge", "Cars parked on each floor.",
+            [({"floor": game_engine.protocol.floor_name(floor)}, parking_lot.get_number_of_cars(floor))
+             for floor in range(game_engine.floors)])
+        add(lines, "cengpark_lot_places", "gauge", "Parking places in the lot.", [({}, game_engine.total_places)])
+        add(lines, "cengpark_earnings_total", "counter", "Fees collected, as computed by the simulator and as reported by the board.", [
+            ({"source": "simulator"}, game_engine.statistics.simulator_fee),
+            ({"source": "board"}, game_engine.statistics.calculated_fee),
+        ])
+
+        elapsed = game_engine.clock.time() - game_engine.start_time if game_engine.status == 1 else 0
+        add(lines, "cengpark_generated_events_total", "counter", "Events run by the event generator.",
+            [({}, game_engine.generated_events)])
+        add(lines, "cengpark_event_rate", "gauge", "Generated events per second since the session started.",
+            [({}, game_engine.generated_events / elapsed if elapsed > 0 else 0)])
+        add(lines, "cengpark_session_status", "gauge", "0 waiting, 1 running, 2 finished.", [({}, game_engine.status)])
+
+        drawer = game_engine.drawer
+        if drawer is not None:
+            lines.append("# HELP cengpark_render_frame_seconds Time to draw a frame.")
+            lines.append("# TYPE cengpark_render_frame_seconds summary")
+            lines.append(f"cengpark_render_frame_seconds_sum {drawer.total_frame_time / 1000.0}")
+            lines.append(f"cengpark_render_frame_seconds_count {drawer.frame_count}")
+            add(lines, "cengpark_render_frame_max_seconds", "gauge", "Longest frame so far.", [({}, drawer.max_frame_time / 1000.0)])
+
+        name = "cengpark_command_latency_seconds"
+        lines.append(f"# HELP {name} Time from sending a command to the board's answer.")
+        lines.append(f"# TYPE {name} histogram")
+        for command, (counts, count, total) in serial_manager.latency.get_histograms(self.LATENCY_BUCKETS).items():
+            for bound, bucket_count in zip(self.LATENCY_BUCKETS, counts):
+                lines.append(f'{name}_bucket{{command="{command}",le="{bound}"}} {bucket_count}')
+            lines.append(f'{name}_bucket{{command="{command}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{command="{command}"}} {total}')
+            lines.append(f'{name}_count{{command="{command}"}} {count}')
+        return "\n".join(lines) + "\n"
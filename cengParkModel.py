@@ -0,0 +1,1565 @@
+# The parking lot model, the board's serial protocol, session recording and the board simulator. Importing it
+# loads nothing but the standard library, numpy follows with the first ParkingLot. The display, the serial port
+# and the game engine are in cengParkSimulator.
+import importlib
+import random
+import time
+import threading
+import queue
+import collections
+import heapq
+import struct
+import math
+import os
+
+DEBUG = False
+JOURNAL_CHECKPOINT_RECORDS = 1000
+
+def debug_print(message):
+    if DEBUG == True:
+        print("DEBUG: " + message)
+
+class LazyModule:
+    # Stands in for a module until one of its attributes is used. The module is then imported and replaces
+    # this object in the namespace it was bound in, so later lookups go straight to the module.
+    def __init__(self, name, namespace, alias=None):
+        self.name = name
+        self.namespace = namespace
+        self.alias = alias if alias is not None else name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.name)
+        if self.namespace.get(self.alias) is self:
+            self.namespace[self.alias] = module
+        return getattr(module, attribute)
+
+np = LazyModule('numpy', globals(), 'np')
+
+# Parking lot configuration
+FLOORS = 4
+CARS_PER_FLOOR = 10
+
+# Game configuration
+GAME_DURATION = 60
+GENERATOR_TICK = 0.11
+BOARD_TICK = 0.1
+
+car_colors = [
+    (0, 0, 0),        # Black
+    (210, 192, 210),  # Cream
+    (128, 128, 128),  # Gray
+    (192, 192, 192),  # Silver
+    (0, 0, 255),      # Blue
+    (0, 128, 255),    # Light Blue
+    (255, 0, 0),      # Red
+    (139, 0, 0),      # Dark Red
+    (0, 128, 0),      # Green
+    (255, 165, 0),    # Orange
+    (128, 0, 128),    # Purple
+    (210, 180, 140),  # Tan
+    (255, 215, 0),    # Gold
+    (105, 105, 105),  # Dark Gray
+    (70, 130, 180),   # Steel Blue
+    (0, 100, 0),      # Dark Green
+    (220, 20, 60),    # Crimson
+    (112, 128, 144),  # Slate Gray
+    (47, 79, 79),     # Dark Slate Gray
+    (169, 169, 169)   # Light Gray
+]
+
+class WallClock:
+    def time(self):
+        return time.time()
+
+    def perf_counter_ns(self):
+        return time.perf_counter_ns()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class VirtualClock:
+    def __init__(self, start_time=0.0):
+        self.now = start_time
+
+    def time(self):
+        return self.now
+
+    def perf_counter_ns(self):
+        return int(self.now * 1e9)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance_to(self, new_time):
+        if new_time > self.now:
+            self.now = new_time
+
+class EventScheduler:
+    def __init__(self, clock):
+        self.clock = clock
+        self.events = []
+        self.sequence = 0
+
+    def schedule(self, delay, callback):
+        # The sequence number keeps events at the same time in scheduling order
+        heapq.heappush(self.events, (self.clock.time() + delay, self.sequence, callback))
+        self.sequence += 1
+
+    def schedule_every(self, interval, callback, first_delay=0.0):
+        def periodic():
+            callback()
+            self.schedule(interval, periodic)
+        self.schedule(first_delay, periodic)
+
+    def run_next(self, until):
+        # Jumps the clock straight to the next event, or to `until` when there is none before it
+        if not self.events or self.events[0][0] > until:
+            self.clock.advance_to(until)
+            return False
+        event_time, _, callback = heapq.heappop(self.events)
+        self.clock.advance_to(event_time)
+        callback()
+        return True
+
+WALL_CLOCK = WallClock()
+
+def floor_to_letters(floor, width=1):
+    letters = ''
+    for _ in range(width):
+        floor, index = divmod(floor, 26)
+        letters = chr(ord('A') + index) + letters
+    return letters
+
+def letters_to_floor(letters):
+    floor = 0
+    for letter in letters:
+        index = ord(letter) - ord('A')
+        if index < 0 or index >= 26:
+            return -1
+        floor = floor * 26 + index
+    return floor
+
+class ProtocolFormat:
+    def __init__(self, name, car_id_digits, floor_letters, spot_digits, empty_digits, fee_digits):
+        self.name = name
+        self.car_id_digits = car_id_digits
+        self.floor_letters = floor_letters
+        self.spot_digits = spot_digits
+        self.empty_digits = empty_digits
+        self.fee_digits = fee_digits
+
+        self.max_car_id = 10 ** car_id_digits - 1
+        self.max_floors = 26 ** floor_letters
+        self.max_spots = 10 ** spot_digits - 1
+        self.max_empty_spaces = 10 ** empty_digits - 1
+
+        car_id_end = 3 + car_id_digits
+        floor_end = car_id_end + floor_letters
+        self.car_id_slice = slice(3, car_id_end)
+        self.floor_slice = slice(car_id_end, floor_end)
+        self.spot_slice = slice(floor_end, floor_end + spot_digits)
+        self.empty_slice = slice(3, 3 + empty_digits)
+        self.fee_slice = slice(car_id_end, car_id_end + fee_digits)
+        self.reservation_fee_slice = slice(car_id_end, car_id_end + 2)
+        self.message_lengths = {
+            b'EMP': 3 + empty_digits,
+            b'SPC': floor_end + spot_digits,
+            b'FEE': car_id_end + fee_digits,
+            b'RES': car_id_end + 2,
+        }
+
+    def fits(self, floors, places_per_floor, fleet_size):
+        return (floors <= self.max_floors and places_per_floor <= self.max_spots
+                and floors * places_per_floor <= self.max_empty_spaces and fleet_size - 1 <= self.max_car_id)
+
+    def check(self, message):
+        return self.message_lengths.get(bytes(message[:3])) == len(message)
+
+    def floor_name(self, floor):
+        return floor_to_letters(floor, self.floor_letters)
+
+# The original 4 x 10 protocol and a wider variant for large garages
+STANDARD_PROTOCOL = ProtocolFormat('standard', 3, 1, 2, 2, 3)
+EXTENDED_PROTOCOL = ProtocolFormat('extended', 5, 2, 3, 6, 6)
+
+def select_protocol(floors, places_per_floor, fleet_size):
+    for protocol in (STANDARD_PROTOCOL, EXTENDED_PROTOCOL):
+        if protocol.fits(floors, places_per_floor, fleet_size):
+            return protocol
+    raise ValueError(f"A {floors} x {places_per_floor} lot with {fleet_size} cars does not fit any protocol variant.")
+
+def checkMessage(message, protocol=STANDARD_PROTOCOL):
+    return protocol.check(message)
+
+def message_type(message, protocol=STANDARD_PROTOCOL):
+    # Known message prefix for counting, b'unknown' for anything else
+    prefix = bytes(message[:3])
+    return prefix if prefix in protocol.message_lengths else b'unknown'
+
+# Decoded board messages and simulator commands, floors and spots are 0-based indices
+EmptySpaces = collections.namedtuple('EmptySpaces', ['empty_spaces'])
+ParkingSpace = collections.namedtuple('ParkingSpace', ['car_id', 'floor', 'spot'])
+Fee = collections.namedtuple('Fee', ['car_id', 'fee'])
+Reservation = collections.namedtuple('Reservation', ['car_id', 'fee'])
+CarCommand = collections.namedtuple('CarCommand', ['code', 'car_id'])
+SubscriptionCommand = collections.namedtuple('SubscriptionCommand', ['car_id', 'floor', 'spot'])
+
+# Letter values by byte for floor names, None for anything else
+LETTER_VALUES = [None] * 256
+for character in range(26):
+    LETTER_VALUES[ord('A') + character] = character
+# Most entries of any encode table, larger values are formatted when they are sent
+CODEC_TABLE_SIZE = 1000
+# Most places in the decode table of floor and spot pairs, the places of the floors beyond it are parsed
+PLACE_TABLE_SIZE = 100000
+
+class ProtocolCodec:
+    # Table driven encoder and decoder for one ProtocolFormat, shared by the engine and the board simulator.
+    # Every car command frame is built once up front; messages are decoded into typed records by looking their
+    # fields up in the same tables inverted, straight from the message bytes (bytes or memoryview).
+    def __init__(self, protocol, fleet_size=None, floors=None, places_per_floor=None):
+        self.protocol = protocol
+        # Without a lot size the tables cover what the protocol can address, up to CODEC_TABLE_SIZE entries each
+        fleet_size = min(protocol.max_car_id + 1, CODEC_TABLE_SIZE if fleet_size is None else fleet_size)
+        floors = min(protocol.max_floors, CODEC_TABLE_SIZE if floors is None else floors)
+        places_per_floor = min(protocol.max_spots, CODEC_TABLE_SIZE if places_per_floor is None else places_per_floor)
+        empty_spaces = min(protocol.max_empty_spaces, CODEC_TABLE_SIZE, floors * places_per_floor)
+        self.car_ids = [self.__digits(car_id, protocol.car_id_digits) for car_id in range(fleet_size)]
+        self.commands = {code: [code.encode('ascii') + car_id for car_id in self.car_ids] for code in ('PRK', 'EXT')}
+        self.frames = {code: [b'$' + command + b'#' for command in commands] for code, commands in self.commands.items()}
+        self.floor_names = [protocol.floor_name(floor).encode('ascii') for floor in range(floors)]
+        # Spots are sent 1-based, self.spots[spot] is the field of the 0-based spot
+        self.spots = [self.__digits(spot + 1, protocol.spot_digits) for spot in range(places_per_floor)]
+        self.empty_messages = [b'EMP' + self.__digits(empty, protocol.empty_digits) for empty in range(empty_spaces + 1)]
+        self.fees = [self.__digits(fee, protocol.fee_digits) for fee in range(min(10 ** protocol.fee_digits, CODEC_TABLE_SIZE))]
+        self.reservation_fees = [self.__digits(fee, 2) for fee in range(100)]
+
+        # Decode tables are the encode tables inverted, field bytes -> value, and decoders read a message's fields
+        # with their get methods: (slice, get) pairs. Floor and spot are looked up together, in one table of
+        # places for lots of up to PLACE_TABLE_SIZE places. A field outside its table is parsed by its layout:
+        # (slice, floor letters rather than digits, offset added to the number).
+        car_id = (protocol.car_id_slice, self.__inverse(self.car_ids).get)
+        place_slice = slice(protocol.floor_slice.start, protocol.spot_slice.stop)
+        places = {floor_name + spot_field: (floor, spot)
+                  for floor, floor_name in enumerate(self.floor_names[:PLACE_TABLE_SIZE // max(1, places_per_floor)])
+                  for spot, spot_field in enumerate(self.spots)}
+        # EMP has a single field, its table holds the finished records
+        empty_records = {message[3:]: EmptySpaces(empty) for empty, message in enumerate(self.empty_messages)}
+        car_id_layout = (protocol.car_id_slice, False, 0)
+        place_layout = (car_id_layout, (protocol.floor_slice, True, 0), (protocol.spot_slice, False, -1))
+        self.car_id_field = car_id
+        self.car_id_layout = car_id_layout
+        # First byte -> (message length, second and third byte, reader, record type, fields, layout)
+        self.decoders = [None] * 256
+        self.__add_decoder(self.decoders, b'EMP', protocol.message_lengths[b'EMP'], self.__read_record, EmptySpaces,
+                           (protocol.empty_slice, empty_records.get), ((protocol.empty_slice, False, 0),))
+        self.__add_decoder(self.decoders, b'SPC', protocol.message_lengths[b'SPC'], self.__read_car_place, ParkingSpace,
+                           car_id + (place_slice, places.get), place_layout)
+        self.__add_decoder(self.decoders, b'FEE', protocol.message_lengths[b'FEE'], self.__read_car_number, Fee,
+                           car_id + (protocol.fee_slice, self.__inverse(self.fees).get),
+                           (car_id_layout, (protocol.fee_slice, False, 0)))
+        self.__add_decoder(self.decoders, b'RES', protocol.message_lengths[b'RES'], self.__read_car_number, Reservation,
+                           car_id + (protocol.reservation_fee_slice, self.__inverse(self.reservation_fees).get),
+                           (car_id_layout, (protocol.reservation_fee_slice, False, 0)))
+        self.command_decoders = [None] * 256
+        self.__add_decoder(self.command_decoders, b'SUB', protocol.spot_slice.stop, self.__read_car_place, SubscriptionCommand,
+                           car_id + (place_slice, places.get), place_layout)
+
+    @staticmethod
+    def __digits(value, width):
+        return f"{value:0{width}}".encode('ascii')
+
+    @staticmethod
+    def __inverse(table):
+        return {field: value for value, field in enumerate(table)}
+
+    @staticmethod
+    def __add_decoder(decoders, prefix, length, reader, record, fields, layout):
+        decoders[prefix[0]] = (length, prefix[1], prefix[2], reader, record, fields, layout)
+
+    @staticmethod
+    def __parse_field(value, letters, offset):
+        # Number in a field outside the decode tables, None when it is not all digits or capital letters.
+        # Spots are sent 1-based, spot 0 comes out negative and is rejected too.
+        if letters:
+            number = 0
+            for byte in value:
+                letter = LETTER_VALUES[byte]
+                if letter is None:
+                    return None
+                number = number * 26 + letter
+        elif value.isdigit():
+            number = int(value)
+        else:
+            return None
+        number += offset
+        return number if number >= 0 else None
+
+    @staticmethod
+    def __parse_record(message, record, layout):
+        # Every field parsed by its layout, only for messages with a value outside the decode tables
+        if type(message) is memoryview:
+            message = message.tobytes()
+        values = []
+        for field_slice, letters, offset in layout:
+            number = ProtocolCodec.__parse_field(message[field_slice], letters, offset)
+            if number is None:
+                return None
+            values.append(number)
+        return record._make(values)
+
+    # Readers by message shape, the length and prefix were checked already. The lookups slice the message,
+    # which does not copy a memoryview, and hash the slice.
+    @staticmethod
+    def __read_record(message, record, fields, layout):
+        field_slice, get = fields
+        known = get(message[field_slice])
+        return known if known is not None else ProtocolCodec.__parse_record(message, record, layout)
+
+    @staticmethod
+    def __read_car_number(message, record, fields, layout):
+        car_id_slice, car_id_get, number_slice, number_get = fields
+        car_id = car_id_get(message[car_id_slice])
+        number = number_get(message[number_slice])
+        if car_id is None or number is None:
+            return ProtocolCodec.__parse_record(message, record, layout)
+        return record._make((car_id, number))
+
+    @staticmethod
+    def __read_car_place(message, record, fields, layout):
+        car_id_slice, car_id_get, place_slice, place_get = fields
+        car_id = car_id_get(message[car_id_slice])
+        place = place_get(message[place_slice])
+        if car_id is None or place is None:
+            return ProtocolCodec.__parse_record(message, record, layout)
+        return record._make((car_id, place[0], place[1]))
+
+    # Board to simulator messages
+    def decode(self, message):
+        # Typed record of a frame without its $ and #, or None when it is not a valid message.
+        # message is bytes or a read-only memoryview.
+        entry = self.decoders[message[0]] if message else None
+        if entry is None:
+            return None
+        length, second, third, reader, record, fields, layout = entry
+        if len(message) != length or message[1] != second or message[2] != third:
+            return None
+        return reader(message, record, fields, layout)
+
+    def decode_batch(self, messages):
+        decoders = self.decoders
+        records = []
+        append = records.append
+        for message in messages:
+            entry = decoders[message[0]] if message else None
+            if entry is None:
+                append(None)
+                continue
+            length, second, third, reader, record, fields, layout = entry
+            if len(message) != length or message[1] != second or message[2] != third:
+                append(None)
+            else:
+                append(reader(message, record, fields, layout))
+        return records
+
+    def parse_car_id(self, message):
+        # None when the car ID field is not made of digits
+        car_id_slice, get = self.car_id_field
+        car_id = get(message[car_id_slice])
+        if car_id is not None:
+            return car_id
+        field_slice, letters, offset = self.car_id_layout
+        return self.__parse_field(bytes(message[field_slice]), letters, offset)
+
+    def __field(self, table, value, width):
+        # Precomputed digits of value, formatted only when it is outside the table
+        if 0 <= value < len(table):
+            return table[value]
+        return self.__digits(value, width)
+
+    def __place(self, floor, spot):
+        if floor < len(self.floor_names):
+            floor_name = self.floor_names[floor]
+        else:
+            floor_name = self.protocol.floor_name(floor).encode('ascii')
+        if 0 <= spot < len(self.spots):
+            return floor_name + self.spots[spot]
+        return floor_name + self.__digits(spot + 1, self.protocol.spot_digits)
+
+    def empty_message(self, empty_spaces):
+        if 0 <= empty_spaces < len(self.empty_messages):
+            return self.empty_messages[empty_spaces]
+        return b'EMP' + self.__digits(empty_spaces, self.protocol.empty_digits)
+
+    def parking_space_message(self, car_id, floor, spot):
+        return b'SPC' + self.__field(self.car_ids, car_id, self.protocol.car_id_digits) + self.__place(floor, spot)
+
+    def fee_message(self, car_id, fee):
+        return (b'FEE' + self.__field(self.car_ids, car_id, self.protocol.car_id_digits)
+                + self.__field(self.fees, fee, self.protocol.fee_digits))
+
+    def reservation_message(self, car_id, fee):
+        return b'RES' + self.__field(self.car_ids, car_id, self.protocol.car_id_digits) + self.__field(self.reservation_fees, fee, 2)
+
+    # Simulator to board commands
+    def car_command(self, code, car_id):
+        commands = self.commands.get(code)
+        if commands is not None and car_id < len(commands):
+            return commands[car_id]
+        return code.encode('ascii') + self.__field(self.car_ids, car_id, self.protocol.car_id_digits)
+
+    def car_frame(self, code, car_id):
+        frames = self.frames.get(code)
+        if frames is not None and car_id < len(frames):
+            return frames[car_id]
+        return b'$' + self.car_command(code, car_id) + b'#'
+
+    def subscription_command(self, car_id, floor, spot):
+        return b'SUB' + self.__field(self.car_ids, car_id, self.protocol.car_id_digits) + self.__place(floor, spot)
+
+    def parse_subscription(self, command):
+        _, _, _, reader, record, fields, layout = self.command_decoders[command[0]]
+        return reader(command, record, fields, layout)
+
+    def decode_command(self, command):
+        # CarCommand for PRK and EXT, SubscriptionCommand for SUB, CarCommand(code, -1) for GO and END
+        code = bytes(command[:3])
+        if code == b'SUB':
+            length, _, _, reader, record, fields, layout = self.command_decoders[command[0]]
+            return reader(command, record, fields, layout) if len(command) == length else None
+        if code in (b'PRK', b'EXT'):
+            car_id = self.parse_car_id(command)
+            return CarCommand(code.decode('ascii'), car_id) if car_id is not None else None
+        if code in (b'GO', b'END'):
+            return CarCommand(code.decode('ascii'), -1)
+        return None
+
+class LatencyHistogram:
+    # HDR-style log-linear buckets: values keep their top SUB_BUCKET_BITS bits, so every recorded
+    # latency is reported at most 2 ** -(SUB_BUCKET_BITS - 1) (0.78 %) above its true value
+    SUB_BUCKET_BITS = 8
+
+    def __init__(self):
+        self.counts = {}
+        self.total_count = 0
+        self.total_value = 0
+        self.max_value = 0
+
+    def record(self, value):
+        shift = max(0, value.bit_length() - self.SUB_BUCKET_BITS)
+        bucket = (shift << self.SUB_BUCKET_BITS) | (value >> shift)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total_count += 1
+        self.total_value += value
+        if value > self.max_value:
+            self.max_value = value
+
+    def __bucket_value(self, bucket):
+        shift = bucket >> self.SUB_BUCKET_BITS
+        lowest = (bucket & ((1 << self.SUB_BUCKET_BITS) - 1)) << shift
+        return min(lowest + (1 << shift) - 1, self.max_value)
+
+    def percentiles(self, percentiles):
+        if self.total_count == 0:
+            return [0] * len(percentiles)
+        values = []
+        buckets = sorted(self.counts.items())
+        index = 0
+        seen = buckets[0][1]
+        for percentile in sorted(percentiles):
+            target = max(1, -(-percentile * self.total_count // 100))
+            while seen < target:
+                index += 1
+                seen += buckets[index][1]
+            values.append(self.__bucket_value(buckets[index][0]))
+        return values
+
+    def cumulative_counts(self, bounds):
+        # Values at or below each of the sorted bounds, for Prometheus style histograms
+        counts = [0] * len(bounds)
+        for bucket, count in self.counts.items():
+            value = self.__bucket_value(bucket)
+            for index, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[index] += count
+        return counts
+
+class LatencyTracker:
+
+    COMMANDS = ('PRK', 'EXT', 'SUB')
+    RESPONSES = {b'SPC': 'PRK', b'FEE': 'EXT', b'RES': 'SUB'}
+    PERCENTILES = (50, 90, 99, 99.9)
+
+    def __init__(self, codec=None, clock=WALL_CLOCK):
+        self.codec = codec if codec is not None else ProtocolCodec(STANDARD_PROTOCOL)
+        self.clock = clock
+        # (command, car_id) -> send time in nanoseconds
+        self.pending = {}
+        self.histograms = {command: LatencyHistogram() for command in self.COMMANDS}
+        self.lock = threading.Lock()
+
+    def command_sent(self, command, car_id):
+        sent = self.clock.perf_counter_ns()
+        with self.lock:
+            self.pending[(command, car_id)] = sent
+
+    def response_received(self, message):
+        command = self.RESPONSES.get(bytes(message[:3]))
+        if command is None:
+            return
+        received = self.clock.perf_counter_ns()
+        car_id = self.codec.parse_car_id(message)
+        with self.lock:
+            sent = self.pending.pop((command, car_id), None)
+            if sent is not None:
+                self.histograms[command].record(received - sent)
+
+    def get_statistics(self):
+        # Per command: answered count, unanswered count and latency percentiles in milliseconds
+        statistics = {}
+        with self.lock:
+            unanswered = collections.Counter(command for command, _ in self.pending)
+            for command, histogram in self.histograms.items():
+                values = histogram.percentiles(self.PERCENTILES)
+                statistics[command] = {
+                    "count": histogram.total_count,
+                    "unanswered": unanswered[command],
+                    "percentiles": {percentile: value / 1e6 for percentile, value in zip(self.PERCENTILES, values)},
+                    "maximum": histogram.max_value / 1e6,
+                }
+        return statistics
+
+    def get_histograms(self, bounds):
+        # Per command: cumulative counts at the bounds, count and sum, all times in seconds
+        bounds_ns = [bound * 1e9 for bound in bounds]
+        with self.lock:
+            return {command: (histogram.cumulative_counts(bounds_ns), histogram.total_count, histogram.total_value / 1e9)
+                    for command, histogram in self.histograms.items()}
+
+class SessionRecorder:
+
+    # The magic names the format, logs of the first format start with LEGACY_MAGIC and have no fleet size
+    MAGIC = b'CENGPRK2'
+    LEGACY_MAGIC = b'CENGPARK'
+    # Floors, places per floor and fleet size, together they pick the protocol variant of the frames
+    HEADER = struct.Struct('<8sHHI')
+    # Clock time in seconds, direction and frame length, followed by the frame without delimiters
+    RECORD = struct.Struct('<dBB')
+    OUTGOING = 0
+    INCOMING = 1
+
+    def __init__(self, path, floors, places_per_floor, fleet_size):
+        self.file = open(path, 'wb')
+        self.file.write(self.HEADER.pack(self.MAGIC, floors, places_per_floor, fleet_size))
+        self.records = queue.Queue()
+        self.writer_thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def record(self, direction, timestamp, frame):
+        self.records.put(self.RECORD.pack(timestamp, direction, len(frame)) + frame)
+
+    def __write_loop(self):
+        # Everything queued since the last write goes to disk in one call
+        running = True
+        while running:
+            batch = [self.records.get()]
+            while True:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            self.file.write(b''.join(batch))
+        self.file.flush()
+
+    def close(self):
+        self.records.put(None)
+        self.writer_thread.join()
+        self.file.close()
+
+def read_session_log(path):
+    with open(path, 'rb') as log:
+        data = log.read()
+    if data[:8] == SessionRecorder.LEGACY_MAGIC:
+        raise ValueError(f"{path} was recorded in an older format without the fleet size, record the session again.")
+    if data[:8] != SessionRecorder.MAGIC or len(data) < SessionRecorder.HEADER.size:
+        raise ValueError(f"{path} is not a recorded session.")
+    magic, floors, places_per_floor, fleet_size = SessionRecorder.HEADER.unpack_from(data)
+    records = []
+    offset = SessionRecorder.HEADER.size
+    while offset + SessionRecorder.RECORD.size <= len(data):
+        timestamp, direction, length = SessionRecorder.RECORD.unpack_from(data, offset)
+        offset += SessionRecorder.RECORD.size
+        records.append((direction, timestamp, data[offset:offset + length]))
+        offset += length
+    return floors, places_per_floor, fleet_size, records
+
+class StateJournal:
+    # Append-only log of the engine's state transitions. Every record holds the car's state after the
+    # transition and the fee totals, so the last record of a car is all recovery needs. Handlers only queue
+    # packed records; the writer thread appends and fsyncs everything queued since its last write at once.
+    # Every JOURNAL_CHECKPOINT_RECORDS records it appends a checkpoint with the latest record of every car
+    # that is not plainly idle, and recovery starts from the last complete checkpoint.
+    MAGIC = b'CENGJRNL'
+    HEADER = struct.Struct('<8sHH')
+    # Kind, car state, flags, car ID, waiting subscription floor and spot, subscription floor and spot,
+    # parked floor and spot, entry time, simulator and board fee totals. Unused places are -1.
+    RECORD = struct.Struct('<BBBxihhhhhhdqq')
+    QUEUED = 1
+    PARKED = 2
+    EXIT_REQUESTED = 3
+    FEE_SETTLED = 4
+    SUBSCRIPTION_REQUESTED = 5
+    SUBSCRIPTION_RESOLVED = 6
+    # car ID field holds the number of records that follow
+    CHECKPOINT = 7
+    SUBSCRIBED = 1
+    IDLE_SUBSCRIBED = 2
+
+    def __init__(self, path, floors, places_per_floor, records=None, fees=(0, 0), checkpoint_records=JOURNAL_CHECKPOINT_RECORDS):
+        # records and fees are a recovered state to continue from, written as the first checkpoint
+        self.resume = records is not None
+        self.file = open(path, 'ab' if self.resume else 'wb')
+        if not self.resume:
+            self.file.write(self.HEADER.pack(self.MAGIC, floors, places_per_floor))
+        self.checkpoint_records = checkpoint_records
+        # car_id -> latest packed record, in the order the cars last changed
+        self.latest = {}
+        self.fees = fees
+        self.records = queue.Queue()
+        self.writer_thread = threading.Thread(target=self.__write_loop, args=(dict(records or {}),), daemon=True)
+        self.writer_thread.start()
+
+    def record(self, kind, car, waiting, subscription, place, simulator_fee, board_fee, idle_subscribed):
+        flags = (self.SUBSCRIBED if car.subscribed else 0) | (self.IDLE_SUBSCRIBED if idle_subscribed else 0)
+        waiting_floor, waiting_spot = (waiting["floor"], waiting["spot"]) if waiting is not None else (-1, -1)
+        floor, spot = (subscription["floor"], subscription["spot"]) if subscription is not None else (-1, -1)
+        parked_floor, parked_spot, entry_time = place if place is not None else (-1, -1, 0.0)
+        self.records.put((car.car_id, self.RECORD.pack(kind, car.state, flags, car.car_id, waiting_floor, waiting_spot, floor, spot,
+                                                       parked_floor, parked_spot, entry_time, simulator_fee, board_fee)))
+
+    def __checkpoint(self):
+        # Idle cars without subscriptions are the state a session starts with, they are left out
+        records = []
+        for car_id, record in list(self.latest.items()):
+            kind, state, flags, _, waiting_floor, _, floor = self.RECORD.unpack_from(record)[:7]
+            if state == CarRegistry.IDLE and flags == 0 and waiting_floor == -1 and floor == -1:
+                del self.latest[car_id]
+            else:
+                records.append(record)
+        marker = self.RECORD.pack(self.CHECKPOINT, 0, 0, len(records), -1, -1, -1, -1, -1, -1, 0.0, *self.fees)
+        return marker + b''.join(records)
+
+    def __write_loop(self, recovered):
+        # A resumed journal starts with a checkpoint of the recovered state
+        self.latest.update(recovered)
+        pending = [self.__checkpoint()] if self.resume else []
+        since_checkpoint = 0
+        running = True
+        while running:
+            batch = [self.records.get()]
+            while True:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [entry for entry in batch if entry is not None]
+            for car_id, record in batch:
+                self.latest.pop(car_id, None)
+                self.latest[car_id] = record
+                pending.append(record)
+            if batch:
+                self.fees = self.RECORD.unpack_from(batch[-1][1])[-2:]
+            since_checkpoint += len(batch)
+            if since_checkpoint >= self.checkpoint_records:
+                pending.append(self.__checkpoint())
+                since_checkpoint = 0
+            # Durable before the next batch is taken, a crash loses at most the records still queued
+            self.file.write(b''.join(pending))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            pending = []
+
+    def close(self):
+        self.records.put(None)
+        self.writer_thread.join()
+        self.file.close()
+
+def read_journal(path):
+    # Latest record fields by car ID, in the order the cars last changed, and the fee totals, from the last
+    # complete checkpoint and the records after it. Also the length of the journal up to the last complete
+    # record, a record or checkpoint cut off by a crash is ignored, and so is everything from the first
+    # record of an unknown kind on, such as the zeros a crash can leave at the end of the file.
+    with open(path, 'rb') as journal:
+        data = journal.read()
+    magic, floors, places_per_floor = StateJournal.HEADER.unpack_from(data)
+    if magic != StateJournal.MAGIC:
+        raise ValueError(f"{path} is not a state journal.")
+    size = StateJournal.RECORD.size
+    offset = end = StateJournal.HEADER.size
+    cars = {}
+    fees = (0, 0)
+    while offset + size <= len(data):
+        fields = StateJournal.RECORD.unpack_from(data, offset)
+        if not StateJournal.QUEUED <= fields[0] <= StateJournal.CHECKPOINT:
+            break
+        offset += size
+        if fields[0] == StateJournal.CHECKPOINT:
+            count = fields[3]
+            if offset + count * size > len(data):
+                break
+            cars = {}
+            for _ in range(count):
+                record = StateJournal.RECORD.unpack_from(data, offset)
+                cars[record[3]] = record
+                offset += size
+        else:
+            cars.pop(fields[3], None)
+            cars[fields[3]] = fields
+        fees = fields[-2:]
+        end = offset
+    return floors, places_per_floor, cars, fees, end
+
+class FrameParser:
+
+    WAITING = 0
+    GETTING = 1
+
+    def __init__(self, protocol=STANDARD_PROTOCOL, rejected=None):
+        self.protocol = protocol
+        self.state = self.WAITING
+        self.buffer = bytearray()
+        self.uncomplete_count = 0
+        self.invalid_count = 0
+        # Dropped frames by message type, b'incomplete' for frames cut off by the next $
+        self.rejected = rejected if rejected is not None else collections.Counter()
+
+    def feed(self, chunk):
+        frames = []
+        view = memoryview(chunk)
+        position = 0
+        end = len(chunk)
+        while position < end:
+            if self.state == self.WAITING:
+                start = chunk.find(b'$', position)
+                if start == -1:
+                    break
+                self.state = self.GETTING
+                position = start + 1
+                continue
+
+            stop = chunk.find(b'#', position)
+            restart = chunk.find(b'$', position, stop if stop != -1 else end)
+            if restart != -1:
+                # A new frame started before the current one was terminated
+                self.uncomplete_count += 1
+                self.rejected[b'incomplete'] += 1
+                print("Error: Uncomplete message received.")
+                self.buffer.clear()
+                position = restart + 1
+                continue
+            if stop == -1:
+                self.buffer += view[position:end]
+                break
+
+            if self.buffer:
+                self.buffer += view[position:stop]
+                message = bytes(self.buffer)
+                self.buffer.clear()
+            else:
+                message = chunk[position:stop]
+            if checkMessage(message, self.protocol):
+                frames.append(message)
+            else:
+                self.invalid_count += 1
+                self.rejected[message_type(message, self.protocol)] += 1
+                print("Error: Invalid message received.")
+            self.state = self.WAITING
+            position = stop + 1
+        return frames
+
+class DirtyRegions:
+
+    PANEL = 'panel'
+    QUEUE = 'queue'
+
+    def __init__(self):
+        self.regions = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def floor(floor):
+        return ('floor', floor)
+
+    def mark(self, *regions):
+        with self.lock:
+            self.regions.update(regions)
+
+    def collect(self):
+        with self.lock:
+            regions = self.regions
+            self.regions = set()
+        return regions
+
+class GameStatistics:
+    def __init__(self, dirty_regions=None):
+        self.dirty_regions = dirty_regions
+        self.game_status = 0
+        self.calculated_fee = 0
+        self.simulator_fee = 0
+        self.received_empty_spaces = 0
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        dirty_regions = self.__dict__.get('dirty_regions')
+        if dirty_regions is not None:
+            dirty_regions.mark(DirtyRegions.PANEL)
+
+class Car:
+    __slots__ = ('car_id', 'car_color', 'subscribed', 'state')
+
+    def __init__(self, car_id, car_color, subscribed):
+        self.car_id = car_id
+        self.car_color = car_color
+        self.subscribed = subscribed
+        self.state = CarRegistry.IDLE
+
+    def __eq__(self, other):
+        if isinstance(other, Car):
+            return self.car_id == other.car_id
+        return False
+
+    def __hash__(self):
+        return hash(self.car_id)
+
+class RandomSet:
+    # Set with O(1) add, remove and uniform random choice, items are swapped to the end before removal
+    def __init__(self):
+        self.items = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def add(self, item):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item):
+        position = self.positions.pop(item, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def choice(self, rng=random):
+        if not self.items:
+            return None
+        return self.items[rng.randrange(len(self.items))]
+
+class CarRegistry:
+    # Every car of the fleet with its state, idle -> queued -> parked -> exiting -> idle.
+    # Not locked, GameEngine holds its own lock around every change.
+    IDLE = 0
+    QUEUED = 1
+    PARKED = 2
+    EXITING = 3
+
+    def __init__(self):
+        self.cars = {}
+        self.members = {state: RandomSet() for state in (self.IDLE, self.QUEUED, self.PARKED, self.EXITING)}
+        # Subscribed, or waiting for a subscription, and not in the game: picked for "add subscribed car"
+        self.idle_subscribed = RandomSet()
+
+    def __len__(self):
+        return len(self.cars)
+
+    def add(self, car):
+        self.cars[car.car_id] = car
+        car.state = self.IDLE
+        self.members[self.IDLE].add(car)
+
+    def __getitem__(self, car_id):
+        return self.cars[car_id]
+
+    def get(self, car_id):
+        return self.cars.get(car_id)
+
+    def move(self, car, from_state, to_state):
+        if car.state != from_state:
+            return False
+        self.members[from_state].discard(car)
+        self.members[to_state].add(car)
+        car.state = to_state
+        return True
+
+    def count(self, state):
+        return len(self.members[state])
+
+    def sample(self, state, rng=random):
+        return self.members[state].choice(rng)
+
+class CarQueue:
+    def __init__(self, no_cars, dirty_regions=None):
+        self.no_cars = no_cars
+        # car_id -> Car in arrival order
+        self.queue = collections.OrderedDict()
+        # Tuple of the queued cars, rebuilt on the first read after a change
+        self.view = ()
+        self.lock = threading.Lock()  
+        self.dirty_regions = dirty_regions
+
+    def __changed(self):
+        self.view = None
+        if self.dirty_regions is not None:
+            self.dirty_regions.mark(DirtyRegions.QUEUE)
+
+    def add_car(self, car):
+        with self.lock:  
+            if car.car_id in self.queue:
+                debug_print(f"Car{car.car_id} is already in the queue.")
+                return False
+            if len(self.queue) < self.no_cars:
+                self.queue[car.car_id] = car
+                self.__changed()
+                return True
+            else:
+                debug_print("Queue is full. Cannot add car.")
+                return False
+
+    def remove_car(self, car):
+        return self.remove_car_by_id(car.car_id)
+
+    def remove_car_by_id(self, car_id):
+        with self.lock:  
+            car = self.queue.pop(car_id, None)
+            if car is not None:
+                self.__changed()
+            return car
+
+    def get_car(self, car_id):
+        with self.lock:
+            return self.queue.get(car_id)
+
+    def contains_car(self, car_id):
+        with self.lock:
+            return car_id in self.queue
+
+    def get_queue(self):
+        # Immutable, shared between callers until the queue changes
+        with self.lock:  
+            if self.view is None:
+                self.view = tuple(self.queue.values())
+            return self.view
+
+    def get_queue_size(self):
+        with self.lock:  
+            return len(self.queue)
+
+    def is_full(self):
+        with self.lock:  
+            return len(self.queue) >= self.no_cars
+
+    def is_empty(self):
+        with self.lock:  
+            return len(self.queue) == 0
+
+class ParkingLot:
+
+    EMPTY = -1
+
+    def __init__(self, floors, places_per_floor, dirty_regions=None, clock=WALL_CLOCK):
+        self.floors = floors
+        self.places_per_floor = places_per_floor
+        self.clock = clock
+        # Parked car IDs (EMPTY for a free spot) and their entry times
+        self.occupancy = np.full((floors, places_per_floor), self.EMPTY, dtype=np.int32)
+        self.entry_times = np.zeros((floors, places_per_floor), dtype=np.float64)
+        self.floor_counts = np.zeros(floors, dtype=np.int32)
+        self.total_cars = 0
+        # car_id -> Car and car_id -> (floor, spot), kept in step with the arrays
+        self.cars = {}
+        self.car_locations = {}
+        self.lock = threading.Lock() 
+        self.dirty_regions = dirty_regions
+
+    def __mark_dirty(self, floor):
+        if self.dirty_regions is not None:
+            self.dirty_regions.mark(DirtyRegions.floor(floor), DirtyRegions.PANEL)
+
+    def __read(self, floor, spot):
+        car_id = self.occupancy[floor, spot]
+        if car_id == self.EMPTY:
+            return None
+        return self.cars[int(car_id)], float(self.entry_times[floor, spot])
+
+    def __remove(self, floor, spot):
+        car, entry_time = self.__read(floor, spot)
+        self.occupancy[floor, spot] = self.EMPTY
+        del self.cars[car.car_id]
+        del self.car_locations[car.car_id]
+        self.floor_counts[floor] -= 1
+        self.total_cars -= 1
+        self.__mark_dirty(floor)
+        return car, entry_time
+
+    def park_car_raw(self, floor, spot, car, entry_time=None):
+        real_floor = letters_to_floor(floor)
+        real_spot = spot - 1
+        return self.park_car(real_floor, real_spot, car, entry_time)
+
+    def park_car(self, floor, spot, car, entry_time=None):
+        with self.lock:  
+            if self.occupancy[floor, spot] != self.EMPTY:
+                print(f"Spot {spot} on floor {floor} is already occupied.")
+                return False
+            if car.car_id in self.car_locations:
+                print(f"Car{car.car_id} is already parked.")
+                return False
+            if entry_time is None:
+                entry_time = self.clock.time()  
+            self.occupancy[floor, spot] = car.car_id
+            self.entry_times[floor, spot] = entry_time
+            self.cars[car.car_id] = car
+            self.car_locations[car.car_id] = (floor, spot)
+            self.floor_counts[floor] += 1
+            self.total_cars += 1
+            self.__mark_dirty(floor)
+            return True
+
+    def remove_car(self, floor, spot):
+        with self.lock:  
+            if self.occupancy[floor, spot] != self.EMPTY:
+                return self.__remove(floor, spot)
+            else:
+                print(f"Spot {spot} on floor {floor} is already empty.")
+                return None
+
+    def remove_car_by_id(self, car_id):
+        with self.lock:  
+            location = self.car_locations.get(car_id)
+            if location is not None:
+                return self.__remove(*location)
+            debug_print(f"Car {car_id} not found in the parking lot.")
+            return None
+
+    def contains_car(self, car_id):
+        with self.lock:
+            return car_id in self.car_locations
+
+    def get_car_location(self, car_id):
+        with self.lock:
+            return self.car_locations.get(car_id)
+
+    def get_car_place(self, car_id):
+        # (floor, spot, entry time) of a parked car, or None
+        with self.lock:
+            location = self.car_locations.get(car_id)
+            if location is None:
+                return None
+            return location[0], location[1], float(self.entry_times[location])
+
+    def get_number_of_cars(self, floor):
+        with self.lock:  
+            return int(self.floor_counts[floor])
+
+    def get_total_cars(self):
+        with self.lock:
+            return self.total_cars
+
+    def get_occupancy(self):
+        with self.lock:
+            return self.floor_counts.tolist(), self.total_cars
+
+    def get_free_spots(self):
+        # Free spots per floor
+        with self.lock:
+            return self.places_per_floor - self.floor_counts
+
+    def get_dwell_statistics(self, now=None):
+        # Number of parked cars and the mean / maximum time they have been parked, in seconds
+        if now is None:
+            now = self.clock.time()
+        with self.lock:
+            dwell_times = now - self.entry_times[self.occupancy != self.EMPTY]
+        if dwell_times.size == 0:
+            return 0, 0.0, 0.0
+        return int(dwell_times.size), float(dwell_times.mean()), float(dwell_times.max())
+
+    def read_spot(self, floor, spot):
+        with self.lock: 
+            return self.__read(floor, spot)
+        
+    def read_spot_raw(self, floor, spot):
+        real_floor = letters_to_floor(floor)
+        real_spot = spot - 1
+        return self.read_spot(real_floor, real_spot)
+        
+    def get_floor_cars(self, floor):
+        # (spot, car) for the occupied spots of a floor only
+        with self.lock:
+            return [(spot, self.cars[int(self.occupancy[floor, spot])])
+                    for spot in np.flatnonzero(self.occupancy[floor] != self.EMPTY).tolist()]
+
+    def get_1D_spots(self):
+        with self.lock:  
+            return [self.__read(floor, spot) for floor in range(self.floors) for spot in range(self.places_per_floor)]
+        
+    def get_all_cars(self):
+        with self.lock:  
+            return list(self.cars.values())
+
+class Subscriptions:
+    def __init__(self, places_per_floor, dirty_regions=None):
+        self.places_per_floor = places_per_floor
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.dirty_regions = dirty_regions
+
+    def __mark_dirty(self, floor):
+        if self.dirty_regions is not None:
+            self.dirty_regions.mark(DirtyRegions.floor(floor))
+
+    def add_subscription(self, car_id, floor, spot):
+        key = self.places_per_floor * floor + spot
+        with self.lock:
+            if key in self.subscriptions:
+                debug_print(f"Error: Subscription already exists for car {self.subscriptions[key]} at floor {floor}, spot {spot}.")
+                return
+            self.subscriptions[key] = car_id
+        self.__mark_dirty(floor)
+
+    def add_subscription_raw(self, car_id, floor, spot):
+        real_floor = letters_to_floor(floor)
+        real_spot = spot - 1
+        return self.add_subscription(car_id, real_floor, real_spot)
+
+    def remove_subscription(self, floor, spot):
+        key = self.places_per_floor * floor + spot
+        with self.lock:
+            if key in self.subscriptions:
+                del self.subscriptions[key]
+        self.__mark_dirty(floor)
+
+    def get_subscription_raw(self, floor, spot):
+        real_floor = letters_to_floor(floor)
+        real_spot = spot - 1
+        return self.get_subscription(real_floor, real_spot)
+
+    def get_subscription(self, floor, spot):
+        with self.lock:
+            return self.subscriptions.get(self.places_per_floor * floor + spot)
+
+    def get_floor_subscriptions(self, floor):
+        # Subscribed spots of a floor
+        first = self.places_per_floor * floor
+        with self.lock:
+            return [spot for spot in range(self.places_per_floor) if first + spot in self.subscriptions]
+
+# Immutable views of what the renderer shows, see SnapshotPublisher
+CarView = collections.namedtuple('CarView', ['car_id', 'car_color', 'subscribed'])
+FloorView = collections.namedtuple('FloorView', ['subscribed_spots', 'cars'])
+PanelView = collections.namedtuple('PanelView', ['floor_counts', 'free_spots', 'latency', 'simulator_fee', 'calculated_fee',
+                                                 'received_empty_spaces', 'game_status'])
+StateSnapshot = collections.namedtuple('StateSnapshot', ['version', 'floors', 'queue', 'panel'])
+
+class SnapshotPublisher:
+    # The engine publishes a new StateSnapshot after every state change and the renderer picks up
+    # the latest one without taking any of the model locks. Views of regions that were not marked
+    # dirty are shared with the previous snapshot.
+    def __init__(self, dirty_regions, parking_lot, car_queue, subscriptions, serial_manager, statistics, latency_interval=0.0):
+        self.dirty_regions = dirty_regions
+        self.parking_lot = parking_lot
+        self.car_queue = car_queue
+        self.subscriptions = subscriptions
+        self.serial_manager = serial_manager
+        self.statistics = statistics
+        # Latency percentiles are recomputed at most every latency_interval seconds. A change in between
+        # leaves them pending, and the next publish() after the interval picks them up.
+        self.latency_interval = latency_interval
+        self.latency_due = 0.0
+        self.latency_pending = False
+        self.latency_rows = ()
+        self.publish_lock = threading.Lock()
+        self.published = threading.Event()
+        self.dirty_regions.collect()
+        self.snapshot = StateSnapshot(0, tuple(self.__floor_view(floor) for floor in range(parking_lot.floors)),
+                                      self.__queue_view(), self.__panel_view())
+        self.published.set()
+
+    @staticmethod
+    def __car_view(car):
+        return CarView(car.car_id, car.car_color, car.subscribed)
+
+    def __floor_view(self, floor):
+        return FloorView(tuple(self.subscriptions.get_floor_subscriptions(floor)),
+                         tuple((spot, self.__car_view(car)) for spot, car in self.parking_lot.get_floor_cars(floor)))
+
+    def __queue_view(self):
+        return tuple(self.__car_view(car) for car in self.car_queue.get_queue())
+
+    def __latency_view(self):
+        now = time.perf_counter()
+        if now < self.latency_due:
+            self.latency_pending = True
+            return self.latency_rows
+        self.latency_pending = False
+        self.latency_due = now + self.latency_interval
+        latency = self.serial_manager.latency.get_statistics()
+        self.latency_rows = tuple((command, latency[command]["percentiles"][50], latency[command]["percentiles"][99],
+                                   latency[command]["unanswered"]) for command in LatencyTracker.COMMANDS)
+        return self.latency_rows
+
+    def __panel_view(self):
+        statistics = self.statistics
+        floor_counts, _ = self.parking_lot.get_occupancy()
+        free_spots = int(self.parking_lot.get_free_spots().sum())
+        return PanelView(tuple(floor_counts), free_spots, self.__latency_view(), statistics.simulator_fee, statistics.calculated_fee,
+                         statistics.received_empty_spaces, statistics.game_status)
+
+    def publish(self, final=False):
+        # The final snapshot of a session also brings pending latency percentiles up to date
+        with self.publish_lock:
+            if final:
+                self.latency_due = 0.0
+            regions = self.dirty_regions.collect()
+            if self.latency_pending and time.perf_counter() >= self.latency_due:
+                regions.add(DirtyRegions.PANEL)
+            if not regions:
+                return self.snapshot
+            previous = self.snapshot
+            floors = tuple(self.__floor_view(floor) if DirtyRegions.floor(floor) in regions else view
+                           for floor, view in enumerate(previous.floors))
+            queue_view = self.__queue_view() if DirtyRegions.QUEUE in regions else previous.queue
+            panel = self.__panel_view() if DirtyRegions.PANEL in regions else previous.panel
+            snapshot = StateSnapshot(previous.version + 1, floors, queue_view, panel)
+            # Replacing the reference is atomic, a reader sees either the old or the new snapshot
+            self.snapshot = snapshot
+        self.published.set()
+        return snapshot
+
+    def wait(self, timeout):
+        if not self.published.wait(timeout):
+            return False
+        self.published.clear()
+        return True
+
+    def wake(self):
+        self.published.set()
+
+class BoardSimulator:
+    def __init__(self, deliver_message, debug_commands, floors=FLOORS, places_per_floor=CARS_PER_FLOOR, protocol=STANDARD_PROTOCOL,
+                 clock=WALL_CLOCK, threaded=True, codec=None):
+        self.floors = floors
+        self.clock = clock
+        self.places_per_floor = places_per_floor
+        self.protocol = protocol
+        self.codec = codec if codec is not None else ProtocolCodec(protocol, None, floors, places_per_floor)
+        self.parking_lot = [[None for _ in range(places_per_floor)] for _ in range(floors)]
+        # Min-heap of free, unsubscribed spot indices (floor * places_per_floor + spot) so the
+        # lowest floor and spot is still picked first. Subscribed spots stay in the heap until popped.
+        self.free_spots = list(range(floors * places_per_floor))
+        self.is_free = [True] * (floors * places_per_floor)
+        self.car_spots = {}
+        self.empty_spaces = floors * places_per_floor
+        self.subscribed_cars = {}
+        self.subscribed_places = {}
+        self.car_queue = queue.Queue()
+        self.running = True
+        self.simulation_started = False
+        self.deliver_message = deliver_message
+        self.debug_commands = debug_commands
+        # Without a thread the owner calls step() every BOARD_TICK of its own clock
+        self.simulator_thread = None
+        if threaded:
+            self.simulator_thread = threading.Thread(target=self.__simulate_board, daemon=True)
+            self.simulator_thread.start()
+
+    def __get__empty_spaces(self):
+        return self.empty_spaces
+    
+    def stop(self):
+        self.running = False
+        if self.simulator_thread is not None:
+            self.simulator_thread.join()
+
+    def __take_free_spot(self):
+        while self.free_spots:
+            index = heapq.heappop(self.free_spots)
+            if self.is_free[index]:
+                self.is_free[index] = False
+                return divmod(index, self.places_per_floor)
+        return None
+
+    def __park(self, car_id, floor, spot):
+        self.parking_lot[floor][spot] = (car_id, self.clock.time())
+        self.car_spots[car_id] = (floor, spot)
+        self.empty_spaces -= 1
+        self.deliver_message(self.codec.parking_space_message(car_id, floor, spot))
+
+    def __leave(self, floor, spot):
+        car_id, parked_time = self.parking_lot[floor][spot]
+        self.parking_lot[floor][spot] = None
+        del self.car_spots[car_id]
+        self.empty_spaces += 1
+        if (floor, spot) not in self.subscribed_places:
+            index = floor * self.places_per_floor + spot
+            self.is_free[index] = True
+            heapq.heappush(self.free_spots, index)
+        return parked_time
+
+    def __process_park_message(self, car_id):
+        if car_id in self.subscribed_cars:
+            floor, spot = self.subscribed_cars[car_id]
+            if self.parking_lot[floor][spot] is not None:
+                self.car_queue.put(car_id)
+            else:
+                self.__park(car_id, floor, spot)
+        else:
+            free_spot = self.__take_free_spot()
+            if free_spot is not None:
+                self.__park(car_id, *free_spot)
+            else:
+                self.car_queue.put(car_id)
+                self.deliver_message(self.codec.empty_message(self.__get__empty_spaces()))
+
+    def __simulate_board(self):
+        while self.running:
+            self.clock.sleep(BOARD_TICK)
+            self.step()
+
+    def step(self):
+        if not self.running:
+            return
+        if self.debug_commands.empty():
+            if self.simulation_started:
+                if not self.car_queue.empty():
+                    car_id = self.car_queue.get()
+                    self.__process_park_message(car_id)
+                else:
+                    self.deliver_message(self.codec.empty_message(self.__get__empty_spaces()))
+        else:
+            command = self.debug_commands.get()
+            if command.startswith(b'GO'):
+                self.simulation_started = True
+            if self.simulation_started:
+                if command.startswith(b'EXT'):
+                    car_id = self.codec.parse_car_id(command)
+                    if car_id in self.subscribed_cars:
+                        self.deliver_message(self.codec.fee_message(car_id, 0))
+                        floor, spot = self.subscribed_cars[car_id]
+                        if self.car_spots.get(car_id) == (floor, spot):
+                            self.__leave(floor, spot)
+                    elif car_id in self.car_spots:
+                        floor, spot = self.car_spots[car_id]
+                        current_time = self.clock.time()
+                        parkedTime = self.__leave(floor, spot)
+                        fee = int(4 * (current_time - parkedTime))
+                        self.deliver_message(self.codec.fee_message(car_id, fee))
+                elif command.startswith(b'PRK'):
+                    car_id = self.codec.parse_car_id(command)
+                    self.__process_park_message(car_id)
+                elif command.startswith(b'SUB'):
+                    car_id, floor, spot = self.codec.parse_subscription(command)
+                    
+                    if (floor, spot) in self.subscribed_places:
+                        fee = 0
+                    elif car_id in self.subscribed_cars:
+                        fee = 0
+                    elif self.parking_lot[floor][spot] is not None:
+                        fee = 0
+                    else:
+                        fee = 50
+                        self.subscribed_cars[car_id] = (floor, spot)
+                        self.subscribed_places[(floor, spot)] = car_id
+                        self.is_free[floor * self.places_per_floor + spot] = False
+
+                    self.deliver_message(self.codec.reservation_message(car_id, fee))
+                elif command.startswith(b'END'):
+                    self.simulation_started = False
+                    self.running = False
+
+# What a workload sees of the game when it picks the next event
+WorkloadView = collections.namedtuple('WorkloadView', ['total_places', 'cars_in_game', 'parked_cars', 'subscriptions',
+                                                       'idle_subscribed_cars'])
+
+class Workload:
+    # Decides what the event generator does next and how long it waits before the following event.
+    # next_action() returns (action, recorded command or None), next_delay() returns seconds or None to stop.
+    ADD = 'add'
+    EXIT = 'exit'
+    SUBSCRIBE = 'subscribe'
+    ADD_SUBSCRIBED = 'add_subscribed'
+    COMMAND = 'command'
+    NOTHING = None
+
+    def __init__(self, rate=None):
+        self.rate = rate
+
+    def next_action(self, view, elapsed, rng):
+        return self.NOTHING, None
+
+    def next_delay(self, elapsed, rng):
+        return 1.0 / self.rate
+
+    def check_lot(self, floors, places_per_floor, fleet_size):
+        # Raises ValueError when the workload cannot drive a lot of this size
+        pass
+
+class DefaultWorkload(Workload):
+    # The original generator: a random event every GENERATOR_TICK, damped as the lot fills up
+    def next_action(self, view, elapsed, rng):
+        # Thresholds scale with the lot, for 40 places they are 35 cars, 45 cars and 10 subscriptions
+        damping_cars = max(1, view.total_places * 7 // 8)
+        max_cars = view.total_places * 9 // 8
+        max_subscriptions = max(1, view.total_places // 4)
+        random_number = rng.randint(0, 1000)
+        coefficient = int(200 * view.cars_in_game / damping_cars)
+
+        if random_number < 600 - coefficient and view.cars_in_game < max_cars:
+            return self.ADD, None
+        elif random_number < 800 and view.parked_cars > 0:
+            return self.EXIT, None
+        elif random_number < 850 and view.subscriptions < max_subscriptions:
+            return self.SUBSCRIBE, None
+        elif random_number < 900 and view.idle_subscribed_cars > 0:
+            return self.ADD_SUBSCRIBED, None
+        return self.NOTHING, None
+
+    def next_delay(self, elapsed, rng):
+        return GENERATOR_TICK if self.rate is None else 1.0 / self.rate
+
+class PoissonWorkload(Workload):
+    # Events arrive as a Poisson process, each one is drawn from a fixed mix
+    MIX = ((Workload.ADD, 0.55), (Workload.EXIT, 0.35), (Workload.SUBSCRIBE, 0.05), (Workload.ADD_SUBSCRIBED, 0.05))
+
+    def __init__(self, rate=None):
+        super().__init__(10.0 if rate is None else rate)
+
+    def pick(self, mix, rng):
+        point = rng.random() * sum(weight for _, weight in mix)
+        for action, weight in mix:
+            point -= weight
+            if point < 0:
+                return action
+        return mix[-1][0]
+
+    def next_action(self, view, elapsed, rng):
+        return self.pick(self.MIX, rng), None
+
+    def next_delay(self, elapsed, rng):
+        return rng.expovariate(self.rate)
+
+class RushHourWorkload(PoissonWorkload):
+    # The rate ramps from a tenth of the peak up to the peak and back every period, arrivals
+    # dominate the first half and departures the second
+    MORNING = ((Workload.ADD, 0.8), (Workload.EXIT, 0.1), (Workload.SUBSCRIBE, 0.05), (Workload.ADD_SUBSCRIBED, 0.05))
+    EVENING = ((Workload.ADD, 0.1), (Workload.EXIT, 0.8), (Workload.SUBSCRIBE, 0.05), (Workload.ADD_SUBSCRIBED, 0.05))
+
+    def __init__(self, rate=None, period=GAME_DURATION):
+        super().__init__(20.0 if rate is None else rate)
+        self.period = period
+
+    def __phase(self, elapsed):
+        return (elapsed % self.period) / self.period
+
+    def next_action(self, view, elapsed, rng):
+        return self.pick(self.MORNING if self.__phase(elapsed) < 0.5 else self.EVENING, rng), None
+
+    def next_delay(self, elapsed, rng):
+        rate = self.rate * (0.1 + 0.9 * math.sin(math.pi * self.__phase(elapsed)) ** 2)
+        return rng.expovariate(rate)
+
+class ExitStormWorkload(Workload):
+    # Fills the lot up to fill_fraction, then asks every parked car to leave as fast as the rate allows
+    def __init__(self, rate=None, fill_fraction=0.9):
+        super().__init__(50.0 if rate is None else rate)
+        self.fill_fraction = fill_fraction
+        self.storm = False
+
+    def next_action(self, view, elapsed, rng):
+        if self.storm and view.parked_cars == 0:
+            self.storm = False
+        elif not self.storm and view.parked_cars >= self.fill_fraction * view.total_places:
+            self.storm = True
+        if self.storm:
+            return self.EXIT, None
+        return (self.ADD, None) if view.cars_in_game < view.total_places else (self.NOTHING, None)
+
+class SubscriptionBurstWorkload(DefaultWorkload):
+    # Default traffic, interrupted every burst_interval seconds by a quarter of the lot asking to subscribe at once
+    def __init__(self, rate=None, burst_interval=10.0):
+        super().__init__(None)
+        self.burst_rate = 100.0 if rate is None else rate
+        self.burst_interval = burst_interval
+        self.next_burst = burst_interval
+        self.burst_remaining = 0
+
+    def next_action(self, view, elapsed, rng):
+        if elapsed >= self.next_burst:
+            self.next_burst += self.burst_interval
+            self.burst_remaining = max(1, view.total_places // 4)
+        if self.burst_remaining > 0:
+            self.burst_remaining -= 1
+            return self.SUBSCRIBE, None
+        return super().next_action(view, elapsed, rng)
+
+    def next_delay(self, elapsed, rng):
+        if self.burst_remaining > 0:
+            return 1.0 / self.burst_rate
+        return super().next_delay(elapsed, rng)
+
+class TraceWorkload(Workload):
+    # Sends the PRK/EXT/SUB commands of a recorded session with their original spacing, divided by rate
+    def __init__(self, rate=None, trace_file=None):
+        super().__init__(1.0 if rate is None else rate)
+        if trace_file is None:
+            raise ValueError("The trace workload needs a recorded session file.")
+        self.trace_file = trace_file
+        self.floors, self.places_per_floor, self.fleet_size, records = read_session_log(trace_file)
+        self.commands = [(timestamp, frame) for direction, timestamp, frame in records
+                         if direction == SessionRecorder.OUTGOING and frame[:3] in (b'PRK', b'EXT', b'SUB')]
+        self.index = 0
+
+    def next_action(self, view, elapsed, rng):
+        if self.index >= len(self.commands):
+            return self.NOTHING, None
+        return self.COMMAND, self.commands[self.index][1]
+
+    def next_delay(self, elapsed, rng):
+        self.index += 1
+        if self.index >= len(self.commands):
+            return None
+        return (self.commands[self.index][0] - self.commands[self.index - 1][0]) / self.rate
+
+    def check_lot(self, floors, places_per_floor, fleet_size):
+        # The recorded commands name car IDs and places of the recorded lot and are sent in its protocol variant
+        if (floors, places_per_floor, fleet_size) != (self.floors, self.places_per_floor, self.fleet_size):
+            raise ValueError(f"{self.trace_file} was recorded for {self.floors} floors of {self.places_per_floor} places "
+                             f"and {self.fleet_size} cars.")
+
+WORKLOADS = {
+    'default': DefaultWorkload,
+    'poisson': PoissonWorkload,
+    'rush_hour': RushHourWorkload,
+    'exit_storm': ExitStormWorkload,
+    'subscription_burst': SubscriptionBurstWorkload,
+    'trace': TraceWorkload,
+}
+
+def make_workload(name, rate=None, trace_file=None):
+    if name not in WORKLOADS:
+        raise ValueError(f"Unknown workload {name}, choose one of {', '.join(WORKLOADS)}.")
+    if name == 'trace':
+        return TraceWorkload(rate, trace_file)
+    return WORKLOADS[name](rate)
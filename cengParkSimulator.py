@@ -1,231 +1,171 @@
 import os
 os.environ["SDL_AUDIODRIVER"] = "dummy"
-import pygame
 import random
-import string
 import time
 import threading
-import serial
 import sys
 import queue
+import collections
+import math
+import json
+import functools
+import contextlib
+import io
+import argparse
+import cengParkModel
+from cengParkModel import (LazyModule, debug_print, FLOORS, CARS_PER_FLOOR, GAME_DURATION, BOARD_TICK, car_colors,
+                           WALL_CLOCK, VirtualClock, EventScheduler, STANDARD_PROTOCOL, select_protocol, message_type,
+                           EmptySpaces, ParkingSpace, Fee, Reservation, SubscriptionCommand, ProtocolCodec, LatencyTracker,
+                           SessionRecorder, read_session_log, StateJournal, read_journal, FrameParser, DirtyRegions,
+                           GameStatistics, Car, CarRegistry, CarQueue, ParkingLot, Subscriptions, SnapshotPublisher,
+                           BoardSimulator, WorkloadView, Workload, WORKLOADS, make_workload)
+
+# pygame with SDL and the serial package load on first use, headless and simulated sessions never import them.
+# The event loop, process pools and the metrics endpoint are only imported by the modes that use them.
+pygame = LazyModule('pygame', globals())
+serial = LazyModule('serial', globals())
+asyncio = LazyModule('asyncio', globals())
+multiprocessing = LazyModule('multiprocessing', globals())
+concurrent_futures = LazyModule('concurrent.futures', globals(), 'concurrent_futures')
+cengParkMetrics = LazyModule('cengParkMetrics', globals())
 
-DEBUG = False
 BOARD_SIMULATION = False
-
-def debug_print(message):
-    if DEBUG == True:
-        print("DEBUG: " + message)
+HEADLESS = False
+# Run the simulated board on a virtual clock, needs BOARD_SIMULATION and HEADLESS
+VIRTUAL_TIME = False
+# Run the session on an asyncio event loop instead of reader, generator and board threads
+ASYNC_CORE = False
+# Record the session to this file, or replay a recorded one instead of running a session
+RECORD_FILE = None
+REPLAY_FILE = None
+# Replay speed factor, None replays as fast as possible
+REPLAY_SPEED = None
+# Serve Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics, None turns the endpoint off
+METRICS_PORT = None
+METRICS_HOST = '127.0.0.1'
+# Profiling mode: spans, lock waits and stack samples, written to PROFILE_OUTPUT.collapsed and .txt
+PROFILE = False
+PROFILE_OUTPUT = 'profile'
+PROFILE_SAMPLE_INTERVAL = 0.005
+# Journal every state transition to this file, fsynced in batches. With RESUME the session continues from the journal
+JOURNAL_FILE = None
+RESUME = False
 
 # Screen dimensions
 SCREEN_WIDTH = 1500
 SCREEN_HEIGHT = 600
 DISPLAY_WIDTH = 200
 SIMULATOR_CAPTION = 'Ceng Parking Lot Simulator'
-
-# Parking lot configuration
-FLOORS = 4
-CARS_PER_FLOOR = 10
+DRAWER_FPS = 30
+DRAWER_IDLE_TIMEOUT = 0.5
+GLYPH_CACHE_SIZE = 512
+# Lot view: spots at zoom 1 and their spacing, in pixels. Floors whose spots would be narrower than DETAIL_SPOT_WIDTH
+# on screen are drawn as a heat map. At most TILE_CACHE_SIZE floors keep a detailed tile when out of view.
+SPOT_WIDTH = 64
+SPOT_HEIGHT = 32
+SPOT_GAP = 12
+SPOT_FONT_SIZE = 22
+TILE_PADDING = 12
+TILE_HEADER = 36
+QUEUE_SPOT_WIDTH = 72
+QUEUE_SPOT_HEIGHT = 40
+DETAIL_SPOT_WIDTH = 40
+MAX_ZOOM = 2.0
+ZOOM_STEP = 1.25
+TILE_CACHE_SIZE = 64
+
+# Parking lot configuration, the number of floors and places is in cengParkModel
+# Number of car IDs in play, None for 5 cars per 2 places (100 cars for the original 40 places)
+FLEET_SIZE = None
+
+# Game configuration, the duration and ticks are in cengParkModel
+EVENT_POLL_INTERVAL = 1 / 60
 
 # Serial communication configuration
 SERIAL_PORT = '/dev/ttyUSB0'
 BAUDRATE = 115200
-PARITY = serial.PARITY_NONE
+# serial.PARITY_NONE
+PARITY = 'N'
 RTSCTS = False
 XONXOFF = False
-
-car_colors = [
-    (0, 0, 0),        # Black
-    (210, 192, 210),  # Cream
-    (128, 128, 128),  # Gray
-    (192, 192, 192),  # Silver
-    (0, 0, 255),      # Blue
-    (0, 128, 255),    # Light Blue
-    (255, 0, 0),      # Red
-    (139, 0, 0),      # Dark Red
-    (0, 128, 0),      # Green
-    (255, 165, 0),    # Orange
-    (128, 0, 128),    # Purple
-    (210, 180, 140),  # Tan
-    (255, 215, 0),    # Gold
-    (105, 105, 105),  # Dark Gray
-    (70, 130, 180),   # Steel Blue
-    (0, 100, 0),      # Dark Green
-    (220, 20, 60),    # Crimson
-    (112, 128, 144),  # Slate Gray
-    (47, 79, 79),     # Dark Slate Gray
-    (169, 169, 169)   # Light Gray
-]
-
-def checkMessage(message):
-    if message.startswith(b'EMP') and len(message) == 5:
-        return True
-    elif message.startswith(b'SPC') and len(message) == 9:
-        return True
-    elif message.startswith(b'FEE') and len(message) == 9:
-        return True
-    elif message.startswith(b'RES') and len(message) == 8:
-        return True
-    else:
-        return False
-
-class Car:
-    def __init__(self, car_id, car_color, subscribed):
-        self.car_id = car_id
-        self.car_color = car_color
-        self.subscribed = subscribed
-
-    def __eq__(self, other):
-        if isinstance(other, Car):
-            return self.car_id == other.car_id
-        return False
-
-    def __hash__(self):
-        return hash(self.car_id)
-
-class CarQueue:
-    def __init__(self, no_cars):
-        self.no_cars = no_cars
-        self.queue = []
-        self.lock = threading.Lock()  
-
-    def add_car(self, car):
-        with self.lock:  
-            if len(self.queue) < self.no_cars:
-                self.queue.append(car)
-                return True
-            else:
-                debug_print("Queue is full. Cannot add car.")
-                return False
-
-    def remove_car(self, car):
-        with self.lock:  
-            if self.queue and car in self.queue:
-                self.queue.remove(car)
-
-    def get_queue(self):
-        with self.lock:  
-            return list(self.queue)  
-
-    def get_queue_size(self):
-        with self.lock:  
-            return len(self.queue)
-
-    def is_full(self):
-        with self.lock:  
-            return len(self.queue) >= self.no_cars
-
-    def is_empty(self):
-        with self.lock:  
-            return len(self.queue) == 0
-
-class ParkingLot:
-    def __init__(self, floors, places_per_floor):
-        self.floors = floors
-        self.places_per_floor = places_per_floor
-        self.spots = [[None for _ in range(places_per_floor)] for _ in range(floors)]
-        self.lock = threading.Lock() 
-
-    def park_car_raw(self, floor, spot, car):
-        real_floor = ord(floor) - ord('A')
-        real_spot = spot - 1
-        return self.park_car(real_floor, real_spot, car)
-
-    def park_car(self, floor, spot, car):
-        with self.lock:  
-            if self.spots[floor][spot] is None:
-                entry_time = time.time()  
-                self.spots[floor][spot] = (car, entry_time)
-                return True
-            else:
-                print(f"Spot {spot} on floor {floor} is already occupied.")
-                return False
-
-    def remove_car(self, floor, spot):
-        with self.lock:  
-            if self.spots[floor][spot] is not None:
-                car, entry_time = self.spots[floor][spot]
-                self.spots[floor][spot] = None
-                return car, entry_time
-            else:
-                print(f"Spot {spot} on floor {floor} is already empty.")
-                return None
-
-    def remove_car_by_id(self, car_id):
-        with self.lock:  
-            for floor in range(self.floors):
-                for spot in range(self.places_per_floor):
-                    if self.spots[floor][spot] is not None and self.spots[floor][spot][0].car_id == car_id:
-                        car, entry_time = self.spots[floor][spot]
-                        self.spots[floor][spot] = None
-                        return car, entry_time
-            debug_print(f"Car {car_id} not found in the parking lot.")
-            return None
-
-    def get_number_of_cars(self, floor):
-        with self.lock:  
-            return sum(1 for spot in self.spots[floor] if spot is not None)
-
-    def get_total_cars(self):
-        return sum(self.get_number_of_cars(floor) for floor in range(self.floors))
-
-    def read_spot(self, floor, spot):
-        with self.lock: 
-            return self.spots[floor][spot]
-        
-    def read_spot_raw(self, floor, spot):
-        real_floor = ord(floor) - ord('A')
-        real_spot = spot - 1
-        return self.read_spot(real_floor, real_spot)
-        
-    def get_1D_spots(self):
-        with self.lock:  
-            return [spot for floor in self.spots for spot in floor]
-        
-    def get_all_cars(self):
-        with self.lock:  
-            return [car for floor in self.spots for spot in floor if spot is not None for car, _ in [spot]]
-
-class Subscriptions:
-    def __init__(self):
-        self.subscriptions = {}
-        self.lock = threading.Lock()
-
-    def add_subscription(self, car_id, floor, spot):
-        with self.lock:
-            if 10 * floor + spot in self.subscriptions:
-                debug_print(f"Error: Subscription already exists for car {Subscriptions[10 * floor + spot]} at floor {floor}, spot {spot}.")
-                return
-            self.subscriptions[10 * floor + spot] = car_id
-
-    def add_subscription_raw(self, car_id, floor, spot):
-        real_floor = ord(floor) - ord('A')
-        real_spot = spot - 1
-        return self.add_subscription(car_id, real_floor, real_spot)
-
-    def remove_subscription(self, floor, spot):
-        with self.lock:
-            if 10 * floor + spot in self.subscriptions:
-                del self.subscriptions[10 * floor + spot]
-
-    def get_subscription_raw(self, floor, spot):
-        real_floor = ord(floor) - ord('A')
-        real_spot = spot - 1
-        return self.get_subscription(real_floor, real_spot)
-
-    def get_subscription(self, floor, spot):
-        with self.lock:
-            if 10 * floor + spot in self.subscriptions:
-                return self.subscriptions[10 * floor + spot]
-            return None
+# Most commands waiting for the serial writer, submitting another one blocks until the writer catches up.
+# The event generator is already held back from WRITE_HIGH_WATER_MARK on.
+WRITE_QUEUE_SIZE = 256
+WRITE_HIGH_WATER_MARK = 3 * WRITE_QUEUE_SIZE // 4
+# Grade several boards at once: one session per port, each in its own process
+BOARD_PORTS = []
+BOARD_REPORT_FILE = None
+OVERVIEW_INTERVAL = 0.5
+
+# Seeded batch evaluation on the simulated board, BATCH_SEEDS = range(1000) runs a thousand sessions
+BATCH_SEEDS = None
+BATCH_SUMMARY_FILE = 'batch_summary.json'
+# Traffic pattern of the event generator, one of WORKLOADS. WORKLOAD_RATE is in events per second
+# (None for the profile's own rate) and speeds up or slows down the trace workload instead.
+WORKLOAD = 'default'
+WORKLOAD_RATE = None
+WORKLOAD_TRACE_FILE = None
+# Occupancy is sampled this often on the virtual clock
+OCCUPANCY_SAMPLE_INTERVAL = 1.0
+
+class GlyphCache:
+    def __init__(self, capacity=GLYPH_CACHE_SIZE):
+        self.capacity = capacity
+        self.glyphs = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        key = (text, color, font)
+        glyph = self.glyphs.get(key)
+        if glyph is not None:
+            self.glyphs.move_to_end(key)
+            self.hits += 1
+            return glyph
+        self.misses += 1
+        glyph = font.render(text, True, color)
+        self.glyphs[key] = glyph
+        if len(self.glyphs) > self.capacity:
+            self.glyphs.popitem(last=False)
+        return glyph
+
+class FloorTile:
+    # A floor as last drawn on a surface. apply() returns only the spots that changed since, so a new
+    # snapshot of the floor is drawn by patching those spots instead of repainting the whole floor.
+    def __init__(self, floor, surface):
+        self.floor = floor
+        self.surface = surface
+        self.view = None
+        self.cars = {}
+        self.subscribed = frozenset()
+        self.version = 0
+
+    def apply(self, view):
+        # (spot, car or None, subscribed) for every spot whose car or subscription changed
+        if view is self.view:
+            return []
+        cars = dict(view.cars)
+        subscribed = frozenset(view.subscribed_spots)
+        changed = {spot for spot, _ in cars.items() ^ self.cars.items()}
+        changed.update(subscribed ^ self.subscribed)
+        self.view, self.cars, self.subscribed = view, cars, subscribed
+        if changed:
+            self.version += 1
+        return [(spot, cars.get(spot), spot in subscribed) for spot in changed]
 
 class Drawer:
-    def __init__(self, screen_width, screen_height, display_width, floors, cars_per_floor, simulator_caption, 
-                 car_queue: CarQueue, parking_lot: ParkingLot, subscriptions: Subscriptions, serial_manager):
+    # The lot is laid out as a grid of floor tiles in world coordinates (pixels at zoom 1) and shown through
+    # a zoomable, scrollable viewport. Every floor is drawn on its own cached tile that is patched when the
+    # floor changes, so a frame costs the changed spots and one blit per changed floor. Floors whose spots
+    # would be smaller than DETAIL_SPOT_WIDTH on screen are drawn as a heat map, one pixel per spot scaled up.
+    VIEWPORT = 'viewport'
 
-        self.car_queue = car_queue
-        self.parking_lot = parking_lot
-        self.subscriptions = subscriptions
-        self.serial_manager = serial_manager
+    def __init__(self, screen_width, screen_height, display_width, floors, cars_per_floor, simulator_caption,
+                 snapshots: SnapshotPublisher, fps=DRAWER_FPS, protocol=STANDARD_PROTOCOL):
+
+        self.snapshots = snapshots
+        self.fps = fps
+        self.protocol = protocol
 
         self.screen_width = screen_width
         self.screen_height = screen_height
@@ -234,18 +174,15 @@ class Drawer:
 
         self.floors = floors
         self.cars_per_floor = cars_per_floor
-        self.places_per_column = cars_per_floor // 2
-        self.queue_places_per_column = 2
-
-        self.parking_height = self.places_per_column * screen_height // (self.places_per_column + self.queue_places_per_column + 1)
-        self.queue_height = self.queue_places_per_column * screen_height // (self.places_per_column + self.queue_places_per_column + 1)
-        self.empty_height = screen_height - self.parking_height - self.queue_height
-        self.floor_width = self.game_area_width // floors
-        self.car_width, self.car_height = self.floor_width // 3, self.parking_height // (self.places_per_column * 1.2)
+        # Spots of a floor go in columns, about two rows per column keeps a tile roughly square
+        self.columns = max(1, round(math.sqrt(cars_per_floor / 2)))
+        self.rows = (cars_per_floor + self.columns - 1) // self.columns
+        self.tile_width = 2 * TILE_PADDING + self.columns * (SPOT_WIDTH + SPOT_GAP)
+        self.tile_height = TILE_HEADER + TILE_PADDING + self.rows * (SPOT_HEIGHT + SPOT_GAP)
 
-        self.floor_font_size = 50
         self.display_font = pygame.font.SysFont(None, 24)
-        self.floor_font = pygame.font.SysFont(None, self.floor_font_size)
+        # Spot and header fonts by size, they scale with the zoom
+        self.fonts = {}
         self.gray_color = (128, 128, 148)
         self.white_color = (255, 255, 255)
         self.red_color = (255, 0, 0)
@@ -253,18 +190,52 @@ class Drawer:
         self.black_color = (0, 0, 0)
         self.text_color = (255, 255, 255)
         self.green_color = (0, 255, 0)
+        self.background_color = (60, 60, 72)
+        # Heat map: free, parked and free but subscribed spots on a floor colored from empty to full
+        self.heat_free_color = (70, 70, 84)
+        self.heat_parked_color = (255, 170, 60)
+        self.heat_subscribed_color = (170, 40, 40)
+        self.heat_empty_color = (40, 110, 60)
+        self.heat_full_color = (190, 50, 40)
 
-        self.parking_spots = self.__init_parking_spots()
         self.queue_spots = self.__init_queue_spots()
-        self.floor_character_spots = self.__init_floor_character_spots()
+        self.viewport = pygame.Rect(0, 0, self.game_area_width, self.queue_top)
+        self.tile_columns = self.__init_tile_columns()
+        self.tile_rows = (floors + self.tile_columns - 1) // self.tile_columns
+        self.world_width = self.tile_columns * self.tile_width
+        self.world_height = self.tile_rows * self.tile_height
+        self.fit_zoom = min(self.viewport.width / self.world_width, self.viewport.height / self.world_height)
+        self.max_zoom = max(MAX_ZOOM, self.fit_zoom)
+        self.min_zoom = self.fit_zoom
+        # Floor rows of the panel that leave room for the rest of it above the status line
+        self.panel_floor_rows = max(1, min(floors, (screen_height - 150) // 30 - 9))
+        self.region_rects = {
+            self.VIEWPORT: self.viewport,
+            DirtyRegions.QUEUE: pygame.Rect(0, self.queue_top, self.game_area_width, screen_height - self.queue_top),
+            DirtyRegions.PANEL: pygame.Rect(self.game_area_width, 0, display_width, screen_height),
+        }
         self.screen = pygame.display.set_mode((screen_width, screen_height))
         pygame.display.set_caption(simulator_caption)
-        
-        # Game statistics
-        self.game_status = 0
-        self.calculated_fee = 0
-        self.simulator_fee = 0
-        self.received_empty_spaces = 0
+        self.glyph_cache = GlyphCache()
+        self.static_layer = self.__init_static_layer()
+
+        # Detail tiles in least recently used order and the heat map of every floor, with its scaled copy
+        self.detail_tiles = collections.OrderedDict()
+        self.heat_tiles = {}
+        self.scaled_heat_tiles = {}
+        self.visible_floors = []
+        # Zoom and pan requests from the event thread, applied by the drawing thread
+        self.view_requests = []
+        self.view_lock = threading.Lock()
+        self.zoom = None
+        self.offset = (0.0, 0.0)
+        self.__set_view(self.fit_zoom, 0.0, 0.0)
+
+        # Frame timing in milliseconds
+        self.frame_count = 0
+        self.last_frame_time = 0
+        self.total_frame_time = 0
+        self.max_frame_time = 0
 
         self.running = True
         self.drawer_thread = threading.Thread(target=self.__drawing_loop, daemon=True)
@@ -273,156 +244,538 @@ class Drawer:
     def stop(self):
         if self.running:
             self.running = False
+            self.snapshots.wake()
             self.drawer_thread.join()
+            debug_print("Frame time: average {:.3f} ms, maximum {:.3f} ms over {} frames, glyph cache {} hits / {} misses.".format(
+                *self.get_frame_statistics()[:2], self.frame_count, self.glyph_cache.hits, self.glyph_cache.misses))
+
+    def get_frame_statistics(self):
+        if self.frame_count == 0:
+            return 0, 0, 0
+        return self.total_frame_time / self.frame_count, self.max_frame_time, self.last_frame_time
+
+    def zoom_by(self, factor, position=None):
+        # Zooms around a screen position, the center of the viewport by default
+        self.__request_view(('zoom', factor, position))
+
+    def pan(self, dx, dy):
+        # Moves the view by screen pixels
+        self.__request_view(('pan', dx, dy))
+
+    def fit(self):
+        self.__request_view(('fit',))
+
+    def handle_event(self, event):
+        # Mouse wheel or +/- zoom, dragging or the arrow keys pan and Home shows the whole lot.
+        # Returns whether the event was one of these.
+        if event.type == pygame.MOUSEWHEEL:
+            self.zoom_by(ZOOM_STEP ** event.y, pygame.mouse.get_pos())
+        elif event.type == pygame.MOUSEMOTION and event.buttons[0]:
+            self.pan(-event.rel[0], -event.rel[1])
+        elif event.type != pygame.KEYDOWN:
+            return False
+        elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+            self.zoom_by(ZOOM_STEP)
+        elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+            self.zoom_by(1 / ZOOM_STEP)
+        elif event.key == pygame.K_LEFT:
+            self.pan(-self.viewport.width // 4, 0)
+        elif event.key == pygame.K_RIGHT:
+            self.pan(self.viewport.width // 4, 0)
+        elif event.key == pygame.K_UP:
+            self.pan(0, -self.viewport.height // 4)
+        elif event.key == pygame.K_DOWN:
+            self.pan(0, self.viewport.height // 4)
+        elif event.key == pygame.K_HOME:
+            self.fit()
+        else:
+            return False
+        return True
+
+    def __request_view(self, request):
+        with self.view_lock:
+            self.view_requests.append(request)
+        self.snapshots.wake()
+
+    def __apply_view_requests(self):
+        # Returns whether the view moved
+        with self.view_lock:
+            requests = self.view_requests
+            self.view_requests = []
+        zoom, (x, y) = self.zoom, self.offset
+        for request in requests:
+            if request[0] == 'zoom':
+                position = request[2] if request[2] is not None else self.viewport.center
+                # The world point under the position stays where it is
+                world_x = x + (position[0] - self.viewport.x) / zoom
+                world_y = y + (position[1] - self.viewport.y) / zoom
+                zoom = min(self.max_zoom, max(self.min_zoom, zoom * request[1]))
+                x = world_x - (position[0] - self.viewport.x) / zoom
+                y = world_y - (position[1] - self.viewport.y) / zoom
+            elif request[0] == 'pan':
+                x += request[1] / zoom
+                y += request[2] / zoom
+            else:
+                zoom, x, y = self.fit_zoom, 0.0, 0.0
+        return self.__set_view(zoom, x, y)
+
+    def __set_view(self, zoom, x, y):
+        # A lot narrower or lower than the viewport is centered, otherwise the view stays on the lot
+        visible_width, visible_height = self.viewport.width / zoom, self.viewport.height / zoom
+        if self.world_width <= visible_width:
+            x = (self.world_width - visible_width) / 2
+        else:
+            x = min(max(x, 0.0), self.world_width - visible_width)
+        if self.world_height <= visible_height:
+            y = (self.world_height - visible_height) / 2
+        else:
+            y = min(max(y, 0.0), self.world_height - visible_height)
+        if zoom == self.zoom and (x, y) == self.offset:
+            return False
+        if zoom != self.zoom:
+            self.zoom = zoom
+            self.detail = SPOT_WIDTH * zoom >= DETAIL_SPOT_WIDTH
+            self.detail_tiles.clear()
+            self.scaled_heat_tiles.clear()
+            self.spot_rects = self.__init_spot_rects()
+            self.tile_base = self.__init_tile_base() if self.detail else None
+        self.offset = (x, y)
+        self.visible_floors = self.__find_visible_floors()
+        return True
 
-    def __init_parking_spots(self):
-        parking_spots = []
-        for floor in range(self.floors):
-            for col in range(2):
-                for spot in range(self.places_per_column):
-                    x = floor * self.floor_width + col * (self.floor_width // 2) + self.floor_width // 4 - self.car_width // 2 + ((2 * (col % 2) - 1) * self.car_width) // 6.5
-                    y = spot * (self.parking_height // self.places_per_column) + (self.parking_height // (self.places_per_column * 2) - self.car_height // 2)
-                    parking_spots.append(pygame.Rect(x, y, self.car_width, self.car_height))
-        return parking_spots    
+    def __init_tile_columns(self):
+        # Floor tiles per row that show the whole lot the largest
+        best_columns, best_zoom = 1, 0
+        for columns in range(1, self.floors + 1):
+            rows = (self.floors + columns - 1) // columns
+            zoom = min(self.viewport.width / (columns * self.tile_width), self.viewport.height / (rows * self.tile_height))
+            if zoom > best_zoom:
+                best_columns, best_zoom = columns, zoom
+        return best_columns
 
     def __init_queue_spots(self):
+        # Two rows under the lot, as many places as fit; cars beyond the last place are counted on it
+        columns = max(1, (self.game_area_width - 2 * TILE_PADDING) // (QUEUE_SPOT_WIDTH + SPOT_GAP))
+        columns = min(columns, (4 * self.floors + 1) // 2)
+        self.queue_top = self.screen_height - 2 * (QUEUE_SPOT_HEIGHT + SPOT_GAP) - 2 * TILE_PADDING
         queue_spots = []
-        for queue in range(self.queue_places_per_column):
-            for floor in range(self.floors):
-                for col in range(2):
-                    x = floor * self.floor_width + col * (self.floor_width // 2) + (self.floor_width // 4 - self.car_width // 2)
-                    y = queue * (self.parking_height // self.places_per_column) + (self.parking_height // (self.places_per_column * 2) - self.car_height // 2) + self.empty_height + self.parking_height
-                    queue_spots.append(pygame.Rect(x, y, self.car_width, self.car_height))
+        for row in range(2):
+            for column in range(columns):
+                x = TILE_PADDING + column * (QUEUE_SPOT_WIDTH + SPOT_GAP) + SPOT_GAP // 2
+                y = self.queue_top + TILE_PADDING + row * (QUEUE_SPOT_HEIGHT + SPOT_GAP) + SPOT_GAP // 2
+                queue_spots.append(pygame.Rect(x, y, QUEUE_SPOT_WIDTH, QUEUE_SPOT_HEIGHT))
         return queue_spots
-    
-    def __init_floor_character_spots(self):
-        floor_character_spots = []
-        for floor in range(self.floors):
-            x = floor * self.floor_width + self.floor_width // 2 - 3 * self.floor_font_size // 10
-            y = self.parking_height // 2 - 3 * self.floor_font_size // 10
-            floor_character_spots.append((string.ascii_uppercase[floor], (x, y)))
-        return floor_character_spots
-    
-    def __drawing_loop(self):
-        # TODO : Implement fps for drawing
-        while self.running:
-            self.__draw()
-    
-    def __draw(self):
-        # Clear screen
-        self.screen.fill(self.black_color)
-
-        # Game area background
-        pygame.draw.rect(self.screen, self.gray_color, pygame.Rect(0, 0, self.game_area_width, self.screen_height))
-
-        # Draw vertical lines to divide floors
-        for i in range(1, self.floors):
-            pygame.draw.line(self.screen, self.yellow_color, (i * self.floor_width, 0), (i * self.floor_width, self.parking_height), 5)
-
-        # Draw horizontal line to separate parking and queue areas
-        pygame.draw.line(self.screen, (60, 30, 20), (3 * self.car_width // 2, self.parking_height + self.empty_height - 10), (self.game_area_width, self.parking_height + self.empty_height - 10), 10)
-
-        # Draw parking spot lines
-        for park_ind in range(self.cars_per_floor):
-            for floor in range(self.floors):
-                spot = self.parking_spots[floor * self.cars_per_floor + park_ind]
-                color = self.white_color
-                if self.subscriptions.get_subscription(floor, park_ind) is not None:
-                    color = self.red_color
-                pygame.draw.rect(self.screen, color, spot, 2)
-                id_text = self.display_font.render(str(park_ind + 1), True, color)
-                text_rect = id_text.get_rect(center=spot.center)
-                self.screen.blit(id_text, text_rect)
+
+    def __init_spot_rects(self):
+        # Spot rectangles inside a tile at the current zoom, in columns from the top left
+        zoom = self.zoom
+        spot_rects = []
+        for spot in range(self.cars_per_floor):
+            column, row = divmod(spot, self.rows)
+            left = TILE_PADDING + column * (SPOT_WIDTH + SPOT_GAP) + SPOT_GAP / 2
+            top = TILE_HEADER + row * (SPOT_HEIGHT + SPOT_GAP) + SPOT_GAP / 2
+            spot_rects.append(pygame.Rect(round(left * zoom), round(top * zoom), round(SPOT_WIDTH * zoom), round(SPOT_HEIGHT * zoom)))
+        return spot_rects
+
+    def __font(self, size):
+        size = max(8, int(size))
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts[size] = pygame.font.SysFont(None, size)
+        return font
+
+    def __init_tile_base(self):
+        # An empty floor at the current zoom: spot outlines and numbers, shared by every detail tile
+        base = pygame.Surface(self.__tile_size()).convert()
+        base.fill(self.gray_color)
+        pygame.draw.rect(base, self.yellow_color, base.get_rect(), 2)
+        font = self.__font(SPOT_FONT_SIZE * self.zoom)
+        for spot, rect in enumerate(self.spot_rects):
+            self.__draw_spot_outline(base, rect, spot, self.white_color, font)
+        return base
+
+    def __init_static_layer(self):
+        # Everything that never changes is painted once and blitted per region
+        layer = pygame.Surface((self.screen_width, self.screen_height)).convert()
+        layer.fill(self.black_color)
+
+        # Lot and queue backgrounds, separated by a line
+        layer.fill(self.background_color, self.viewport)
+        pygame.draw.rect(layer, self.gray_color, pygame.Rect(0, self.queue_top, self.game_area_width, self.screen_height - self.queue_top))
+        pygame.draw.line(layer, (60, 30, 20), (0, self.queue_top + 4), (self.game_area_width, self.queue_top + 4), 8)
 
         # Draw queue spot lines
         for queue in self.queue_spots:
-            pygame.draw.rect(self.screen, self.white_color, queue, 2)
-
-        # Draw Floor Characters
-        for char, position in self.floor_character_spots:
-            text = self.floor_font.render(char, True, self.white_color)
-            self.screen.blit(text, position)
-
-        # Draw parked cars
-        for car, spot in zip(self.parking_lot.get_1D_spots(), self.parking_spots):
-            if car is not None:
-                pygame.draw.rect(self.screen, car[0].car_color, spot)
-                text = f"{car[0].car_id}"
-                if car[0].subscribed:
-                    text += "*"
-                id_text = self.display_font.render(text, True, self.white_color)
-                text_rect = id_text.get_rect(center=spot.center)
-                self.screen.blit(id_text, text_rect)
-
-        # Display queue cars
-        for car, queue_spot in zip(self.car_queue.get_queue(), self.queue_spots):
-            pygame.draw.rect(self.screen, car.car_color, queue_spot)
-            text = f"{car.car_id}"
-            if car.subscribed:
-                text += "*"
-            id_text = self.display_font.render(text, True, self.white_color)
-            text_rect = id_text.get_rect(center=queue_spot.center)
-            self.screen.blit(id_text, text_rect)
-
-        # Display cars per floor information
-        for floor in range(self.floors):
-            floor_cars = self.parking_lot.get_number_of_cars(floor)
-            floor_text = self.display_font.render(f'Floor {floor + 1}: {floor_cars} cars', True, self.text_color)
-            self.screen.blit(floor_text, (self.game_area_width + 20, 20 + floor * 30))
-
-        (avg_time, min_time, max_time) = self.serial_manager.get_statistics()
-
-        # Display statistics
-        self.screen.blit(self.display_font.render(f"Time statistics:" , True, self.text_color),
-                          (self.game_area_width + 20, 40 + (self.floors + 0) * 30))
-        self.screen.blit(self.display_font.render(f"Average: {avg_time:05.2f}" , True, self.text_color),
-                          (self.game_area_width + 20, 40 + (self.floors + 1) * 30))
-        self.screen.blit(self.display_font.render(f"Minimum: {min_time:05.2f}" , True, self.text_color),
-                          (self.game_area_width + 20, 40 + (self.floors + 2) * 30))
-        self.screen.blit(self.display_font.render(f"Maximum: {max_time:05.2f}" , True, self.text_color),
-                          (self.game_area_width + 20, 40 + (self.floors + 3) * 30))
-        
-        self.screen.blit(self.display_font.render(f"Total Earnings:" , True, self.text_color),
-                          (self.game_area_width + 20, 60 + (self.floors + 4) * 30))
-        self.screen.blit(self.display_font.render(f"Simulator: {self.simulator_fee:03}" , True, self.text_color),
-                            (self.game_area_width + 20, 60 + (self.floors + 5) * 30))
-        self.screen.blit(self.display_font.render(f"Received: {self.calculated_fee:03}" , True, self.text_color),
-                            (self.game_area_width + 20, 60 + (self.floors + 6) * 30))
-        
-        self.screen.blit(self.display_font.render(f"Empty Places:" , True, self.text_color),
-                          (self.game_area_width + 20, 80 + (self.floors + 7) * 30))
-        self.screen.blit(self.display_font.render(f"Simulator: {((self.floors * self.cars_per_floor) -self.parking_lot.get_total_cars()):02}" , True, self.text_color),
-                            (self.game_area_width + 20, 80 + (self.floors + 8) * 30))
-        self.screen.blit(self.display_font.render(f"Received: : {self.received_empty_spaces:02}" , True, self.text_color),
-                            (self.game_area_width + 20, 80 + (self.floors + 9) * 30))
+            pygame.draw.rect(layer, self.white_color, queue, 2)
+
+        # Panel labels
+        rows = self.panel_floor_rows
+        layer.blit(self.glyph_cache.render(self.display_font, "Latency p50/p99 ms:", self.text_color),
+                   (self.game_area_width + 20, 40 + (rows + 0) * 30))
+        layer.blit(self.glyph_cache.render(self.display_font, "Total Earnings:", self.text_color),
+                   (self.game_area_width + 20, 60 + (rows + 4) * 30))
+        layer.blit(self.glyph_cache.render(self.display_font, "Empty Places:", self.text_color),
+                   (self.game_area_width + 20, 80 + (rows + 7) * 30))
+        layer.blit(self.glyph_cache.render(self.display_font, "Status:", self.text_color),
+                   (self.game_area_width + 20, self.screen_height - 40))
+        return layer
+
+    def __draw_spot_outline(self, surface, spot, park_ind, color, font=None):
+        pygame.draw.rect(surface, color, spot, 2)
+        id_text = self.glyph_cache.render(font or self.display_font, str(park_ind + 1), color)
+        surface.blit(id_text, id_text.get_rect(center=spot.center))
+
+    def __draw_car(self, surface, car, spot, font=None):
+        pygame.draw.rect(surface, car.car_color, spot)
+        text = f"{car.car_id}"
+        if car.subscribed:
+            text += "*"
+        id_text = self.glyph_cache.render(font or self.display_font, text, self.white_color)
+        surface.blit(id_text, id_text.get_rect(center=spot.center))
+
+    def __draw_text(self, text, color, position):
+        self.screen.blit(self.glyph_cache.render(self.display_font, text, color), position)
 
-        
-        
-        self.screen.blit(self.display_font.render(f"Status:" , True, self.text_color), (self.game_area_width + 20, self.screen_height - 40))
-        if self.game_status == 0:
-            self.screen.blit(self.display_font.render(f"WAITING" , True, self.text_color), (self.game_area_width + 100, self.screen_height - 40))
-        elif self.game_status == 1:
-            self.screen.blit(self.display_font.render(f"RUNNING" , True, self.green_color), (self.game_area_width + 100, self.screen_height - 40))
-        elif self.game_status == 2:
-            self.screen.blit(self.display_font.render(f"FINISHED" , True, self.red_color), (self.game_area_width + 100, self.screen_height - 40))
+    def __drawing_loop(self):
+        frame_interval = 1.0 / self.fps
+        # The first frame paints every region
+        drawn = None
+        while self.running:
+            # Sleep until a new snapshot is published or the view moves instead of repainting an unchanged screen
+            if not self.snapshots.wait(DRAWER_IDLE_TIMEOUT):
+                continue
+            frame_start = time.perf_counter()
+            snapshot = self.snapshots.snapshot
+            moved = self.__apply_view_requests()
+            if drawn is not None and snapshot.version == drawn.version and not moved:
+                continue
+            regions = self.__changed_regions(drawn, snapshot)
+            if moved:
+                regions.add(self.VIEWPORT)
+            if regions and self.running:
+                self.__draw(snapshot, regions)
+                self.__record_frame_time((time.perf_counter() - frame_start) * 1000.0)
+            drawn = snapshot
+            remaining = frame_interval - (time.perf_counter() - frame_start)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def __record_frame_time(self, frame_time):
+        self.frame_count += 1
+        self.last_frame_time = frame_time
+        self.total_frame_time += frame_time
+        if frame_time > self.max_frame_time:
+            self.max_frame_time = frame_time
+
+    def __changed_regions(self, drawn, snapshot):
+        if drawn is None:
+            return set(self.region_rects.keys())
+        # Views of unchanged floors are shared between snapshots
+        regions = {DirtyRegions.floor(floor) for floor, view in enumerate(snapshot.floors) if view is not drawn.floors[floor]}
+        if snapshot.queue != drawn.queue:
+            regions.add(DirtyRegions.QUEUE)
+        if snapshot.panel != drawn.panel:
+            regions.add(DirtyRegions.PANEL)
+        return regions
+
+    def __draw(self, snapshot, regions):
+        updated_rects = []
+        for region in regions:
+            if region == self.VIEWPORT:
+                continue
+            if region[0] == 'floor':
+                if self.VIEWPORT not in regions:
+                    rect = self.__draw_floor(region[1], snapshot.floors[region[1]])
+                    if rect is not None:
+                        updated_rects.append(rect)
+                continue
+            rect = self.region_rects[region]
+            self.screen.set_clip(rect)
+            self.screen.blit(self.static_layer, rect, rect)
+            if region == DirtyRegions.PANEL:
+                self.__draw_panel(snapshot.panel)
+            else:
+                self.__draw_queue(snapshot.queue)
+            updated_rects.append(rect)
+        if self.VIEWPORT in regions:
+            self.screen.set_clip(self.viewport)
+            self.screen.blit(self.static_layer, self.viewport, self.viewport)
+            for floor in self.visible_floors:
+                self.__draw_floor(floor, snapshot.floors[floor])
+            updated_rects.append(self.viewport)
+        self.screen.set_clip(None)
 
         # Update display
-        pygame.display.flip()
+        pygame.display.update(updated_rects)
+
+    def __tile_size(self):
+        return round(self.tile_width * self.zoom), round(self.tile_height * self.zoom)
+
+    def __tile_rect(self, floor):
+        # Screen rectangle of a floor's tile, edges rounded on their own so neighbouring tiles meet
+        row, column = divmod(floor, self.tile_columns)
+        x, y = self.offset
+        left = self.viewport.x + round((column * self.tile_width - x) * self.zoom)
+        top = self.viewport.y + round((row * self.tile_height - y) * self.zoom)
+        right = self.viewport.x + round(((column + 1) * self.tile_width - x) * self.zoom)
+        bottom = self.viewport.y + round(((row + 1) * self.tile_height - y) * self.zoom)
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def __find_visible_floors(self):
+        x, y = self.offset
+        first_column = max(0, int(x // self.tile_width))
+        last_column = min(self.tile_columns - 1, int((x + self.viewport.width / self.zoom) // self.tile_width))
+        first_row = max(0, int(y // self.tile_height))
+        last_row = min(self.tile_rows - 1, int((y + self.viewport.height / self.zoom) // self.tile_height))
+        return [row * self.tile_columns + column for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1) if row * self.tile_columns + column < self.floors]
+
+    def __draw_floor(self, floor, floor_view):
+        # Blits the floor's tile, patched to floor_view, and returns the screen area drawn or None when it is out of view
+        rect = self.__tile_rect(floor)
+        if not rect.colliderect(self.viewport):
+            return None
+        self.screen.set_clip(self.viewport)
+        if self.detail:
+            self.screen.blit(self.__detail_tile(floor, floor_view).surface, rect)
+        else:
+            self.__draw_heat_tile(floor, floor_view, rect)
+        return rect.clip(self.viewport)
+
+    def __detail_tile(self, floor, floor_view):
+        tile = self.detail_tiles.get(floor)
+        created = tile is None
+        if created:
+            tile = self.detail_tiles[floor] = FloorTile(floor, self.tile_base.copy())
+            # Cached tiles go least recently used first, never below what is in view
+            while len(self.detail_tiles) > max(TILE_CACHE_SIZE, len(self.visible_floors)):
+                self.detail_tiles.popitem(last=False)
+        else:
+            self.detail_tiles.move_to_end(floor)
+        changes = tile.apply(floor_view)
+        if changes:
+            font = self.__font(SPOT_FONT_SIZE * self.zoom)
+            for spot, car, subscribed in changes:
+                rect = self.spot_rects[spot]
+                tile.surface.blit(self.tile_base, rect, rect)
+                if subscribed:
+                    # Subscribed spots are outlined in red
+                    tile.surface.fill(self.gray_color, rect)
+                    self.__draw_spot_outline(tile.surface, rect, spot, self.red_color, font)
+                if car is not None:
+                    self.__draw_car(tile.surface, car, rect, font)
+        if changes or created:
+            self.__draw_tile_header(tile)
+        return tile
+
+    def __draw_tile_header(self, tile):
+        # Floor name and number of parked cars
+        floor = self.protocol.floor_name(tile.floor)
+        header = pygame.Rect(2, 2, tile.surface.get_width() - 4, round(TILE_HEADER * self.zoom) - 2)
+        tile.surface.fill(self.gray_color, header)
+        text = self.glyph_cache.render(self.__font(TILE_HEADER * self.zoom * 0.8), f"{floor}  {len(tile.cars)}/{self.cars_per_floor}",
+                                       self.white_color)
+        tile.surface.blit(text, text.get_rect(midleft=(round(TILE_PADDING * self.zoom), header.centery)))
+
+    def __draw_heat_tile(self, floor, floor_view, rect):
+        tile = self.heat_tiles.get(floor)
+        if tile is None:
+            surface = pygame.Surface((self.columns, self.rows)).convert()
+            surface.fill(self.heat_free_color)
+            # Places of a last column that is not full
+            for spot in range(self.cars_per_floor, self.columns * self.rows):
+                surface.set_at(divmod(spot, self.rows), self.background_color)
+            tile = self.heat_tiles[floor] = FloorTile(floor, surface)
+        for spot, car, subscribed in tile.apply(floor_view):
+            color = self.heat_parked_color if car is not None else self.heat_subscribed_color if subscribed else self.heat_free_color
+            tile.surface.set_at(divmod(spot, self.rows), color)
+        scaled = self.scaled_heat_tiles.get(floor)
+        if scaled is None or scaled[0] != tile.version:
+            size = (round(self.columns * (SPOT_WIDTH + SPOT_GAP) * self.zoom), round(self.rows * (SPOT_HEIGHT + SPOT_GAP) * self.zoom))
+            scaled = self.scaled_heat_tiles[floor] = (tile.version, pygame.transform.scale(tile.surface, size))
+
+        # The tile itself is colored from empty to full
+        fullness = len(tile.cars) / self.cars_per_floor
+        color = tuple(round(empty + (full - empty) * fullness) for empty, full in zip(self.heat_empty_color, self.heat_full_color))
+        self.screen.fill(color, rect)
+        pygame.draw.rect(self.screen, self.black_color, rect, 1)
+        self.screen.blit(scaled[1], (rect.x + round(TILE_PADDING * self.zoom), rect.y + round(TILE_HEADER * self.zoom)))
+        header_height = round(TILE_HEADER * self.zoom)
+        if header_height >= 10:
+            text = self.glyph_cache.render(self.__font(header_height * 0.8), self.protocol.floor_name(floor), self.white_color)
+            self.screen.blit(text, text.get_rect(midleft=(rect.x + round(TILE_PADDING * self.zoom), rect.y + header_height // 2 + 1)))
+
+    def __draw_queue(self, queue_view):
+        # Display queue cars, the last place shows how many more are waiting
+        overflow = len(queue_view) - len(self.queue_spots)
+        for car, queue_spot in zip(queue_view, self.queue_spots):
+            self.__draw_car(self.screen, car, queue_spot)
+        if overflow > 0:
+            queue_spot = self.queue_spots[-1]
+            self.screen.fill(self.gray_color, queue_spot)
+            pygame.draw.rect(self.screen, self.white_color, queue_spot, 2)
+            text = self.glyph_cache.render(self.display_font, f"+{overflow + 1}", self.white_color)
+            self.screen.blit(text, text.get_rect(center=queue_spot.center))
+
+    def __draw_panel(self, panel):
+        x = self.game_area_width + 20
+        rows = self.panel_floor_rows
+
+        # Display cars per floor information, the floors that do not fit are summed on the last row
+        for floor in range(rows):
+            if floor == rows - 1 and self.floors > rows:
+                self.__draw_text(f'Floors {floor + 1}-{self.floors}: {sum(panel.floor_counts[floor:])} cars', self.text_color,
+                                 (x, 20 + floor * 30))
+            else:
+                self.__draw_text(f'Floor {floor + 1}: {panel.floor_counts[floor]} cars', self.text_color, (x, 20 + floor * 30))
+
+        # Display per command latency, unanswered commands in parentheses
+        for row, (command, p50, p99, unanswered) in enumerate(panel.latency):
+            self.__draw_text(f"{command} {p50:.1f}/{p99:.1f} ({unanswered})", self.text_color, (x, 40 + (rows + row + 1) * 30))
+
+        self.__draw_text(f"Simulator: {panel.simulator_fee:03}", self.text_color, (x, 60 + (rows + 5) * 30))
+        self.__draw_text(f"Received: {panel.calculated_fee:03}", self.text_color, (x, 60 + (rows + 6) * 30))
+
+        self.__draw_text(f"Simulator: {panel.free_spots:02}", self.text_color, (x, 80 + (rows + 8) * 30))
+        self.__draw_text(f"Received: : {panel.received_empty_spaces:02}", self.text_color, (x, 80 + (rows + 9) * 30))
+
+        if panel.game_status == 0:
+            self.__draw_text("WAITING", self.text_color, (self.game_area_width + 100, self.screen_height - 40))
+        elif panel.game_status == 1:
+            self.__draw_text("RUNNING", self.green_color, (self.game_area_width + 100, self.screen_height - 40))
+        elif panel.game_status == 2:
+            self.__draw_text("FINISHED", self.red_color, (self.game_area_width + 100, self.screen_height - 40))
+
+class CommandWriter:
+    # Sends command frames from its own thread so a slow or flow controlled port does not block the caller.
+    # Everything queued while a write is in progress goes out in the next single write() call. The queue holds
+    # at most size frames, submit() blocks while it is full and drops frames once the writer is closed.
+    # Producers that can wait call wait_for_space() once the queue is congested, before it is full.
+    def __init__(self, serial_port, size=WRITE_QUEUE_SIZE, high_water_mark=WRITE_HIGH_WATER_MARK):
+        self.serial = serial_port
+        self.size = size
+        self.high_water_mark = high_water_mark
+        self.frames = collections.deque()
+        self.condition = threading.Condition()
+        self.running = True
+        self.max_depth = 0
+        self.writes = 0
+        self.written_frames = 0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+        self.stalls = 0
+        self.stall_time = 0.0
+        self.full_waits = 0
+        self.full_wait_time = 0.0
+        self.dropped = 0
+        self.writer_thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def submit(self, frame):
+        with self.condition:
+            if self.running and len(self.frames) >= self.size:
+                start = time.perf_counter()
+                self.condition.wait_for(lambda: not self.running or len(self.frames) < self.size)
+                self.full_waits += 1
+                self.full_wait_time += time.perf_counter() - start
+            if not self.running:
+                # Nothing sends it any more
+                self.dropped += 1
+                return
+            self.frames.append(frame)
+            if len(self.frames) > self.max_depth:
+                self.max_depth = len(self.frames)
+            self.condition.notify_all()
+
+    def congested(self):
+        return len(self.frames) >= self.high_water_mark
+
+    def wait_for_space(self):
+        # Blocks while the queue is at its high water mark and returns the seconds spent waiting
+        if not self.congested():
+            return 0.0
+        start = time.perf_counter()
+        with self.condition:
+            self.condition.wait_for(lambda: not self.running or len(self.frames) < self.high_water_mark)
+        stalled = time.perf_counter() - start
+        self.record_stall(stalled)
+        return stalled
+
+    def record_stall(self, seconds):
+        with self.condition:
+            self.stalls += 1
+            self.stall_time += seconds
+
+    def close(self):
+        # Sends what is still queued, then stops the writer thread
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.writer_thread.join()
 
-class SerialManager:
+    def __write_loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.frames or not self.running)
+                if not self.frames:
+                    return
+                count = len(self.frames)
+                data = b''.join(self.frames)
+                self.frames.clear()
+                self.condition.notify_all()
+            start = time.perf_counter()
+            try:
+                self.serial.write(data)
+            except serial.SerialException as e:
+                print(f"Error writing to serial port: {e}")
+            elapsed = time.perf_counter() - start
+            with self.condition:
+                self.writes += 1
+                self.written_frames += count
+                self.write_time += elapsed
+                if elapsed > self.max_write_time:
+                    self.max_write_time = elapsed
 
-    WAITING = 0
-    GETTING = 1
+    def get_statistics(self):
+        # Times in milliseconds
+        with self.condition:
+            return {
+                "depth": len(self.frames),
+                "max_depth": self.max_depth,
+                "writes": self.writes,
+                "frames": self.written_frames,
+                "frames_per_write": self.written_frames / self.writes if self.writes else 0,
+                "write_time": self.write_time * 1000.0,
+                "max_write_time": self.max_write_time * 1000.0,
+                "stalls": self.stalls,
+                "stall_time": self.stall_time * 1000.0,
+                "full_waits": self.full_waits,
+                "full_wait_time": self.full_wait_time * 1000.0,
+                "dropped": self.dropped,
+            }
+
+class SerialManager:
 
-    def __init__(self, port, baudrate, parity, rtscts, xonxoff):
+    def __init__(self, port, baudrate, parity, rtscts, xonxoff, dirty_regions=None, protocol=STANDARD_PROTOCOL, clock=WALL_CLOCK,
+                 recorder=None, codec=None):
+        # No port is opened for the simulated board or when replaying a recorded session
+        self.serial = None
         try:
-            if BOARD_SIMULATION == False:
+            if BOARD_SIMULATION == False and port is not None:
                 self.serial = serial.Serial(port, baudrate, parity=parity,
                                     rtscts=rtscts, xonxoff=xonxoff, timeout=None)
         except serial.SerialException as e:
             raise
-        self.state = self.WAITING
-        self.data = b''
+        self.recorder = recorder
+        self.protocol = protocol
+        self.codec = codec if codec is not None else ProtocolCodec(protocol)
+        self.clock = clock
+        # Frames by message or command type for the metrics endpoint, counted without locks
+        self.received = collections.Counter()
+        self.rejected = collections.Counter()
+        self.sent = collections.Counter()
+        self.parser = FrameParser(protocol, self.rejected)
+        self.latency = LatencyTracker(self.codec, clock)
         self.time = 0
         self.avg_time = -1
         self.max_time = float('-inf')
@@ -434,28 +787,55 @@ class SerialManager:
         self.messages = queue.Queue()
         self.writer_lock = threading.Lock()
         self.statistics_lock = threading.Lock()
+        self.dirty_regions = dirty_regions
         self.running = False
+        # Set by start(), received frames go to message_handler instead of the messages queue
+        self.message_handler = None
+        self.loop = None
+        # Created by start(), commands are written directly before that
+        self.writer = None
 
-        if BOARD_SIMULATION == False:
+        if self.serial is not None:
             self.receiver_thread = threading.Thread(target=self.read, daemon=True)
 
-    def start(self):
-        self.startTime = time.time()
+    def start(self, loop=None, message_handler=None):
+        # With an event loop the port's file descriptor is watched by the loop instead of a reader thread.
+        # Loops that cannot watch it (Windows) fall back to the thread.
+        self.startTime = self.clock.time()
         self.cmd_count = 0
-        self.state = self.WAITING
-        if BOARD_SIMULATION == False:
+        self.parser = FrameParser(self.protocol, self.rejected)
+        self.message_handler = message_handler
+        if self.serial is not None:
             self.running = True
+            self.writer = CommandWriter(self.serial)
+            if loop is not None:
+                try:
+                    self.serial.timeout = 0
+                    loop.add_reader(self.serial.fileno(), self.__read_available)
+                    self.loop = loop
+                    return
+                except NotImplementedError:
+                    self.serial.timeout = None
             self.receiver_thread.start()
 
     def stop(self):
         if self.running:
             self.running = False
-            self.receiver_thread.join()
+            self.writer.close()
+            if self.loop is not None:
+                self.loop.remove_reader(self.serial.fileno())
+                self.loop = None
+            else:
+                self.receiver_thread.join()
             self.serial.close()
 
+    def __read_available(self):
+        for message in self.parser.feed(self.serial.read(max(1, self.serial.in_waiting))):
+            self.receive(message)
+
     def __update_statistics(self):
         with self.statistics_lock:
-            self.time = time.time()
+            self.time = self.clock.time()
             total_time_passed = (self.time - self.startTime) * 1000.0
             if self.cmd_count > 0:
                 self.avg_time = (total_time_passed) / self.cmd_count
@@ -469,241 +849,530 @@ class SerialManager:
                 if time_passed > self.max_time or self.max_time == -1:
                     self.max_time = time_passed
             self.prev_time = self.time
+        if self.dirty_regions is not None:
+            self.dirty_regions.mark(DirtyRegions.PANEL)
 
     def get_statistics(self):
         with self.statistics_lock:
             if self.cmd_count == 0:
-                return 0, 0, 0
+                avg_time, min_time, max_time = 0, 0, 0
             else:
-                return self.avg_time, self.min_time, self.max_time
+                avg_time, min_time, max_time = self.avg_time, self.min_time, self.max_time
+        return {
+            "average": avg_time,
+            "minimum": min_time,
+            "maximum": max_time,
+            "latency": self.latency.get_statistics(),
+            "writer": self.writer.get_statistics() if self.writer is not None else None,
+        }
 
     def read(self):
         while self.running:
-            byte = self.serial.read(1)
-            if self.state == self.WAITING:
-                if byte == b'$':
-                    self.state = self.GETTING
-                    if (self.data != b''):
-                        print("Error: Uncomplete message received.")
-                    self.data = b''
-            elif self.state == self.GETTING:
-                if byte == b'#':
-                    if (checkMessage(self.data)):
-                        self.messages.put(self.data)
-                        self.cmd_count += 1
-                        self.data = b''
-                        self.__update_statistics()
-                    else:
-                        print("Error: Invalid message received.")
-                    self.data = b''
-                    self.state = self.WAITING
-                else:
-                    self.data = b''.join([self.data, byte])                      
-
-    def write(self, data):
-        with self.writer_lock:
-            if BOARD_SIMULATION == False:
-                self.serial.write(data)
+            # Block for at least one byte, then take everything already buffered by the driver
+            chunk = self.serial.read(max(1, self.serial.in_waiting))
+            for message in self.parser.feed(chunk):
+                self.receive(message)
+
+    def receive(self, message):
+        self.received[message[:3]] += 1
+        self.latency.response_received(message)
+        if self.message_handler is not None:
+            self.message_handler(message)
+        else:
+            self.messages.put(message)
+        self.cmd_count += 1
+        self.__update_statistics()
+
+    def write(self, command, frame=None):
+        # Queues the framed command for the writer thread, frame can be given when it is already built
+        self.record_outgoing(command)
+        if frame is None:
+            frame = b'$' + command + b'#'
+        if self.writer is not None:
+            self.writer.submit(frame)
+        elif self.serial is not None:
+            with self.writer_lock:
+                self.serial.write(frame)
+
+    def congested(self):
+        return self.writer is not None and self.writer.congested()
+
+    def wait_for_space(self):
+        # Backpressure for the event generator, seconds it was held back
+        if self.writer is None:
+            return 0.0
+        return self.writer.wait_for_space()
+
+    def record_stall(self, seconds):
+        if self.writer is not None:
+            self.writer.record_stall(seconds)
+
+    def record_outgoing(self, command):
+        self.sent[command[:3]] += 1
+        if self.recorder is not None:
+            self.recorder.record(SessionRecorder.OUTGOING, self.clock.time(), command)
+
+    def record_incoming(self, message, timestamp):
+        if self.recorder is not None:
+            self.recorder.record(SessionRecorder.INCOMING, timestamp, message)
+
+    def close_recorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+class ProfiledLock:
+    # Stands in for a threading.Lock and records how long callers wait for it. An uncontended
+    # acquire is a single non-blocking try, only waits are timed.
+    def __init__(self, lock, statistics):
+        self.wrapped_lock = lock
+        # [acquisitions, contended acquisitions, total wait, maximum wait]
+        self.statistics = statistics
+
+    def acquire(self, blocking=True, timeout=-1):
+        statistics = self.statistics
+        statistics[0] += 1
+        if self.wrapped_lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self.wrapped_lock.acquire(True, timeout)
+        waited = time.perf_counter() - start
+        statistics[1] += 1
+        statistics[2] += waited
+        if waited > statistics[3]:
+            statistics[3] = waited
+        return acquired
+
+    def release(self):
+        self.wrapped_lock.release()
+
+    def locked(self):
+        return self.wrapped_lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wrapped_lock.release()
+
+class Profiler:
+    # Profiling mode: timing spans around the hot paths, wait times of the engine's locks and a
+    # sampling profiler that walks every thread's stack. Nothing is wrapped or started without it.
+    # Counters are updated without locks, under heavy contention a few updates can be lost.
+    def __init__(self, sample_interval=PROFILE_SAMPLE_INTERVAL):
+        self.sample_interval = sample_interval
+        # name -> [count, total seconds, maximum seconds]
+        self.spans = {}
+        # name -> [acquisitions, contended acquisitions, total wait, maximum wait]
+        self.locks = {}
+        # collapsed stack -> samples
+        self.stacks = collections.Counter()
+        self.samples = 0
+        # How late the sampler woke up, mostly time spent waiting for the GIL
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.start_time = None
+        self.end_time = None
+        self.running = False
+        self.sampler_thread = None
+
+    def wrap(self, name, function):
+        span = self.spans.setdefault(name, [0, 0.0, 0.0])
+        perf_counter = time.perf_counter
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                span[0] += 1
+                span[1] += elapsed
+                if elapsed > span[2]:
+                    span[2] = elapsed
+        return timed
+
+    def lock(self, name, lock):
+        return ProfiledLock(lock, self.locks.setdefault(name, [0, 0, 0.0, 0.0]))
+
+    def instrument(self, game_engine):
+        # Swaps the engine's hot methods and locks for timed ones, before the session threads start
+        def wrap(owner, attribute, name):
+            setattr(owner, attribute, self.wrap(name, getattr(owner, attribute)))
+
+        def lock(owner, attribute, name):
+            if owner is not None:
+                setattr(owner, attribute, self.lock(name, getattr(owner, attribute)))
+
+        wrap(game_engine, '_GameEngine__process_message', 'GameEngine.__process_message')
+        wrap(game_engine, '_GameEngine__generate_event', 'GameEngine.__generate_event')
+        wrap(game_engine, '_GameEngine__send_command', 'GameEngine.__send_command')
+        wrap(game_engine.serial_manager, 'receive', 'SerialManager.receive')
+        if game_engine.snapshots is not None:
+            wrap(game_engine.snapshots, 'publish', 'SnapshotPublisher.publish')
+        if game_engine.drawer is not None:
+            wrap(game_engine.drawer, '_Drawer__draw', 'Drawer.__draw')
+        if game_engine.board_simulation:
+            wrap(game_engine.board_simulator, 'step', 'BoardSimulator.step')
+            # The simulator was handed the unwrapped receive()
+            game_engine.board_simulator.deliver_message = game_engine.serial_manager.receive
+
+        lock(game_engine, 'lock', 'GameEngine.lock')
+        lock(game_engine.parking_lot, 'lock', 'ParkingLot.lock')
+        lock(game_engine.car_queue, 'lock', 'CarQueue.lock')
+        lock(game_engine.subsriptions, 'lock', 'Subscriptions.lock')
+        lock(game_engine.serial_manager, 'writer_lock', 'SerialManager.writer_lock')
+        lock(game_engine.serial_manager, 'statistics_lock', 'SerialManager.statistics_lock')
+        lock(game_engine.serial_manager.latency, 'lock', 'LatencyTracker.lock')
+        lock(game_engine.dirty_regions, 'lock', 'DirtyRegions.lock')
+        lock(game_engine.snapshots, 'publish_lock', 'SnapshotPublisher.publish_lock')
 
-class BoardSimulator:
-    def __init__(self, debug_messages, debug_commands):
-        self.parking_lot = [[None for _ in range(10)] for _ in range(4)]
-        self.subscribed_cars = {}
-        self.subscribed_places = {}
-        self.car_queue = queue.Queue()
+    def start(self):
+        self.start_time = time.perf_counter()
         self.running = True
-        self.simulation_started = False
-        self.debug_messages = debug_messages
-        self.debug_commands = debug_commands
-        self.simulator_thread = threading.Thread(target=self.__simulate_board, daemon=True)
-        self.simulator_thread.start()
-
-    def __get__empty_spaces(self):
-        empty_spaces = 0
-        for floor in self.parking_lot:
-            for spot in floor:
-                if spot is None:
-                    empty_spaces += 1
-        return empty_spaces
-    
-    def stop(self):
-        self.running = False
-        self.simulator_thread.join()
+        self.sampler_thread = threading.Thread(target=self.__sample_loop, name='profiler', daemon=True)
+        self.sampler_thread.start()
 
-    def __process_park_message(self, car_id):
-        if car_id in self.subscribed_cars:
-            floor, spot = self.subscribed_cars[car_id]
-            if self.parking_lot[floor][spot] is not None:
-                self.car_queue.put(car_id)
-            else:
-                current_time = time.time()
-                self.parking_lot[floor][spot] = (car_id, current_time)
-                self.debug_messages.put(b'SPC' + f"{car_id:03}".encode('ascii') 
-                                        + chr(floor + 65).encode('ascii') + f"{spot + 1:02}".encode('ascii'))
-        else:
-            car_found = False
-            for floor in range(4):
-                for spot in range(10):
-                    if self.parking_lot[floor][spot] is None and (floor, spot) not in self.subscribed_places:
-                        current_time = time.time()
-                        self.parking_lot[floor][spot] = (car_id, current_time)
-                        self.debug_messages.put(b'SPC' + f"{car_id:03}".encode('ascii') 
-                                                + chr(floor + 65).encode('ascii') + f"{spot + 1:02}".encode('ascii'))
-                        car_found = True
-                        break
-                else:
-                    continue
-                break
-            if not car_found:
-                self.car_queue.put(car_id)
-                self.debug_messages.put(b'EMP' + f"{self.__get__empty_spaces():02}".encode('ascii'))
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.sampler_thread.join()
+            self.end_time = time.perf_counter()
 
-    def __simulate_board(self):
+    def __sample_loop(self):
+        own_thread = threading.get_ident()
+        next_sample = time.perf_counter()
         while self.running:
-            time.sleep(0.1)
-            if self.debug_commands.empty():
-                if self.simulation_started:
-                    if not self.car_queue.empty():
-                        car_id = self.car_queue.get()
-                        self.__process_park_message(car_id)
-                    else:
-                        self.debug_messages.put(b'EMP' + f"{self.__get__empty_spaces():02}".encode('ascii'))
-            else:
-                command = self.debug_commands.get()
-                if command.startswith(b'GO'):
-                    self.simulation_started = True
-                if self.simulation_started:
-                    if command.startswith(b'EXT'):
-                        car_id = int(command[3:6].decode('ascii'))
-                        if car_id in self.subscribed_cars:
-                            self.debug_messages.put(b'FEE' + f"{car_id:03}".encode('ascii') + f"{000:03}".encode('ascii'))
-                            floor, spot = self.subscribed_cars[car_id]
-                            self.parking_lot[floor][spot] = None
-                        else:
-                            for floor in range(4):
-                                for spot in range(10):
-                                    if self.parking_lot[floor][spot] is not None:
-                                        if self.parking_lot[floor][spot][0] == car_id:
-                                            current_time = time.time()
-                                            parkedTime = self.parking_lot[floor][spot][1]
-                                            fee = int(4 * (current_time - parkedTime))
-                                            self.debug_messages.put(b'FEE' + f"{car_id:03}".encode('ascii') + f"{fee:03}".encode('ascii'))
-                                            self.parking_lot[floor][spot] = None
-                                            break
-                                else:
-                                    continue
-                                break
-                    elif command.startswith(b'PRK'):
-                        car_id = int(command[3:6].decode('ascii'))
-                        self.__process_park_message(car_id)
-                    elif command.startswith(b'SUB'):
-                        car_id = int(command[3:6].decode('ascii'))
-                        floor = ord(command[6:7].decode('ascii')) - ord('A')
-                        spot = int(command[7:9].decode('ascii')) - 1
-                        
-                        if (floor, spot) in self.subscribed_places:
-                            fee = 0
-                        elif car_id in self.subscribed_cars:
-                            fee = 0
-                        elif self.parking_lot[floor][spot] is not None:
-                            fee = 0
-                        else:
-                            fee = 50
-                            self.subscribed_cars[car_id] = (floor, spot)
-                            self.subscribed_places[(floor, spot)] = car_id
-
-                        self.debug_messages.put(b'RES' + f"{car_id:03}".encode('ascii') + f"{fee:02}".encode('ascii'))
-                    elif command.startswith(b'END'):
-                        self.simulation_started = False
-                        self.running = False
+            next_sample += self.sample_interval
+            delay = next_sample - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            lag = max(0.0, time.perf_counter() - next_sample)
+            self.total_lag += lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag > self.sample_interval:
+                # Fell behind, skip the missed samples instead of taking them all at once
+                next_sample = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        # One "thread;outer;...;inner count" line per stack, the input of flamegraph.pl and speedscope
+        with open(path, 'w') as output:
+            for stack, count in sorted(self.stacks.items()):
+                output.write(f"{stack} {count}\n")
+
+    def summary(self):
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        wall_time = end_time - self.start_time if self.start_time is not None else 0.0
+        lines = [f"Profile: {wall_time:.2f} s, {self.samples} samples every {self.sample_interval * 1000.0:.1f} ms, "
+                 f"sampler lag average {self.total_lag / max(1, self.samples) * 1000.0:.3f} ms, maximum {self.max_lag * 1000.0:.3f} ms"]
+        lines.append(f"  {'Span':<34}{'Count':>10}{'Total ms':>12}{'Mean us':>10}{'Max ms':>10}")
+        for name, (count, total, maximum) in sorted(self.spans.items(), key=lambda item: -item[1][1]):
+            mean = total / count * 1e6 if count else 0.0
+            lines.append(f"  {name:<34}{count:>10}{total * 1000.0:>12.2f}{mean:>10.1f}{maximum * 1000.0:>10.3f}")
+        lines.append(f"  {'Lock':<34}{'Acquires':>10}{'Contended':>12}{'Wait ms':>10}{'Max ms':>10}")
+        for name, (acquisitions, contended, total, maximum) in sorted(self.locks.items(), key=lambda item: -item[1][2]):
+            lines.append(f"  {name:<34}{acquisitions:>10}{contended:>12}{total * 1000.0:>10.2f}{maximum * 1000.0:>10.3f}")
+        return "\n".join(lines)
+
+    def report(self, output_prefix=PROFILE_OUTPUT):
+        # Writes <prefix>.collapsed and <prefix>.txt and prints the summary table
+        summary = self.summary()
+        self.write_collapsed(output_prefix + '.collapsed')
+        with open(output_prefix + '.txt', 'w') as output:
+            output.write(summary + "\n")
+        print(summary)
+        print(f"Collapsed stacks written to {output_prefix}.collapsed")
 
 class GameEngine:
     def __init__(self, screen_width, screen_height, display_width, simulator_caption, floors, cars_per_floor
-                 , serial_port='/dev/ttyUSB0', baudrate=115200, parity=serial.PARITY_NONE, rtscts=False, xonxoff=False):
+                 , serial_port='/dev/ttyUSB0', baudrate=115200, parity=PARITY, rtscts=False, xonxoff=False,
+                 headless=False, virtual_time=False, record_file=None, fleet_size=FLEET_SIZE, seed=None, workload=WORKLOAD,
+                 board_simulation=None, workload_rate=WORKLOAD_RATE, workload_trace_file=WORKLOAD_TRACE_FILE,
+                 asynchronous=ASYNC_CORE, metrics_port=METRICS_PORT, profile=PROFILE,
+                 journal_file=JOURNAL_FILE, resume=RESUME, metrics_host=METRICS_HOST):
+        self.board_simulation = BOARD_SIMULATION if board_simulation is None else board_simulation
+        if virtual_time and asynchronous:
+            raise ValueError("Virtual time and the asyncio core cannot be combined.")
+        # Sessions run with run_async() on an event loop, the board simulator is then a task of that loop
+        self.asynchronous = asynchronous
+        self.loop = None
+        self.stopped = None
+        if virtual_time and not ((self.board_simulation or serial_port is None) and headless):
+            raise ValueError("Virtual time needs headless mode and the simulated board or a replayed session.")
+        if resume and (journal_file is None or self.board_simulation):
+            raise ValueError("Resuming needs a journal file and the real board, the simulated board starts empty.")
+        # Every random choice goes through this generator, a virtual time session is fully determined by its seed
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.workload = make_workload(workload, workload_rate, workload_trace_file) if isinstance(workload, str) else workload
+        # Without a display nothing has to track what needs repainting
+        self.headless = headless
+        self.virtual_time = virtual_time
+        self.clock = VirtualClock() if virtual_time else WALL_CLOCK
+        self.scheduler = EventScheduler(self.clock) if virtual_time else None
+        self.dirty_regions = None if headless else DirtyRegions()
+        self.floors = floors
+        self.cars_per_floor = cars_per_floor
+        self.total_places = floors * cars_per_floor
+        self.fleet_size = fleet_size if fleet_size is not None else 5 * self.total_places // 2
+        self.protocol = select_protocol(floors, cars_per_floor, self.fleet_size)
+        self.codec = ProtocolCodec(self.protocol, self.fleet_size, floors, cars_per_floor)
+        self.workload.check_lot(floors, cars_per_floor, self.fleet_size)
         try:
-            self.serial_manager = SerialManager(serial_port, baudrate, parity, rtscts, xonxoff)
+            recorder = SessionRecorder(record_file, floors, cars_per_floor, self.fleet_size) if record_file is not None else None
+            self.serial_manager = SerialManager(None if self.board_simulation else serial_port, baudrate, parity, rtscts, xonxoff,
+                                                self.dirty_regions, self.protocol, self.clock, recorder, self.codec)
         except serial.SerialException as e:
             print(f"Error opening serial port: {e}")
             print("Please check the serial port and try again.")
             sys.exit()
-        pygame.init()
-        self.parking_lot = ParkingLot(floors, cars_per_floor)
-        self.car_queue = CarQueue(4 * floors)
-        self.nonparking_cars = []
+        if not self.headless:
+            pygame.init()
+        self.parking_lot = ParkingLot(floors, cars_per_floor, self.dirty_regions, self.clock)
+        self.car_queue = CarQueue(4 * floors, self.dirty_regions)
         self.status = 0
-        for car_id in range(100):
-            car_color = random.choice(car_colors)
-            new_car = Car(car_id, car_color, False)
-            self.nonparking_cars.append(new_car)
+        self.fleet = CarRegistry()
+        for car_id in range(self.fleet_size):
+            car_color = self.random.choice(car_colors)
+            self.fleet.add(Car(car_id, car_color, False))
         self.subscribed_cars = {}
-        self.nonparking_subscribed_cars = []
-        self.subsriptions = Subscriptions()
-        self.cars_waiting_to_exit = []
+        self.subsriptions = Subscriptions(cars_per_floor, self.dirty_regions)
+        self.statistics = GameStatistics(self.dirty_regions)
         self.cars_waiting_to_subscribe = {}
-        self.no_cars_in_game = 0
+        self.queue_overflows = 0
+        self.rejected_subscriptions = 0
+        self.generated_events = 0
+        # (seconds since start, parked cars, queued cars)
+        self.occupancy_curve = []
         self.lock = threading.Lock()
         self.generate = False
         self.event_generator_thread = threading.Thread(target=self.__event_generator_loop, daemon=True)
-        self.drawer = Drawer(screen_width, screen_height, display_width, floors, cars_per_floor, 
-                             simulator_caption, self.car_queue, self.parking_lot, self.subsriptions, self.serial_manager)
-        self.drawer.game_status = 0
+        self.statistics.game_status = 0
+        self.snapshots = None
+        self.drawer = None
+        if not self.headless:
+            self.snapshots = SnapshotPublisher(self.dirty_regions, self.parking_lot, self.car_queue, self.subsriptions,
+                                               self.serial_manager, self.statistics, 1.0 / DRAWER_FPS)
+            self.drawer = Drawer(screen_width, screen_height, display_width, floors, cars_per_floor, 
+                                 simulator_caption, self.snapshots, protocol=self.protocol)
+        self.running = False
+        self.replaying = False
+        self.start_time = -1
         self.automatic_mode = True
-        if BOARD_SIMULATION == True:
-            self.debug_messages = queue.Queue()
+        self.metrics_server = cengParkMetrics.MetricsServer(self, metrics_host, metrics_port) if metrics_port is not None else None
+        self.profiler = None
+        self.journal = None
+        if journal_file is not None:
+            self.journal = self.__open_journal(journal_file, resume)
+        if self.board_simulation:
             self.debug_commands = queue.Queue()
-            self.board_simulator = BoardSimulator(self.debug_messages, self.debug_commands)
+            self.board_simulator = BoardSimulator(self.serial_manager.receive, self.debug_commands, floors, cars_per_floor, self.protocol,
+                                                  self.clock, threaded=not (virtual_time or asynchronous), codec=self.codec)
+        if profile:
+            self.profiler = Profiler()
+            self.profiler.instrument(self)
+
+    def __open_journal(self, path, resume):
+        if not resume:
+            return StateJournal(path, self.floors, self.cars_per_floor)
+        floors, places_per_floor, cars, fees, end = read_journal(path)
+        if (floors, places_per_floor) != (self.floors, self.cars_per_floor):
+            raise ValueError(f"{path} was written for {floors} floors of {places_per_floor} places.")
+        # The records are in the order the cars last changed, so queued cars come back in their queue order
+        for car_id, (kind, state, flags, _, waiting_floor, waiting_spot, floor, spot, parked_floor, parked_spot, entry_time,
+                     _, _) in cars.items():
+            car = self.fleet.get(car_id)
+            if car is None:
+                print(f"Error: Car{car_id} in the journal is not in the fleet.")
+                continue
+            car.subscribed = bool(flags & StateJournal.SUBSCRIBED)
+            if flags & StateJournal.IDLE_SUBSCRIBED:
+                self.fleet.idle_subscribed.add(car)
+            if waiting_floor >= 0:
+                self.cars_waiting_to_subscribe[car_id] = {"floor": waiting_floor, "spot": waiting_spot}
+            if floor >= 0:
+                self.subscribed_cars[car_id] = {"floor": floor, "spot": spot}
+                self.subsriptions.add_subscription(car_id, floor, spot)
+            if state == CarRegistry.QUEUED:
+                self.car_queue.add_car(car)
+            elif state in (CarRegistry.PARKED, CarRegistry.EXITING):
+                self.parking_lot.park_car(parked_floor, parked_spot, car, entry_time)
+            self.fleet.move(car, CarRegistry.IDLE, state)
+        self.statistics.simulator_fee, self.statistics.calculated_fee = fees
+        # New records go right after the last complete one
+        os.truncate(path, end)
+        print(f"Resumed {len(cars)} cars from {path}.")
+        return StateJournal(path, self.floors, self.cars_per_floor, {car_id: StateJournal.RECORD.pack(*fields)
+                                                                     for car_id, fields in cars.items()}, fees)
+
+    def __journal_car(self, kind, car_id):
+        if self.journal is None:
+            return
+        car = self.fleet.get(car_id)
+        if car is None:
+            return
+        with self.lock:
+            place = None
+            if car.state == CarRegistry.PARKED or car.state == CarRegistry.EXITING:
+                place = self.parking_lot.get_car_place(car_id)
+            self.journal.record(kind, car, self.cars_waiting_to_subscribe.get(car_id), self.subscribed_cars.get(car_id), place,
+                                self.statistics.simulator_fee, self.statistics.calculated_fee, car in self.fleet.idle_subscribed)
 
-    def __stop(self):
+    def __publish_snapshot(self, final=False):
+        if self.snapshots is not None:
+            self.snapshots.publish(final)
+
+    def __shutdown(self):
         if self.generate:
             self.generate = False
+        if self.event_generator_thread.is_alive():
             self.event_generator_thread.join()
-        if BOARD_SIMULATION == True:
+        if self.board_simulation:
             self.board_simulator.stop()
-        self.drawer.stop()
+        if self.drawer is not None:
+            self.drawer.stop()
         self.serial_manager.stop()
-        pygame.quit()
+        self.serial_manager.close_recorder()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.profiler is not None and self.profiler.running:
+            self.profiler.stop()
+            self.profiler.report(PROFILE_OUTPUT)
+        if not self.headless:
+            pygame.quit()
+
+    def __stop(self):
+        self.__shutdown()
         sys.exit()
 
-    def __send_command(self, code, XXX: int = -1, Y: str = '?', ZZ: int = -1):
+    def stop(self):
+        # Ends a running session early, run() then finishes it and returns the statistics
+        self.running = False
+        self.serial_manager.messages.put(None)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    def get_statistics(self):
+        serial_statistics = self.serial_manager.get_statistics()
+        parked_cars, average_dwell_time, maximum_dwell_time = self.parking_lot.get_dwell_statistics()
+        return {
+            "status": self.status,
+            "automatic_mode": self.automatic_mode,
+            "simulator_fee": self.statistics.simulator_fee,
+            "received_fee": self.statistics.calculated_fee,
+            "simulator_empty_spaces": int(self.parking_lot.get_free_spots().sum()),
+            "received_empty_spaces": self.statistics.received_empty_spaces,
+            "parked_cars": parked_cars,
+            "average_dwell_time": average_dwell_time,
+            "maximum_dwell_time": maximum_dwell_time,
+            "received_messages": self.serial_manager.cmd_count,
+            "average_time": serial_statistics["average"],
+            "minimum_time": serial_statistics["minimum"],
+            "maximum_time": serial_statistics["maximum"],
+            "latency": serial_statistics["latency"],
+            "writer": serial_statistics["writer"],
+            "queue_overflows": self.queue_overflows,
+            "rejected_subscriptions": self.rejected_subscriptions,
+            "occupancy_curve": self.occupancy_curve,
+        }
+
+    def print_statistics(self):
+        statistics = self.get_statistics()
+        print("Total Earnings:")
+        print(f"  Simulator: {statistics['simulator_fee']:03}")
+        print(f"  Received: {statistics['received_fee']:03}")
+        print("Empty Places:")
+        print(f"  Simulator: {statistics['simulator_empty_spaces']:02}")
+        print(f"  Received: {statistics['received_empty_spaces']:02}")
+        print("Time statistics:")
+        print(f"  Messages: {statistics['received_messages']}")
+        print(f"  Average: {statistics['average_time']:05.2f}")
+        print(f"  Minimum: {statistics['minimum_time']:05.2f}")
+        print(f"  Maximum: {statistics['maximum_time']:05.2f}")
+        print("Command latency (ms):")
+        for command, latency in statistics["latency"].items():
+            percentiles = "  ".join(f"p{percentile}: {value:.2f}" for percentile, value in latency["percentiles"].items())
+            print(f"  {command}: {latency['count']} answered, {latency['unanswered']} unanswered  {percentiles}  max: {latency['maximum']:.2f}")
+        writer = statistics["writer"]
+        if writer is not None:
+            print("Serial writer:")
+            print(f"  Frames: {writer['frames']} in {writer['writes']} writes ({writer['frames_per_write']:.2f} per write)")
+            print(f"  Queue depth: {writer['depth']}, maximum: {writer['max_depth']}")
+            print(f"  Write time (ms): total {writer['write_time']:.2f}, maximum {writer['max_write_time']:.2f}")
+            print(f"  Generator stalls: {writer['stalls']}, {writer['stall_time']:.2f} ms")
+            print(f"  Waits on a full queue: {writer['full_waits']}, {writer['full_wait_time']:.2f} ms, dropped after close: {writer['dropped']}")
+
+    def __send_command(self, code, XXX: int = -1, floor: int = -1, spot: int = -1):
         command = b''
+        frame = None
+        max_car_id = self.protocol.max_car_id
         if code == "GO":
             command = b'GO'
         elif code == "END":
             command = b'END'
         elif code == "EXT":
-            if (XXX < 0 or XXX > 999):
+            if (XXX < 0 or XXX > max_car_id):
                 debug_print("Error: Invalid XXX for EXT command.")
                 return
-            command = b'EXT' + f"{XXX:03}".encode('ascii')
-            self.serial_manager.write(b'$EXT' + f"{XXX:03}".encode('ascii') + b'#')
+            command = self.codec.car_command("EXT", XXX)
+            frame = self.codec.car_frame("EXT", XXX)
         elif code == "PRK":
-            if (XXX < 0 or XXX > 999):
+            if (XXX < 0 or XXX > max_car_id):
                 debug_print("Error: Invalid XXX for PRK command.")
                 return
-            command = b'PRK' + f"{XXX:03}".encode('ascii')
+            command = self.codec.car_command("PRK", XXX)
+            frame = self.codec.car_frame("PRK", XXX)
         elif code == "SUB":
-            if (XXX < 0 or XXX > 999):
+            if (XXX < 0 or XXX > max_car_id):
                 debug_print("Error: Invalid XXX for SUB command.")
                 return
-            if (Y not in ['A', 'B', 'C', 'D']):
-                debug_print("Error: Invalid Y for SUB command.")
+            if (floor < 0 or floor >= self.floors):
+                debug_print("Error: Invalid floor for SUB command.")
                 return
-            if (ZZ < 0 or ZZ > 10):
-                debug_print("Error: Invalid ZZ for SUB command.")
+            if (spot < 0 or spot >= self.cars_per_floor):
+                debug_print("Error: Invalid spot for SUB command.")
                 return
-            command = b'SUB' + f"{XXX:03}".encode('ascii') + Y.encode('ascii') + f"{ZZ:02}".encode('ascii')
+            command = self.codec.subscription_command(XXX, floor, spot)
         else:
             debug_print("Error: Invalid command.")
             return
+
+        if code in LatencyTracker.COMMANDS:
+            self.serial_manager.latency.command_sent(code, XXX)
+
+        # A replayed session only rebuilds state, the commands were already sent once
+        if self.replaying:
+            return
         
-        if BOARD_SIMULATION == True:
+        if self.board_simulation:
             self.debug_commands.put(command)
+            self.serial_manager.record_outgoing(command)
         else:
-            self.serial_manager.write(b'$' + command + b'#')
+            self.serial_manager.write(command, frame)
 
     def __add_car(self, car):
         with self.lock:
-            if car not in self.nonparking_cars:
+            if car.state != CarRegistry.IDLE:
                 debug_print(f": Car{car.car_id} is not in the non-parking list.")
                 return False
 
@@ -714,50 +1383,55 @@ class GameEngine:
             if self.car_queue.is_full():
                 # TODO: Point reduction
                 print("Car queue is full. New cars cannot enter.")
+                self.queue_overflows += 1
                 return False
             
-            self.nonparking_cars.remove(car)
-            if car in self.nonparking_subscribed_cars:
-                self.nonparking_subscribed_cars.remove(car)
+            self.fleet.move(car, CarRegistry.IDLE, CarRegistry.QUEUED)
+            self.fleet.idle_subscribed.discard(car)
             
             self.car_queue.add_car(car)
-            self.no_cars_in_game += 1
 
+        self.__journal_car(StateJournal.QUEUED, car.car_id)
         self.__send_command("PRK", car.car_id)  
 
         return True
 
     def __add_random_car(self):
         with self.lock:
-            random_car = random.choice(self.nonparking_cars)
-        self.__add_car(random_car)
+            random_car = self.fleet.sample(CarRegistry.IDLE, self.random)
+        if random_car is not None:
+            self.__add_car(random_car)
 
     def __exit_car(self, car):
         with self.lock:
-            if car in self.nonparking_cars:
+            if car.state == CarRegistry.IDLE:
                 debug_print(f"Error: Car{car.car_id} is already in the non-parking list.")
                 return False
 
-            if car in self.cars_waiting_to_exit:
+            if car.state == CarRegistry.EXITING:
                 debug_print(f"Error: Car{car.car_id} is already in the waiting list.")
                 return False
+
+            if not self.fleet.move(car, CarRegistry.PARKED, CarRegistry.EXITING):
+                debug_print(f"Error: Car{car.car_id} is not parked yet.")
+                return False
         
-        self.cars_waiting_to_exit.append(car)
+        self.__journal_car(StateJournal.EXIT_REQUESTED, car.car_id)
         self.__send_command("EXT", car.car_id)
         return True
     
     def __exit_random_car(self):
-        if self.parking_lot.get_total_cars() == 0:
+        with self.lock:
+            random_car = self.fleet.sample(CarRegistry.PARKED, self.random)
+        if random_car is None:
             debug_print("No cars in the parking lot.")
             return False
-        with self.lock:
-                random_car = random.choice(self.parking_lot.get_all_cars())
         self.__exit_car(random_car)        
         return True
     
-    def __subscribe_car(self, car, letter, spot):
+    def __subscribe_car(self, car, floor, spot):
         with self.lock:
-            if car not in self.nonparking_cars:
+            if car.state != CarRegistry.IDLE:
                 debug_print(f"Error: Car{car.car_id} is not in the non-parking list.")
                 return False
             
@@ -770,51 +1444,49 @@ class GameEngine:
                 return False
             
             self.cars_waiting_to_subscribe[car.car_id] = {
-                "floor": letter,
+                "floor": floor,
                 "spot": spot
             }
 
-            self.nonparking_subscribed_cars.append(car)
+            self.fleet.idle_subscribed.add(car)
 
-        self.__send_command("SUB", car.car_id, letter, spot)  
+        self.__journal_car(StateJournal.SUBSCRIPTION_REQUESTED, car.car_id)
+        self.__send_command("SUB", car.car_id, floor, spot)  
         return True
     
     def __subscribe_random_car(self):
         with self.lock:
-            random_car = random.choice(self.nonparking_cars)
-            random_letter = random.choice("ABCD")
-            random_spot = random.randint(1, 10)
-        self.__subscribe_car(random_car, random_letter, random_spot)
+            random_car = self.fleet.sample(CarRegistry.IDLE, self.random)
+            if random_car is None:
+                return
+            random_floor = self.random.randrange(self.floors)
+            random_spot = self.random.randrange(self.cars_per_floor)
+        self.__subscribe_car(random_car, random_floor, random_spot)
 
     def __add_random_subscribed_car(self):
         if len(self.subscribed_cars) == 0:
             debug_print("There is no subscribed car.")
             return False
         
-        if len(self.nonparking_subscribed_cars) == 0:
+        with self.lock:
+            random_car = self.fleet.idle_subscribed.choice(self.random)
+        if random_car is None:
             debug_print("There is no non-parking subscribed car.")
             return False
-        
-        with self.lock:
-            random_car = random.choice(self.nonparking_subscribed_cars)
         self.__add_car(random_car)
 
     def __handle_empty_space_message(self, empty_spaces):
         with self.lock:
-            self.drawer.received_empty_spaces = empty_spaces
+            self.statistics.received_empty_spaces = empty_spaces
 
-    def __handle_parking_space_message(self, car_id, floor, spot):
-        car_in_queue = None
-        for car in self.car_queue.get_queue():
-            if car.car_id == car_id:
-                car_in_queue = car
-                break
+    def __handle_parking_space_message(self, car_id, floor, spot, now):
+        car_in_queue = self.car_queue.get_car(car_id)
         if car_in_queue is None:
             print(f"Error: Trying to park Car{car_id} which is not in the queue.")
             return
         
-        if self.parking_lot.read_spot_raw(floor, spot) is not None:
-            print(f"Error: Spot {spot} on floor {floor} is already occupied.")
+        if self.parking_lot.read_spot(floor, spot) is not None:
+            print(f"Error: Spot {self.__spot_name(floor, spot)} is already occupied.")
             return
         
         with self.lock:
@@ -824,15 +1496,21 @@ class GameEngine:
                     print(f"Car{car_id} cannot be parked at this spot.")
                     return
 
-        subscribed_car_at_spot = self.subsriptions.get_subscription_raw(floor, spot)
+        subscribed_car_at_spot = self.subsriptions.get_subscription(floor, spot)
         if subscribed_car_at_spot is not None:
             if subscribed_car_at_spot != car_id:
-                print(f"Error: Floor {floor} and spot {spot} is already occupied by Car{subscribed_car_at_spot}.")
+                print(f"Error: Spot {self.__spot_name(floor, spot)} is already occupied by Car{subscribed_car_at_spot}.")
                 print(f"Car{car_id} cannot be parked at this spot.")
                 return
         
         self.car_queue.remove_car(car_in_queue)
-        self.parking_lot.park_car_raw(floor, spot, car_in_queue)
+        if self.parking_lot.park_car(floor, spot, car_in_queue, now):
+            with self.lock:
+                self.fleet.move(car_in_queue, CarRegistry.QUEUED, CarRegistry.PARKED)
+
+    def __spot_name(self, floor, spot):
+        # Spot as the board names it, floor letters and a 1-based number
+        return f"{self.protocol.floor_name(floor)}{spot + 1}"
 
     def __calculate_fee(self, time_passed):
         return int(time_passed / 250) + 1
@@ -840,25 +1518,20 @@ class GameEngine:
     def __get_subscription_fee(self):
         return 50
     
-    def __handle_fee_message(self, car_id, fee):
-        exiting_car = None
-        with self.lock:
-            for car in self.cars_waiting_to_exit:
-                if car.car_id == car_id:
-                    exiting_car = car
-                    break
-        if exiting_car is None:
+    def __handle_fee_message(self, car_id, fee, now):
+        exiting_car = self.fleet.get(car_id)
+        if exiting_car is None or exiting_car.state != CarRegistry.EXITING:
             print(f"Error: Car{car_id} is not in the waiting list.")
             return
         
-        if car not in self.parking_lot.get_all_cars():
+        if not self.parking_lot.contains_car(car_id):
             print(f"Error: Car{car_id} is not in the parking lot, cannot exit.")
             return
         
         simulator_fee = 0
         subscribed = False
         car, entry_time = self.parking_lot.remove_car_by_id(car_id)
-        time_passed = time.time() - entry_time
+        time_passed = now - entry_time
         with self.lock:
             if car_id in self.subscribed_cars:
                 simulator_fee = 0
@@ -866,24 +1539,20 @@ class GameEngine:
             else:
                 simulator_fee = self.__calculate_fee(time_passed * 1000.0)
                 
-            self.drawer.calculated_fee += fee
-            self.drawer.simulator_fee += simulator_fee
+            self.statistics.calculated_fee += fee
+            self.statistics.simulator_fee += simulator_fee
            
-            self.cars_waiting_to_exit.remove(exiting_car)
-            self.nonparking_cars.append(car)
-            self.no_cars_in_game -= 1
+            self.fleet.move(exiting_car, CarRegistry.EXITING, CarRegistry.IDLE)
             if subscribed:
-                self.nonparking_subscribed_cars.append(car)
+                self.fleet.idle_subscribed.add(car)
             
     def __handle_res_message(self, car_id, fee):
         already_subscribed = False
+        if fee == 0:
+            self.rejected_subscriptions += 1
         with self.lock:
-            subcribing_car = None
-            for car in self.nonparking_cars:
-                if car.car_id == car_id:
-                    subcribing_car = car
-                    break
-            if subcribing_car is None:
+            subcribing_car = self.fleet.get(car_id)
+            if subcribing_car is None or subcribing_car.state != CarRegistry.IDLE:
                 print(f"Error: Car{car_id} is not in the non-parking list.")
                 return
 
@@ -893,18 +1562,18 @@ class GameEngine:
 
             if fee != 0 and fee != 50:
                 print(f"Wrong fee {fee} for Car{car_id}.")
-                if subcribing_car in self.nonparking_subscribed_cars:
-                    self.nonparking_subscribed_cars.remove(subcribing_car)
+                if subcribing_car in self.fleet.idle_subscribed:
+                    self.fleet.idle_subscribed.discard(subcribing_car)
                     return False
 
             floor = self.cars_waiting_to_subscribe[car_id]["floor"]
             spot = self.cars_waiting_to_subscribe[car_id]["spot"]
 
-            if self.parking_lot.read_spot_raw(floor, spot) is not None:
+            if self.parking_lot.read_spot(floor, spot) is not None:
                 if fee != 0:
-                    print(f"Error: Spot {spot} on floor {floor} is already occupied. Cannot subscribe.")
-                if subcribing_car in self.nonparking_subscribed_cars:
-                    self.nonparking_subscribed_cars.remove(subcribing_car)
+                    print(f"Error: Spot {self.__spot_name(floor, spot)} is already occupied. Cannot subscribe.")
+                if subcribing_car in self.fleet.idle_subscribed:
+                    self.fleet.idle_subscribed.discard(subcribing_car)
                     return False
             
             if car_id in self.subscribed_cars:
@@ -914,28 +1583,25 @@ class GameEngine:
                     print(f"Error: Car{car_id} is already subscribed.")
                     return False
 
-        if self.subsriptions.get_subscription_raw(floor, spot) is not None:
+        if self.subsriptions.get_subscription(floor, spot) is not None:
             if fee == 0:
                 already_subscribed = True
             else:
-                print(f"Error: Spot {spot} on floor {floor} is already subscribed.")
+                print(f"Error: Spot {self.__spot_name(floor, spot)} is already subscribed.")
                 return False
         
         with self.lock:
             if not already_subscribed:
                 if fee == 50:
-                    for car in self.nonparking_subscribed_cars:
-                        if car.car_id == car_id:
-                            car.subscribed = True
-                            break
+                    if subcribing_car in self.fleet.idle_subscribed:
+                        subcribing_car.subscribed = True
                 elif fee == 0:
                     print(f"Error: Car{car_id} could be subscribed but rejected.")
-                    if subcribing_car in self.nonparking_subscribed_cars:
-                        self.nonparking_subscribed_cars.remove(subcribing_car)
+                    if subcribing_car in self.fleet.idle_subscribed:
+                        self.fleet.idle_subscribed.discard(subcribing_car)
                         return False
             else:
-                if subcribing_car in self.nonparking_subscribed_cars:
-                    self.nonparking_subscribed_cars.remove(subcribing_car)
+                self.fleet.idle_subscribed.discard(subcribing_car)
             
             del self.cars_waiting_to_subscribe[car_id]
 
@@ -944,89 +1610,177 @@ class GameEngine:
                 "floor": floor,
                 "spot": spot
             }
-            self.subsriptions.add_subscription_raw(car_id, floor, spot)
+            self.subsriptions.add_subscription(car_id, floor, spot)
             
             with self.lock:
                 simulated_fee = self.__get_subscription_fee()
-                self.drawer.calculated_fee += fee
-                self.drawer.simulator_fee += simulated_fee
+                self.statistics.calculated_fee += fee
+                self.statistics.simulator_fee += simulated_fee
         
-    def __process_message(self, message):
-        if message.startswith(b'EMP'):
-            empty_spaces = int(message[3:5].decode('ascii'))
-            if empty_spaces < 0 or empty_spaces > 40:
-                print(f"Error: Invalid number of empty spaces {empty_spaces}.")
+    def __process_message(self, message, record=None):
+        # Every handler sees the same time, which is also the one recorded for replays
+        now = self.clock.time()
+        self.serial_manager.record_incoming(message, now)
+        if record is None:
+            record = self.codec.decode(message)
+        record_type = type(record)
+
+        if record_type is EmptySpaces:
+            if record.empty_spaces > self.total_places:
+                print(f"Error: Invalid number of empty spaces {record.empty_spaces}.")
                 return
-            self.__handle_empty_space_message(empty_spaces)
-
-        elif message.startswith(b'SPC'):
-            car_id = int(message[3:6].decode('ascii'))
-            floor = message[6:7].decode('ascii')
-            spot = int(message[7:9].decode('ascii'))
-            if floor not in ['A', 'B', 'C', 'D']:
-                print(f"Error: Invalid floor {floor} in SPC command.")
+            self.__handle_empty_space_message(record.empty_spaces)
+
+        elif record_type is ParkingSpace:
+            if record.floor >= self.floors:
+                print(f"Error: Invalid floor {self.protocol.floor_name(record.floor)} in SPC command.")
                 return
-            if spot < 1 or spot > 10:
-                print(f"Error: Invalid spot {spot} in SPC command.")
+            if record.spot >= self.cars_per_floor:
+                print(f"Error: Invalid spot {record.spot + 1} in SPC command.")
                 return
-            self.__handle_parking_space_message(car_id, floor, spot)
+            self.__handle_parking_space_message(record.car_id, record.floor, record.spot, now)
+            self.__journal_car(StateJournal.PARKED, record.car_id)
 
-        elif message.startswith(b'FEE'):
-            car_id = int(message[3:6].decode('ascii'))
-            fee = int(message[6:9].decode('ascii'))
-            self.__handle_fee_message(car_id, fee)
+        elif record_type is Fee:
+            self.__handle_fee_message(record.car_id, record.fee, now)
+            self.__journal_car(StateJournal.FEE_SETTLED, record.car_id)
 
-        elif message.startswith(b'RES'):
-            car_id = int(message[3:6].decode('ascii'))
-            fee = int(message[6:8].decode('ascii'))
-            self.__handle_res_message(car_id, fee)
+        elif record_type is Reservation:
+            self.__handle_res_message(record.car_id, record.fee)
+            self.__journal_car(StateJournal.SUBSCRIPTION_RESOLVED, record.car_id)
 
         else:
+            self.serial_manager.rejected[message_type(message, self.protocol)] += 1
             print("Unknown message received.")
 
-    def __receive_messages(self):
-        while self.serial_manager.running and self.running:
-            if not self.serial_manager.messages.empty():
-                message = self.serial_manager.messages.get()
+    def __dispatch_messages(self, timeout):
+        # Block on the message queue and handle each message as soon as it arrives
+        messages = self.serial_manager.messages
+        deadline = time.perf_counter() + timeout
+        remaining = timeout
+        while self.running and remaining > 0:
+            try:
+                message = messages.get(timeout=remaining)
+            except queue.Empty:
+                return
+            if message is not None:
                 self.__process_message(message)
-            else:
+                self.__publish_snapshot()
+            remaining = deadline - time.perf_counter()
+
+    def __event_generator_loop(self):
+        # Events are due at absolute times so the rate does not drift with the time each event takes
+        next_event = time.perf_counter()
+        while self.generate:
+            # Held back while the serial writer is behind, the schedule moves by the time lost
+            next_event += self.serial_manager.wait_for_space()
+            delay = self.__generate_event()
+            if delay is None:
+                self.generate = False
                 break
+            next_event += delay
+            remaining = next_event - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def __workload_step(self):
+        delay = self.__generate_event()
+        if delay is None:
+            self.generate = False
+        elif self.generate:
+            self.scheduler.schedule(delay, self.__workload_step)
 
-    def __debug_receive_messages(self):
-        while self.running:
-            if not self.debug_messages.empty():
-                message = self.debug_messages.get()
-                self.__process_message(message)
-            else:
+    def __workload_view(self):
+        with self.lock:
+            return WorkloadView(self.total_places, len(self.fleet) - self.fleet.count(CarRegistry.IDLE),
+                                self.fleet.count(CarRegistry.PARKED), len(self.subscribed_cars), len(self.fleet.idle_subscribed))
+
+    def __generate_event(self):
+        # Runs the workload's next event and returns the delay until the one after it
+        elapsed = self.clock.time() - self.start_time
+        self.generated_events += 1
+        action, command = self.workload.next_action(self.__workload_view(), elapsed, self.random)
+        if action == Workload.ADD:
+            self.__add_random_car()
+        elif action == Workload.EXIT:
+            self.__exit_random_car()
+        elif action == Workload.SUBSCRIBE:
+            self.__subscribe_random_car()
+        elif action == Workload.ADD_SUBSCRIBED:
+            self.__add_random_subscribed_car()
+        elif action == Workload.COMMAND:
+            self.__apply_command(command)
+        return self.workload.next_delay(elapsed, self.random)
+
+    def __apply_command(self, command):
+        # Repeats the state change that sending a recorded command made in the original session
+        record = self.codec.decode_command(command)
+        if record is None or record.car_id < 0:
+            return
+        car = self.fleet.get(record.car_id)
+        if car is None:
+            print(f"Error: Car in {command} is not in the fleet.")
+        elif type(record) is SubscriptionCommand:
+            self.__subscribe_car(car, record.floor, record.spot)
+        elif record.code == "PRK":
+            self.__add_car(car)
+        else:
+            self.__exit_car(car)
+
+    def replay(self, records, speed=None):
+        # Feeds a recorded session back through the engine, speed is a factor over real time
+        # and None replays as fast as possible. Needs virtual_time so fees use the recorded times.
+        if not self.virtual_time:
+            raise ValueError("Replaying a session needs virtual time.")
+        if not records:
+            return self.get_statistics()
+        self.replaying = True
+        self.running = True
+        self.start_time = records[0][1]
+        self.clock.advance_to(self.start_time)
+        # Incoming frames take the live path through receive(), which counts and times them
+        self.serial_manager.start(message_handler=self.__process_message)
+        self.status = 1
+        self.statistics.game_status = 1
+        wall_start = time.perf_counter()
+        for direction, timestamp, frame in records:
+            if not self.running:
                 break
+            if speed is not None:
+                delay = (timestamp - self.start_time) / speed - (time.perf_counter() - wall_start)
+                if delay > 0:
+                    time.sleep(delay)
+            self.clock.advance_to(timestamp)
+            if direction == SessionRecorder.OUTGOING:
+                self.__apply_command(frame)
+            else:
+                self.serial_manager.receive(frame)
+        self.running = False
+        self.replaying = False
+        self.status = 2
+        self.statistics.game_status = 2
+        return self.get_statistics()
 
-    def __event_generator_loop(self):
-        while self.generate:
-            random_number = random.randint(0, 1000)
-            with self.lock:
-                no_cars = self.no_cars_in_game
-                coefficient = int(200 * no_cars / 35)
-
-            if random_number < 600 - coefficient and no_cars < 45:
-                # Randomly add a car
-                self.__add_random_car()
-            elif random_number < 800 and self.parking_lot.get_total_cars() > 0:
-                # Randomly request a car to exit
-                self.__exit_random_car()
-            elif random_number < 850 and len(self.subscribed_cars) < 10:
-                # Randomly request subscribe a car
-                self.__subscribe_random_car()
-            elif random_number < 900 and len(self.nonparking_subscribed_cars) > 0:
-                # Randomly add a subscribed car
-                self.__add_random_subscribed_car()
-            elif random_number <= 1000:
-                # DO NOTHING
-                pass
-
-            time.sleep(0.11)             
-
-    def run(self):
-        # Waiting loop
+    def __handle_pygame_events(self):
+        for event in pygame.event.get():
+            if self.drawer.handle_event(event):
+                continue
+            if event.type == pygame.QUIT:
+                self.__stop()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    self.__stop()
+                if self.running and not self.automatic_mode:
+                    if event.key == pygame.K_r:
+                        self.__add_random_car()
+                    elif event.key == pygame.K_t:
+                        self.__exit_random_car()
+                    elif event.key == pygame.K_y:
+                        self.__subscribe_random_car()
+                    elif event.key == pygame.K_u:
+                        self.__add_random_subscribed_car()
+
+    def __wait_for_mode_selection(self):
         while True:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -1035,70 +1789,591 @@ class GameEngine:
                     if event.key == pygame.K_ESCAPE:
                         self.__stop()
                     elif event.key == pygame.K_a:
-                        self.automatic_mode =True
-                        break
+                        return True
                     elif event.key == pygame.K_m:
-                        self.automatic_mode = False
-                        break
-            else:
-                continue
-            break
+                        return False
 
-        # Start the game
+    def __start_metrics(self):
+        if self.metrics_server is not None and not self.metrics_server.running:
+            self.metrics_server.start()
+            print(f"Serving metrics on http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+        if self.profiler is not None and not self.profiler.running:
+            self.profiler.start()
+
+    def start(self, automatic_mode=True):
+        self.automatic_mode = automatic_mode
+        self.__start_metrics()
         self.serial_manager.start()
         self.running = True
-        start_time = time.time()
+        self.start_time = self.clock.time()
         self.__send_command("GO")
         self.status = 1
-        self.drawer.game_status = 1
+        self.statistics.game_status = 1
         if self.automatic_mode:
             self.generate = True
-            self.event_generator_thread.start()
+            if self.virtual_time:
+                self.scheduler.schedule(0.0, self.__workload_step)
+            else:
+                self.event_generator_thread.start()
+
+    def __drain_messages(self):
+        # Everything that arrived during the last tick is decoded in one call
+        messages = self.serial_manager.messages
+        batch = []
+        while not messages.empty():
+            message = messages.get_nowait()
+            if message is not None:
+                batch.append(message)
+        for message, record in zip(batch, self.codec.decode_batch(batch)):
+            self.__process_message(message, record)
+
+    def __sample_occupancy(self):
+        self.occupancy_curve.append((round(self.clock.time() - self.start_time, 6), self.parking_lot.get_total_cars(),
+                                     self.car_queue.get_queue_size()))
+
+    def __run_virtual(self, duration):
+        # Discrete-event loop, the clock jumps from one generator or board tick to the next
+        self.scheduler.schedule_every(BOARD_TICK, self.board_simulator.step, BOARD_TICK)
+        self.scheduler.schedule_every(OCCUPANCY_SAMPLE_INTERVAL, self.__sample_occupancy, OCCUPANCY_SAMPLE_INTERVAL)
+        end_time = self.start_time + duration
+        while self.running and self.scheduler.run_next(end_time):
+            self.__drain_messages()
+        self.running = False
+
+    def run(self, automatic_mode=None, duration=GAME_DURATION):
+        # Waiting loop, skipped when the mode is given or there is no window to press keys in
+        if automatic_mode is None:
+            automatic_mode = True if self.headless else self.__wait_for_mode_selection()
+
+        # Start the game
+        self.start(automatic_mode)
+        if self.virtual_time:
+            self.__run_virtual(duration)
 
-        # Main running loop
+        # Main running loop, pygame events are handled at most every EVENT_POLL_INTERVAL
         while self.running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.__stop()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        self.__stop()
-                    if not self.automatic_mode:
-                        if event.key == pygame.K_r:
-                            self.__add_random_car()
-                        elif event.key == pygame.K_t:
-                            self.__exit_random_car()
-                        elif event.key == pygame.K_y:
-                            self.__subscribe_random_car()
-                        elif event.key == pygame.K_u:
-                            self.__add_random_subscribed_car()                    
-
-            if BOARD_SIMULATION == True: 
-                self.__debug_receive_messages()
-            else:
-                self.__receive_messages()            
+            if not self.headless:
+                self.__handle_pygame_events()
 
-            current_time = time.time()
-            
-            if (current_time - start_time) >= 60:
-                self.__send_command("END")
+            time_left = duration - (self.clock.time() - self.start_time)
+            if time_left <= 0:
                 self.running = False
+                break
+
+            if self.headless:
+                self.__dispatch_messages(time_left)
+            else:
+                self.__dispatch_messages(min(EVENT_POLL_INTERVAL, time_left))
+                # Commands sent by the generator thread or the keyboard changed the queue
+                self.__publish_snapshot()
 
+        self.__send_command("END")
         self.status = 2
-        self.drawer.game_status = 2
+        self.statistics.game_status = 2
+        self.__publish_snapshot(True)
         self.generate = False
         self.serial_manager.stop()
 
+        if self.headless:
+            self.__shutdown()
+            self.print_statistics()
+            return self.get_statistics()
+
         # Loop to wait for the user to close the window
         while True:
+            self.__handle_pygame_events()
+
+    def __receive_async(self, message):
+        # Called by the serial manager on the loop or, without fd watching, on its reader thread
+        self.loop.call_soon_threadsafe(self.__handle_message_async, message)
+
+    def __handle_message_async(self, message):
+        if self.running:
+            self.__process_message(message)
+            self.__publish_snapshot()
+
+    async def __generate_events_async(self):
+        next_event = self.loop.time()
+        while self.generate:
+            if self.serial_manager.congested():
+                stall_start = self.loop.time()
+                while self.generate and self.serial_manager.congested():
+                    await asyncio.sleep(EVENT_POLL_INTERVAL)
+                stalled = self.loop.time() - stall_start
+                self.serial_manager.record_stall(stalled)
+                next_event += stalled
+            delay = self.__generate_event()
+            if delay is None:
+                break
+            next_event += delay
+            await asyncio.sleep(max(0.0, next_event - self.loop.time()))
+
+    async def __simulate_board_async(self):
+        next_tick = self.loop.time()
+        while self.running:
+            next_tick += BOARD_TICK
+            await asyncio.sleep(max(0.0, next_tick - self.loop.time()))
+            self.board_simulator.step()
+
+    async def __handle_pygame_events_async(self):
+        while True:
+            self.__handle_pygame_events()
+            self.__publish_snapshot()
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+    async def run_async(self, automatic_mode=None, duration=GAME_DURATION):
+        # The same session as run() on the running event loop. Serial frames are read when the port's
+        # descriptor is readable and the generator and board simulator are timers; only the drawer
+        # keeps its own thread. Several engines can share one loop.
+        if not self.asynchronous:
+            raise ValueError("run_async() needs an engine created with asynchronous=True.")
+        if automatic_mode is None:
+            automatic_mode = True if self.headless else self.__wait_for_mode_selection()
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.automatic_mode = automatic_mode
+        self.__start_metrics()
+        self.serial_manager.start(self.loop, self.__receive_async)
+        self.running = True
+        self.start_time = self.clock.time()
+        self.__send_command("GO")
+        self.status = 1
+        self.statistics.game_status = 1
+
+        tasks = []
+        if self.automatic_mode:
+            self.generate = True
+            tasks.append(self.loop.create_task(self.__generate_events_async()))
+        if self.board_simulation:
+            tasks.append(self.loop.create_task(self.__simulate_board_async()))
+        if not self.headless:
+            tasks.append(self.loop.create_task(self.__handle_pygame_events_async()))
+        try:
+            await asyncio.wait_for(self.stopped.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+
+        self.running = False
+        self.generate = False
+        self.__send_command("END")
+        self.status = 2
+        self.statistics.game_status = 2
+        self.__publish_snapshot(True)
+        self.serial_manager.stop()
+
+        if self.headless:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.__shutdown()
+            self.print_statistics()
+            return self.get_statistics()
+
+        # Keep handling window events until the user closes the window
+        for task in tasks[:-1]:
+            task.cancel()
+        await tasks[-1]
+
+async def run_sessions_async(game_engines, duration=GAME_DURATION):
+    # Runs several asynchronous engines on the current loop at once
+    return await asyncio.gather(*(game_engine.run_async(True, duration) for game_engine in game_engines))
+
+def replay_session(path, speed=None):
+    floors, places_per_floor, fleet_size, records = read_session_log(path)
+    game_engine = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, floors, places_per_floor,
+                             serial_port=None, headless=True, virtual_time=True, fleet_size=fleet_size)
+    statistics = game_engine.replay(records, speed)
+    game_engine.print_statistics()
+    return statistics
+
+def run_seeded_session(seed, workload=WORKLOAD, duration=GAME_DURATION, floors=FLOORS, places_per_floor=CARS_PER_FLOOR,
+                       workload_rate=WORKLOAD_RATE, workload_trace_file=WORKLOAD_TRACE_FILE, fleet_size=FLEET_SIZE):
+    # One session of batch_evaluate(), the same seed always gives the same result
+    with contextlib.redirect_stdout(io.StringIO()):
+        game_engine = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, floors, places_per_floor,
+                                 serial_port=None, headless=True, virtual_time=True, fleet_size=fleet_size, seed=seed, workload=workload,
+                                 board_simulation=True, workload_rate=workload_rate, workload_trace_file=workload_trace_file)
+        statistics = game_engine.run(automatic_mode=True, duration=duration)
+    return {
+        "seed": seed,
+        "simulator_fee": statistics["simulator_fee"],
+        "received_fee": statistics["received_fee"],
+        "messages": statistics["received_messages"],
+        "queue_overflows": statistics["queue_overflows"],
+        "rejected_subscriptions": statistics["rejected_subscriptions"],
+        "occupancy_curve": [parked for _, parked, _ in statistics["occupancy_curve"]],
+    }
+
+def summarize_values(values):
+    values = sorted(values)
+    return {
+        "mean": sum(values) / len(values),
+        "minimum": values[0],
+        "median": values[len(values) // 2],
+        "maximum": values[-1],
+    }
+
+def batch_evaluate(seeds, workload=WORKLOAD, duration=GAME_DURATION, summary_file=BATCH_SUMMARY_FILE, workers=None,
+                   workload_rate=WORKLOAD_RATE, workload_trace_file=WORKLOAD_TRACE_FILE, floors=FLOORS,
+                   places_per_floor=CARS_PER_FLOOR, fleet_size=FLEET_SIZE):
+    # Runs one virtual time session per seed across all cores and writes the aggregate to summary_file
+    seeds = list(seeds)
+    if not seeds:
+        raise ValueError("No seeds to evaluate.")
+    if workload not in WORKLOADS:
+        raise ValueError(f"Unknown workload {workload}, choose one of {', '.join(WORKLOADS)}.")
+    session = functools.partial(run_seeded_session, workload=workload, duration=duration, floors=floors,
+                                places_per_floor=places_per_floor, workload_rate=workload_rate,
+                                workload_trace_file=workload_trace_file, fleet_size=fleet_size)
+    start = time.perf_counter()
+    with concurrent_futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        sessions = list(executor.map(session, seeds, chunksize=max(1, len(seeds) // (4 * (os.cpu_count() or 1)))))
+    elapsed = time.perf_counter() - start
+
+    curves = [result["occupancy_curve"] for result in sessions]
+    samples = min(len(curve) for curve in curves)
+    summary = {
+        "workload": workload,
+        "workload_rate": workload_rate,
+        "duration": duration,
+        "floors": floors,
+        "places_per_floor": places_per_floor,
+        "fleet_size": fleet_size,
+        "sessions": len(sessions),
+        "wall_time": elapsed,
+        "summary": {
+            key: summarize_values([result[key] for result in sessions])
+            for key in ("simulator_fee", "received_fee", "messages", "queue_overflows", "rejected_subscriptions")
+        },
+        "mean_occupancy_curve": [sum(curve[sample] for curve in curves) / len(curves) for sample in range(samples)],
+        "results": sessions,
+    }
+    if summary_file is not None:
+        with open(summary_file, 'w') as file:
+            json.dump(summary, file, indent=2)
+    print(f"{len(sessions)} sessions of {duration} s in {elapsed:.2f} s")
+    for key, values in summary["summary"].items():
+        print(f"  {key}: mean {values['mean']:.1f}, min {values['minimum']}, median {values['median']}, max {values['maximum']}")
+    return summary
+
+def board_status(game_engine):
+    # What the overview window shows for one board
+    statistics = game_engine.get_statistics()
+    floor_counts, _ = game_engine.parking_lot.get_occupancy()
+    return {
+        "status": statistics["status"],
+        "floor_counts": floor_counts,
+        "places_per_floor": game_engine.cars_per_floor,
+        "simulator_fee": statistics["simulator_fee"],
+        "received_fee": statistics["received_fee"],
+        "simulator_empty_spaces": statistics["simulator_empty_spaces"],
+        "received_empty_spaces": statistics["received_empty_spaces"],
+        "messages": statistics["received_messages"],
+    }
+
+def board_report(port, statistics):
+    return {
+        "port": port,
+        "simulator_fee": statistics["simulator_fee"],
+        "received_fee": statistics["received_fee"],
+        "fee_match": statistics["simulator_fee"] == statistics["received_fee"],
+        "simulator_empty_spaces": statistics["simulator_empty_spaces"],
+        "received_empty_spaces": statistics["received_empty_spaces"],
+        "empty_spaces_match": statistics["simulator_empty_spaces"] == statistics["received_empty_spaces"],
+        "messages": statistics["received_messages"],
+        "latency": statistics["latency"],
+    }
+
+def make_board_engine(port, asynchronous=False, floors=FLOORS, places_per_floor=CARS_PER_FLOOR, fleet_size=FLEET_SIZE,
+                      baudrate=BAUDRATE, parity=PARITY, rtscts=RTSCTS, xonxoff=XONXOFF, board_simulation=None, seed=None,
+                      workload=WORKLOAD, workload_rate=WORKLOAD_RATE, workload_trace_file=WORKLOAD_TRACE_FILE):
+    # The headless engine of one board in run_boards(), the keyword arguments of run_boards() end up here
+    return GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, floors, places_per_floor,
+                      port, baudrate, parity, rtscts, xonxoff, headless=True, fleet_size=fleet_size, seed=seed, workload=workload,
+                      board_simulation=board_simulation, workload_rate=workload_rate, workload_trace_file=workload_trace_file,
+                      asynchronous=asynchronous)
+
+def run_board_session(index, port, duration=GAME_DURATION, updates=None, **engine_options):
+    # One board of run_boards(), runs in a worker process with its own engine. Its output is kept
+    # off the shared stdout, the parent prints the combined report.
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            game_engine = make_board_engine(port, **engine_options)
+        except SystemExit:
+            return {"port": port, "error": (output.getvalue().splitlines() or ["could not open the serial port"])[0]}
+        finished = threading.Event()
+
+        def publish_updates():
+            while not finished.wait(OVERVIEW_INTERVAL):
+                updates.put((index, board_status(game_engine)))
+
+        if updates is not None:
+            threading.Thread(target=publish_updates, daemon=True).start()
+        statistics = game_engine.run(automatic_mode=True, duration=duration)
+    finished.set()
+    if updates is not None:
+        updates.put((index, board_status(game_engine)))
+    return board_report(port, statistics)
+
+class BoardOverview:
+    # One tile per board with its floors, fees and empty spaces, fed from the worker processes
+    def __init__(self, ports, screen_width=SCREEN_WIDTH, screen_height=SCREEN_HEIGHT):
+        self.ports = ports
+        self.columns = math.ceil(math.sqrt(len(ports)))
+        self.rows = math.ceil(len(ports) / self.columns)
+        self.tile_width = screen_width // self.columns
+        self.tile_height = screen_height // self.rows
+        self.statuses = [None] * len(ports)
+        pygame.init()
+        self.screen = pygame.display.set_mode((screen_width, screen_height))
+        pygame.display.set_caption(f"{SIMULATOR_CAPTION} - {len(ports)} boards")
+        self.font = pygame.font.SysFont(None, 20)
+        self.gray_color = (128, 128, 148)
+        self.white_color = (255, 255, 255)
+        self.red_color = (255, 0, 0)
+        self.green_color = (0, 255, 0)
+
+    def update(self, index, status):
+        self.statuses[index] = status
+
+    def __draw_text(self, text, color, position):
+        self.screen.blit(self.font.render(text, True, color), position)
+
+    def __draw_tile(self, index, port, status):
+        row, column = divmod(index, self.columns)
+        tile = pygame.Rect(column * self.tile_width, row * self.tile_height, self.tile_width, self.tile_height).inflate(-6, -6)
+        pygame.draw.rect(self.screen, self.gray_color, tile)
+        self.__draw_text(str(port), self.white_color, (tile.x + 6, tile.y + 6))
+        if status is None:
+            self.__draw_text("WAITING", self.white_color, (tile.x + 6, tile.y + 26))
+            return
+
+        # Occupancy bar per floor
+        bar_width = max(1, (tile.width - 12) // max(1, len(status["floor_counts"])))
+        bar_height = tile.height // 2
+        for floor, cars in enumerate(status["floor_counts"]):
+            bar = pygame.Rect(tile.x + 6 + floor * bar_width, tile.y + 26, bar_width - 4, bar_height)
+            pygame.draw.rect(self.screen, self.white_color, bar, 1)
+            filled = bar_height * cars // status["places_per_floor"]
+            pygame.draw.rect(self.screen, self.green_color, pygame.Rect(bar.x, bar.bottom - filled, bar.width, filled))
+
+        y = tile.y + 32 + bar_height
+        fee_color = self.white_color if status["simulator_fee"] == status["received_fee"] else self.red_color
+        self.__draw_text(f"Fee {status['simulator_fee']} / {status['received_fee']}", fee_color, (tile.x + 6, y))
+        empty_color = self.white_color if status["simulator_empty_spaces"] == status["received_empty_spaces"] else self.red_color
+        self.__draw_text(f"Empty {status['simulator_empty_spaces']} / {status['received_empty_spaces']}", empty_color, (tile.x + 6, y + 20))
+        self.__draw_text(f"Messages {status['messages']}", self.white_color, (tile.x + 6, y + 40))
+        if status["status"] == 2:
+            self.__draw_text("FINISHED", self.red_color, (tile.right - 80, tile.y + 6))
+
+    def draw(self):
+        self.screen.fill((0, 0, 0))
+        for index, port in enumerate(self.ports):
+            self.__draw_tile(index, port, self.statuses[index])
+        pygame.display.flip()
+
+    def close(self):
+        pygame.quit()
+
+def print_board_reports(reports):
+    print(f"{'Board':<16}{'Fee sim/recv':>18}{'Empty sim/recv':>16}{'Messages':>10}  Latency p50/p99 ms")
+    for report in reports:
+        if "error" in report:
+            print(f"{str(report['port']):<16}  {report['error']}")
+            continue
+        fees = f"{report['simulator_fee']}/{report['received_fee']}{'' if report['fee_match'] else ' !'}"
+        empty = f"{report['simulator_empty_spaces']}/{report['received_empty_spaces']}{'' if report['empty_spaces_match'] else ' !'}"
+        latency = "  ".join(f"{command} {values['percentiles'][50]:.1f}/{values['percentiles'][99]:.1f}"
+                            for command, values in report["latency"].items())
+        print(f"{str(report['port']):<16}{fees:>18}{empty:>16}{report['messages']:>10}  {latency}")
+
+async def run_boards_async(ports, duration=GAME_DURATION, overview=False, **engine_options):
+    # All boards on one event loop in this process. What the engines print is kept off stdout,
+    # as in the worker processes, run_boards() prints the combined report.
+    game_engines = []
+    reports = [None] * len(ports)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index, port in enumerate(ports):
+            output = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(output):
+                    game_engines.append(make_board_engine(port, asynchronous=True, **engine_options))
+            except SystemExit:
+                game_engines.append(None)
+                reports[index] = {"port": port, "error": (output.getvalue().splitlines() or ["could not open the serial port"])[0]}
+        sessions = asyncio.gather(*(game_engine.run_async(True, duration) for game_engine in game_engines if game_engine is not None))
+
+        board_overview = BoardOverview(ports) if overview else None
+        while board_overview is not None and not sessions.done():
+            for index, game_engine in enumerate(game_engines):
+                if game_engine is not None:
+                    board_overview.update(index, board_status(game_engine))
+            board_overview.draw()
+            if any(event.type == pygame.QUIT for event in pygame.event.get()):
+                board_overview.close()
+                board_overview = None
+                break
+            await asyncio.sleep(OVERVIEW_INTERVAL)
+
+        statistics = iter(await sessions)
+    for index, game_engine in enumerate(game_engines):
+        if game_engine is not None:
+            reports[index] = board_report(ports[index], next(statistics))
+    if board_overview is not None:
+        board_overview.close()
+    return reports
+
+def run_boards(ports, duration=GAME_DURATION, overview=False, report_file=None, asynchronous=ASYNC_CORE, **engine_options):
+    # Every board gets its own process so a slow or stuck board cannot hold up the others,
+    # or with asynchronous all boards share one event loop in this process.
+    # engine_options are the lot, serial port and workload settings of make_board_engine().
+    if asynchronous:
+        reports = asyncio.run(run_boards_async(ports, duration, overview, **engine_options))
+        print_board_reports(reports)
+        if report_file is not None:
+            with open(report_file, 'w') as file:
+                json.dump(reports, file, indent=2)
+        return reports
+    updates = multiprocessing.Manager().Queue() if overview else None
+    board_overview = BoardOverview(ports) if overview else None
+    with concurrent_futures.ProcessPoolExecutor(max_workers=len(ports)) as executor:
+        futures = [executor.submit(run_board_session, index, port, duration, updates, **engine_options)
+                   for index, port in enumerate(ports)]
+        while board_overview is not None and not all(future.done() for future in futures):
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
-                    self.__stop()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        self.__stop()
+                    board_overview.close()
+                    board_overview = None
+                    break
+            else:
+                while not updates.empty():
+                    board_overview.update(*updates.get_nowait())
+                board_overview.draw()
+                time.sleep(1 / DRAWER_FPS)
+        reports = []
+        for port, future in zip(ports, futures):
+            try:
+                reports.append(future.result())
+            except Exception as e:
+                reports.append({"port": port, "error": str(e)})
+    if board_overview is not None:
+        while not updates.empty():
+            board_overview.update(*updates.get_nowait())
+        board_overview.draw()
+    print_board_reports(reports)
+    if report_file is not None:
+        with open(report_file, 'w') as file:
+            json.dump(reports, file, indent=2)
+    if board_overview is not None:
+        board_overview.close()
+    return reports
+
+def parse_arguments(argv=None):
+    # The constants at the top of the file are the defaults
+    parser = argparse.ArgumentParser(description=SIMULATOR_CAPTION)
+    session = parser.add_argument_group("session")
+    session.add_argument("--duration", type=float, default=GAME_DURATION, help="session length in seconds")
+    session.add_argument("--floors", type=int, default=FLOORS)
+    session.add_argument("--places", type=int, default=CARS_PER_FLOOR, help="places per floor")
+    session.add_argument("--fleet-size", type=int, default=FLEET_SIZE, help="car IDs in play, 5 per 2 places by default")
+    session.add_argument("--seed", type=int, default=None)
+    session.add_argument("--workload", choices=list(WORKLOADS), default=WORKLOAD)
+    session.add_argument("--workload-rate", type=float, default=WORKLOAD_RATE, help="events per second")
+    session.add_argument("--workload-trace", default=WORKLOAD_TRACE_FILE, metavar="FILE")
+    session.add_argument("--mode", choices=("automatic", "manual"), default=None, help="skip the mode selection screen")
+    session.add_argument("--headless", action="store_true", default=HEADLESS, help="no display")
+    session.add_argument("--board-simulation", action="store_true", default=BOARD_SIMULATION, help="simulate the board")
+    session.add_argument("--virtual-time", action="store_true", default=VIRTUAL_TIME,
+                         help="run the simulated board on a virtual clock, needs --headless and --board-simulation")
+    session.add_argument("--async", dest="asynchronous", action="store_true", default=ASYNC_CORE, help="run on an asyncio event loop")
+    session.add_argument("--debug", action="store_true", default=cengParkModel.DEBUG)
+    port = parser.add_argument_group("serial port")
+    port.add_argument("--port", default=SERIAL_PORT)
+    port.add_argument("--baudrate", type=int, default=BAUDRATE)
+    port.add_argument("--parity", choices=("N", "E", "O", "M", "S"), default=PARITY)
+    port.add_argument("--rtscts", action="store_true", default=RTSCTS)
+    port.add_argument("--xonxoff", action="store_true", default=XONXOFF)
+    output = parser.add_argument_group("recording and monitoring")
+    output.add_argument("--record", default=RECORD_FILE, metavar="FILE", help="record the session")
+    output.add_argument("--replay", default=REPLAY_FILE, metavar="FILE", help="replay a recorded session instead of running one")
+    output.add_argument("--replay-speed", type=float, default=REPLAY_SPEED, help="as fast as possible by default")
+    output.add_argument("--journal", default=JOURNAL_FILE, metavar="FILE", help="journal every state transition")
+    output.add_argument("--resume", action="store_true", default=RESUME, help="continue the session in the journal")
+    output.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="serve Prometheus metrics, 0 picks a free port")
+    output.add_argument("--metrics-host", default=METRICS_HOST)
+    output.add_argument("--profile", action="store_true", default=PROFILE,
+                        help=f"write spans, lock waits and stack samples to {PROFILE_OUTPUT}.collapsed and .txt")
+    runs = parser.add_argument_group("several sessions")
+    runs.add_argument("--boards", nargs="+", default=BOARD_PORTS, metavar="PORT", help="grade one board per port")
+    runs.add_argument("--board-report", default=BOARD_REPORT_FILE, metavar="FILE")
+    runs.add_argument("--batch", type=int, default=None if BATCH_SEEDS is None else len(BATCH_SEEDS), metavar="SESSIONS",
+                      help="seeded virtual time sessions on the simulated board, seeds from --seed or 0")
+    runs.add_argument("--batch-summary", default=BATCH_SUMMARY_FILE, metavar="FILE")
+    return parser, parser.parse_args(argv)
+
+# Options the runs of several sessions do not take, as (option, destination)
+SINGLE_SESSION_OPTIONS = (("--mode", "mode"), ("--record", "record"), ("--journal", "journal"), ("--resume", "resume"),
+                          ("--metrics-port", "metrics_port"), ("--profile", "profile"))
+SERIAL_PORT_OPTIONS = (("--port", "port"), ("--baudrate", "baudrate"), ("--parity", "parity"), ("--rtscts", "rtscts"),
+                       ("--xonxoff", "xonxoff"))
+
+def check_several_sessions(parser, arguments):
+    # Rejects the options given on the command line that --boards or --batch would otherwise ignore
+    unsupported = SINGLE_SESSION_OPTIONS
+    if arguments.boards:
+        name = "--boards"
+        unsupported += (("--virtual-time", "virtual_time"), ("--batch", "batch"))
+    else:
+        # Batch sessions run on the simulated board in virtual time, in worker processes
+        name = "--batch"
+        unsupported += SERIAL_PORT_OPTIONS + (("--async", "asynchronous"),)
+    given = [option for option, destination in unsupported if getattr(arguments, destination) != parser.get_default(destination)]
+    if given:
+        parser.error(f"{name} cannot be combined with {', '.join(given)}.")
+    fleet_size = arguments.fleet_size if arguments.fleet_size is not None else 5 * arguments.floors * arguments.places // 2
+    try:
+        select_protocol(arguments.floors, arguments.places, fleet_size)
+        make_workload(arguments.workload, arguments.workload_rate, arguments.workload_trace).check_lot(arguments.floors,
+                                                                                                      arguments.places, fleet_size)
+    except ValueError as e:
+        parser.error(str(e))
+
+def main(argv=None):
+    parser, arguments = parse_arguments(argv)
+    cengParkModel.DEBUG = arguments.debug
+    if arguments.replay is not None:
+        replay_session(arguments.replay, arguments.replay_speed)
+        return
+    if arguments.boards or arguments.batch is not None:
+        check_several_sessions(parser, arguments)
+    if arguments.boards:
+        run_boards(arguments.boards, arguments.duration, not arguments.headless, arguments.board_report, arguments.asynchronous,
+                   floors=arguments.floors, places_per_floor=arguments.places, fleet_size=arguments.fleet_size,
+                   baudrate=arguments.baudrate, parity=arguments.parity, rtscts=arguments.rtscts, xonxoff=arguments.xonxoff,
+                   board_simulation=arguments.board_simulation, seed=arguments.seed, workload=arguments.workload,
+                   workload_rate=arguments.workload_rate, workload_trace_file=arguments.workload_trace)
+        return
+    if arguments.batch is not None:
+        first_seed = arguments.seed if arguments.seed is not None else 0
+        batch_evaluate(range(first_seed, first_seed + arguments.batch), arguments.workload, arguments.duration,
+                       arguments.batch_summary, workload_rate=arguments.workload_rate, workload_trace_file=arguments.workload_trace,
+                       floors=arguments.floors, places_per_floor=arguments.places, fleet_size=arguments.fleet_size)
+        return
+    try:
+        game_engine = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, arguments.floors, arguments.places,
+                                 arguments.port, arguments.baudrate, arguments.parity, arguments.rtscts, arguments.xonxoff,
+                                 arguments.headless, arguments.virtual_time, arguments.record, arguments.fleet_size, arguments.seed,
+                                 arguments.workload, arguments.board_simulation, arguments.workload_rate, arguments.workload_trace,
+                                 arguments.asynchronous, arguments.metrics_port, arguments.profile, arguments.journal,
+                                 arguments.resume, arguments.metrics_host)
+    except ValueError as e:
+        parser.error(str(e))
+    automatic_mode = None if arguments.mode is None else arguments.mode == "automatic"
+    if arguments.asynchronous:
+        asyncio.run(game_engine.run_async(automatic_mode, arguments.duration))
+    else:
+        game_engine.run(automatic_mode, arguments.duration)
 
 if __name__ == "__main__":
-    game_engine = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, FLOORS, CARS_PER_FLOOR
-                             , SERIAL_PORT, BAUDRATE, PARITY, RTSCTS, XONXOFF)
-    game_engine.run()
+    main()
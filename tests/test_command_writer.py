@@ -0,0 +1,47 @@
+import threading
+
+from cengParkSimulator import CommandWriter
+
+
+class HeldPort:
+    # Holds every write() until released, like a port stopped by flow control
+    def __init__(self):
+        self.released = threading.Event()
+        self.writing = threading.Event()
+        self.data = b''
+
+    def write(self, data):
+        self.writing.set()
+        self.released.wait()
+        self.data += data
+
+
+def test_submit_blocks_on_a_full_queue():
+    port = HeldPort()
+    writer = CommandWriter(port, size=4, high_water_mark=3)
+    writer.submit(b'PRK001')
+    assert port.writing.wait(5)
+    for car_id in range(2, 6):
+        writer.submit(b'PRK%03d' % car_id)
+    assert writer.congested()
+
+    blocked = threading.Thread(target=writer.submit, args=(b'PRK006',))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive() and len(writer.frames) == 4
+    port.released.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    writer.close()
+    assert port.data == b''.join(b'PRK%03d' % car_id for car_id in range(1, 7))
+    statistics = writer.get_statistics()
+    assert statistics["max_depth"] == 4 and statistics["full_waits"] == 1 and statistics["dropped"] == 0
+
+
+def test_submit_after_close_drops():
+    port = HeldPort()
+    port.released.set()
+    writer = CommandWriter(port)
+    writer.close()
+    writer.submit(b'PRK001')
+    assert port.data == b'' and writer.get_statistics()["dropped"] == 1
@@ -0,0 +1,64 @@
+import pytest
+
+from cengParkModel import EXTENDED_PROTOCOL, FrameParser
+
+STREAM = b'$EMP40#$SPC042B01#$FEE042125#$RES04250#'
+FRAMES = [b'EMP40', b'SPC042B01', b'FEE042125', b'RES04250']
+
+
+def test_whole_frames():
+    parser = FrameParser()
+    assert parser.feed(STREAM) == FRAMES
+    assert parser.uncomplete_count == 0
+    assert parser.invalid_count == 0
+
+
+@pytest.mark.parametrize("split", range(1, len(STREAM)))
+def test_frame_split_across_chunks(split):
+    parser = FrameParser()
+    assert parser.feed(STREAM[:split]) + parser.feed(STREAM[split:]) == FRAMES
+    assert parser.uncomplete_count == 0
+
+
+def test_one_byte_at_a_time():
+    parser = FrameParser()
+    frames = []
+    for position in range(len(STREAM)):
+        frames += parser.feed(STREAM[position:position + 1])
+    assert frames == FRAMES
+
+
+def test_noise_between_frames():
+    parser = FrameParser()
+    assert parser.feed(b'\x00noise$EMP40#EMP99#\r\n$FEE042125#') == [b'EMP40', b'FEE042125']
+    assert parser.invalid_count == 0
+
+
+def test_frame_cut_off_by_the_next_one():
+    parser = FrameParser()
+    assert parser.feed(b'$SPC042$EMP40#') == [b'EMP40']
+    assert parser.uncomplete_count == 1
+    assert parser.rejected[b'incomplete'] == 1
+
+
+def test_frame_cut_off_across_chunks():
+    parser = FrameParser()
+    assert parser.feed(b'$SPC042') == []
+    assert parser.feed(b'B$EMP40#') == [b'EMP40']
+    assert parser.uncomplete_count == 1
+
+
+def test_invalid_frames():
+    parser = FrameParser()
+    assert parser.feed(b'$EMP4#$XYZ123#$EMP40#') == [b'EMP40']
+    assert parser.invalid_count == 2
+    assert parser.rejected[b'EMP'] == 1
+    assert parser.rejected[b'unknown'] == 1
+
+
+def test_extended_frames():
+    parser = FrameParser(EXTENDED_PROTOCOL)
+    assert parser.feed(b'$SPC01999B') == []
+    assert parser.feed(b'D120#$EMP003600#') == [b'SPC01999BD120', b'EMP003600']
+    assert parser.feed(b'$SPC042B01#') == []
+    assert parser.invalid_count == 1
@@ -0,0 +1,100 @@
+import pytest
+
+from cengParkModel import (STANDARD_PROTOCOL, EXTENDED_PROTOCOL, ProtocolCodec, select_protocol, EmptySpaces, ParkingSpace,
+                           Fee, Reservation, CarCommand, SubscriptionCommand)
+
+
+@pytest.fixture
+def codec():
+    return ProtocolCodec(STANDARD_PROTOCOL, 100, 4, 10)
+
+
+@pytest.fixture
+def extended_codec():
+    return ProtocolCodec(EXTENDED_PROTOCOL, 2000, 30, 120)
+
+
+def test_select_protocol():
+    assert select_protocol(4, 10, 100) is STANDARD_PROTOCOL
+    assert select_protocol(30, 120, 2000) is EXTENDED_PROTOCOL
+    with pytest.raises(ValueError):
+        select_protocol(4, 10, 10 ** 6)
+
+
+def test_standard_messages(codec):
+    assert codec.empty_message(7) == b'EMP07'
+    assert codec.parking_space_message(42, 1, 0) == b'SPC042B01'
+    assert codec.fee_message(42, 125) == b'FEE042125'
+    assert codec.reservation_message(42, 50) == b'RES04250'
+    assert codec.car_frame('PRK', 5) == b'$PRK005#'
+    assert codec.car_command('EXT', 99) == b'EXT099'
+    assert codec.subscription_command(3, 3, 9) == b'SUB003D10'
+
+
+def test_standard_round_trip(codec):
+    assert codec.decode(codec.empty_message(40)) == EmptySpaces(40)
+    assert codec.decode(codec.parking_space_message(99, 3, 9)) == ParkingSpace(99, 3, 9)
+    assert codec.decode(codec.fee_message(0, 999)) == Fee(0, 999)
+    assert codec.decode(codec.reservation_message(17, 99)) == Reservation(17, 99)
+
+
+def test_extended_round_trip(extended_codec):
+    assert extended_codec.parking_space_message(1999, 29, 119) == b'SPC01999BD120'
+    assert extended_codec.decode(extended_codec.empty_message(3600)) == EmptySpaces(3600)
+    assert extended_codec.decode(extended_codec.parking_space_message(1999, 29, 119)) == ParkingSpace(1999, 29, 119)
+    assert extended_codec.decode(extended_codec.fee_message(1500, 123456)) == Fee(1500, 123456)
+    assert extended_codec.decode(extended_codec.reservation_message(1500, 20)) == Reservation(1500, 20)
+
+
+def test_values_outside_the_tables(codec):
+    # Larger values than the tables hold are formatted when they are sent
+    assert codec.parking_space_message(500, 20, 50) == b'SPC500U51'
+    assert codec.decode(codec.parking_space_message(500, 20, 50)) == ParkingSpace(500, 20, 50)
+    assert codec.car_frame('PRK', 500) == b'$PRK500#'
+
+
+def test_decode_memoryview(codec):
+    assert codec.decode(memoryview(b'xFEE042125')[1:]) == Fee(42, 125)
+    assert codec.decode(memoryview(b'SPC500U51')) == ParkingSpace(500, 20, 50)
+    assert codec.decode(memoryview(b'SPC042B00')) is None
+
+
+@pytest.mark.parametrize("message", [
+    b'',
+    b'EMP',
+    b'EMP7',
+    b'EMP007',
+    b'XMP07',
+    b'EMX07',
+    b'EM007',
+    b'EMP0x',
+    b'EMP-1',
+    b'EMP 7',
+    b'SPC042b01',
+    b'SPC042[01',
+    b'SPC042B00',
+    b'SPC04xB01',
+    b'FEE04212a',
+    b'FEE042+25',
+    b'RES042\xff0',
+])
+def test_rejects_bad_messages(codec, message):
+    assert codec.decode(message) is None
+
+
+def test_decode_batch(codec):
+    assert codec.decode_batch([b'EMP07', b'EMPxx', b'FEE042125', b'']) == [EmptySpaces(7), None, Fee(42, 125), None]
+
+
+def test_decode_commands(codec):
+    assert codec.decode_command(b'PRK042') == CarCommand('PRK', 42)
+    assert codec.decode_command(b'EXT000') == CarCommand('EXT', 0)
+    assert codec.decode_command(b'SUB003D10') == SubscriptionCommand(3, 3, 9)
+    assert codec.decode_command(b'GO') == CarCommand('GO', -1)
+    assert codec.decode_command(b'END') == CarCommand('END', -1)
+    assert codec.parse_subscription(codec.subscription_command(7, 2, 4)) == SubscriptionCommand(7, 2, 4)
+
+
+@pytest.mark.parametrize("command", [b'PRK04x', b'EXT 42', b'SUB003D1', b'SUB003d10', b'SUB003D00', b'FOO042'])
+def test_rejects_bad_commands(codec, command):
+    assert codec.decode_command(command) is None
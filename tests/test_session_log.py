@@ -0,0 +1,80 @@
+import struct
+
+import pytest
+
+from cengParkModel import EXTENDED_PROTOCOL, SessionRecorder, read_session_log, make_workload
+from cengParkSimulator import GameEngine, replay_session, SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION
+
+RECORDS = [
+    (SessionRecorder.OUTGOING, 0.5, b'PRK001'),
+    (SessionRecorder.INCOMING, 0.75, b'SPC001A01'),
+    (SessionRecorder.INCOMING, 0.75, b'EMP39'),
+    (SessionRecorder.OUTGOING, 10.25, b'EXT001'),
+    (SessionRecorder.INCOMING, 10.5, b'FEE001010'),
+]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "session.log")
+    recorder = SessionRecorder(path, 4, 10, 100)
+    for direction, timestamp, frame in RECORDS:
+        recorder.record(direction, timestamp, frame)
+    recorder.close()
+    assert read_session_log(path) == (4, 10, 100, RECORDS)
+
+
+def test_record_cut_off(tmp_path):
+    path = str(tmp_path / "session.log")
+    recorder = SessionRecorder(path, 4, 10, 100)
+    for direction, timestamp, frame in RECORDS:
+        recorder.record(direction, timestamp, frame)
+    recorder.close()
+    with open(path, 'ab') as log:
+        log.write(SessionRecorder.RECORD.pack(11.0, SessionRecorder.OUTGOING, 6)[:-1])
+    assert read_session_log(path) == (4, 10, 100, RECORDS)
+
+
+def test_old_format(tmp_path):
+    # The first format had no fleet size in its header, its records would be read from the wrong offset
+    path = tmp_path / "session.log"
+    path.write_bytes(struct.pack('<8sHH', b'CENGPARK', 4, 10) + SessionRecorder.RECORD.pack(0.5, SessionRecorder.OUTGOING, 6)
+                     + b'PRK001')
+    with pytest.raises(ValueError, match="older format"):
+        read_session_log(str(path))
+
+
+def test_not_a_session(tmp_path):
+    path = tmp_path / "session.log"
+    path.write_bytes(b'CENGJRNL' + bytes(8))
+    with pytest.raises(ValueError):
+        read_session_log(str(path))
+
+
+@pytest.mark.parametrize("fleet_size", [None, 2000])
+def test_replay_matches_the_recorded_session(tmp_path, fleet_size):
+    # 2000 cars need the extended protocol's car IDs, the replay has to pick it from the log
+    path = str(tmp_path / "session.log")
+    engine = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, 4, 10, serial_port=None, headless=True,
+                        virtual_time=True, fleet_size=fleet_size, seed=5, board_simulation=True, record_file=path)
+    assert (engine.protocol is EXTENDED_PROTOCOL) == (fleet_size == 2000)
+    recorded = engine.run(automatic_mode=True, duration=30)
+    assert read_session_log(path)[:3] == (4, 10, engine.fleet_size)
+    replayed = replay_session(path)
+    assert replayed["received_messages"] == recorded["received_messages"] > 0
+    for key in ("simulator_fee", "received_fee", "simulator_empty_spaces", "received_empty_spaces", "parked_cars"):
+        assert replayed[key] == recorded[key]
+
+
+def test_trace_workload_needs_the_recorded_lot(tmp_path):
+    path = str(tmp_path / "session.log")
+    engine = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, 4, 10, serial_port=None, headless=True,
+                        virtual_time=True, fleet_size=2000, seed=5, board_simulation=True, record_file=path)
+    engine.run(automatic_mode=True, duration=30)
+    workload = make_workload('trace', trace_file=path)
+    assert workload.commands
+    traced = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, 4, 10, serial_port=None, headless=True,
+                        virtual_time=True, fleet_size=2000, seed=5, board_simulation=True, workload=workload)
+    assert traced.run(automatic_mode=True, duration=30)["received_messages"] > 0
+    with pytest.raises(ValueError):
+        GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, 4, 10, serial_port=None, headless=True,
+                   virtual_time=True, seed=5, board_simulation=True, workload=workload)
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from cengParkModel import Car, CarRegistry, StateJournal, read_journal
+from cengParkSimulator import GameEngine, SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION
+
+
+def write_journal(path, checkpoint_records=1000):
+    # Car 1 parks and leaves, car 2 queues while waiting for a subscription
+    journal = StateJournal(path, 4, 10, checkpoint_records=checkpoint_records)
+    first = Car(1, None, False)
+    second = Car(2, None, True)
+    first.state = CarRegistry.QUEUED
+    journal.record(StateJournal.QUEUED, first, None, None, None, 0, 0, False)
+    first.state = CarRegistry.PARKED
+    journal.record(StateJournal.PARKED, first, None, None, (0, 3, 12.5), 0, 0, False)
+    journal.record(StateJournal.SUBSCRIPTION_REQUESTED, second, {"floor": 1, "spot": 2}, None, None, 0, 0, True)
+    second.state = CarRegistry.QUEUED
+    journal.record(StateJournal.QUEUED, second, {"floor": 1, "spot": 2}, None, None, 0, 0, False)
+    first.state = CarRegistry.IDLE
+    journal.record(StateJournal.FEE_SETTLED, first, None, None, None, 30, 28, False)
+    journal.close()
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "state.journal")
+    write_journal(path)
+    floors, places_per_floor, cars, fees, end = read_journal(path)
+    assert (floors, places_per_floor) == (4, 10)
+    assert list(cars) == [2, 1]
+    assert cars[2][:10] == (StateJournal.QUEUED, CarRegistry.QUEUED, StateJournal.SUBSCRIBED, 2, 1, 2, -1, -1, -1, -1)
+    assert cars[1][:2] == (StateJournal.FEE_SETTLED, CarRegistry.IDLE)
+    assert fees == (30, 28)
+    assert end == os.path.getsize(path)
+
+
+def test_not_a_journal(tmp_path):
+    path = tmp_path / "state.journal"
+    path.write_bytes(b'CENGPARK' + bytes(4))
+    with pytest.raises(ValueError):
+        read_journal(str(path))
+
+
+@pytest.mark.parametrize("tail", [
+    # A record cut off by a crash
+    StateJournal.RECORD.pack(StateJournal.PARKED, CarRegistry.PARKED, 0, 3, -1, -1, -1, -1, 1, 1, 5.0, 40, 38)[:-5],
+    # Zeros left behind by a crash, and plain garbage
+    bytes(2 * StateJournal.RECORD.size),
+    b'\xff' * (3 * StateJournal.RECORD.size + 7),
+    # A checkpoint cut off before all of its records
+    StateJournal.RECORD.pack(StateJournal.CHECKPOINT, 0, 0, 5, -1, -1, -1, -1, -1, -1, 0.0, 40, 38)
+    + StateJournal.RECORD.pack(StateJournal.PARKED, CarRegistry.PARKED, 0, 3, -1, -1, -1, -1, 1, 1, 5.0, 40, 38),
+])
+def test_damaged_tail(tmp_path, tail):
+    path = str(tmp_path / "state.journal")
+    write_journal(path)
+    expected = read_journal(path)
+    with open(path, 'ab') as journal:
+        journal.write(tail)
+    assert read_journal(path) == expected
+
+
+def test_checkpoint(tmp_path):
+    # Checkpoints after every batch leave out the idle cars without subscriptions, here car 1
+    path = str(tmp_path / "state.journal")
+    write_journal(path, checkpoint_records=1)
+    _, _, cars, fees, end = read_journal(path)
+    assert list(cars) == [2]
+    assert fees == (30, 28)
+    assert end == os.path.getsize(path)
+
+
+def session_state(engine):
+    lot = sorted((car.car_id, floor, spot, round(entry_time, 6))
+                 for floor in range(engine.floors) for spot in range(engine.cars_per_floor)
+                 for car, entry_time in [engine.parking_lot.read_spot(floor, spot) or (None, None)] if car is not None)
+    return {
+        "lot": lot,
+        "queue": [car.car_id for car in engine.car_queue.get_queue()],
+        "subscriptions": sorted((car_id, place["floor"], place["spot"]) for car_id, place in engine.subscribed_cars.items()),
+        "waiting": sorted((car_id, place["floor"], place["spot"]) for car_id, place in engine.cars_waiting_to_subscribe.items()),
+        "states": [engine.fleet.count(state) for state in range(4)],
+        "idle_subscribed": len(engine.fleet.idle_subscribed),
+        "subscribed": sorted(car.car_id for car in engine.fleet.cars.values() if car.subscribed),
+        "fees": (engine.statistics.simulator_fee, engine.statistics.calculated_fee),
+    }
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "state.journal")
+    engine = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, 4, 10, serial_port=None, headless=True,
+                        virtual_time=True, seed=3, board_simulation=True, journal_file=path)
+    engine.run(automatic_mode=True, duration=60)
+    expected = session_state(engine)
+    assert expected["lot"] and expected["fees"][0] > 0
+    size = os.path.getsize(path)
+    with open(path, 'ab') as journal:
+        journal.write(bytes(StateJournal.RECORD.size + 3))
+
+    resumed = GameEngine(SCREEN_WIDTH, SCREEN_HEIGHT, DISPLAY_WIDTH, SIMULATOR_CAPTION, 4, 10, serial_port=None, headless=True,
+                         board_simulation=False, journal_file=path, resume=True)
+    resumed.journal.close()
+    assert session_state(resumed) == expected
+    # The damaged tail is cut off and the resumed journal starts with a checkpoint of the recovered state
+    _, _, cars, fees, end = read_journal(path)
+    assert os.path.getsize(path) == end > size
+    assert fees == expected["fees"]
+    assert {car_id for car_id, _, _, _ in expected["lot"]} <= cars.keys()